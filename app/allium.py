@@ -0,0 +1,168 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from db.metrics import metrics
+from dotenv import load_dotenv
+import os
+import requests
+from requests.adapters import HTTPAdapter
+import threading
+import time
+
+load_dotenv()
+
+ALLIUM_API_KEY = os.getenv('ALLIUM_API_KEY')
+# latest balance records returned per query run; a sync whose new records fill it fails
+ALLIUM_RESULT_LIMIT = int(os.getenv('ALLIUM_RESULT_LIMIT', 10000))
+ALLIUM_POOL_SIZE = int(os.getenv('ALLIUM_POOL_SIZE', 10))
+
+allium_query_run_api_url = 'https://api.allium.so/api/v1/explorer/queries/UWHFUe3BPTFpd7EDVIiI/run-async'
+allium_status_api_url = 'https://api.allium.so/api/v1/explorer/query-runs/{run_id}/status'
+allium_results_api_url = 'https://api.allium.so/api/v1/explorer/query-runs/{run_id}/results?f=json'
+
+pending_statuses = ['created', 'queued', 'running']
+
+
+class QueryCancelled(Exception):
+    pass
+
+
+class _QueryRun:
+    """
+    One Allium query run shared by every caller asking for the same wallet.
+    """
+
+    def __init__(self):
+        self.future = None
+        self.waiters = 0
+        self.cancelled = threading.Event()
+
+
+class AlliumClient:
+    """
+    Pooled Allium client. Requests go through one keep-alive Session, status polling
+    backs off exponentially from an interval adapted to recent query durations, and
+    concurrent lookups of the same wallet share a single query run. Polling stops once
+    every caller waiting on a run has cancelled.
+    """
+
+    def __init__(self, api_key=ALLIUM_API_KEY, pool_size=ALLIUM_POOL_SIZE, min_poll=0.25,
+                 max_poll=5, backoff=1.5, timeout=1200):
+        self.headers = {'X-API-Key': api_key}
+        self.min_poll = min_poll
+        self.max_poll = max_poll
+        self.backoff = backoff
+        self.timeout = timeout
+        # exponentially weighted average of query run durations, seeds the first poll
+        self.avg_duration = None
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.executor = ThreadPoolExecutor(max_workers=pool_size)
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    def post_query(self, wallet_address):
+        """
+        Runs saved SQL query to last ALLIUM_RESULT_LIMIT balance records from wallet.
+
+        Returns:
+        Str: Run_id of the query that was run
+        """
+        params = {'address': wallet_address}
+        run_config = {'limit': str(ALLIUM_RESULT_LIMIT)}
+
+        resp = self.session.post(allium_query_run_api_url, json={
+            'parameters': params, 'run_config': run_config}, headers=self.headers)
+        return resp.json()['run_id']
+
+    def wait_for_status(self, run_id, cancelled):
+        """
+        Poll the query status until it is final. The first check waits half the recent
+        average run time, later checks back off exponentially between min_poll and max_poll.
+
+        Parameters:
+        - run_id (str): Run_id returned by post_query.
+        - cancelled (threading.Event): Stops polling when set.
+
+        Returns:
+        Str: Final status of the query.
+        """
+        formatted_status_url = allium_status_api_url.format(run_id=run_id)
+        start = time.monotonic()
+        interval = self.min_poll
+        if self.avg_duration:
+            interval = min(self.max_poll, max(
+                self.min_poll, self.avg_duration / 2))
+
+        while time.monotonic() < start + self.timeout:
+            if cancelled.wait(interval):
+                raise QueryCancelled(f"Query run {run_id} cancelled")
+
+            status = self.session.get(
+                formatted_status_url, headers=self.headers).json()
+            if status not in pending_statuses:
+                duration = time.monotonic() - start
+                self.avg_duration = duration if self.avg_duration is None \
+                    else 0.8 * self.avg_duration + 0.2 * duration
+                return status
+            interval = min(self.max_poll, interval * self.backoff)
+
+        raise TimeoutError(
+            f"Query run {run_id} timed out before reaching final status")
+
+    def get_results(self, run_id):
+        formatted_results_url = allium_results_api_url.format(run_id=run_id)
+        return self.session.get(formatted_results_url, headers=self.headers).json()
+
+    def _execute(self, wallet_address, run):
+        try:
+            with metrics.span('allium_post'):
+                run_id = self.post_query(wallet_address)
+            with metrics.span('allium_poll'):
+                self.wait_for_status(run_id, run.cancelled)
+            with metrics.span('allium_fetch'):
+                return self.get_results(run_id)['data']
+        finally:
+            with self.lock:
+                if self.in_flight.get(wallet_address) is run:
+                    del self.in_flight[wallet_address]
+
+    def fetch_wallet(self, wallet_address, cancel=None):
+        """
+        Return a wallet's latest ALLIUM_RESULT_LIMIT balance records. Callers asking for
+        the same wallet while a run is in flight wait on that run instead of starting their own.
+
+        Parameters:
+        - wallet_address (str): Wallet address to return balance records from.
+        - cancel (threading.Event): Optional argument. Set it to stop waiting, e.g. when
+          the HTTP client disconnects. The run is cancelled once no caller is waiting.
+
+        Returns:
+        List: Data array from Allium query results api JSON response.
+        """
+        key = wallet_address.lower()
+        with self.lock:
+            run = self.in_flight.get(key)
+            if run is None:
+                run = _QueryRun()
+                self.in_flight[key] = run
+                run.future = self.executor.submit(self._execute, key, run)
+            run.waiters += 1
+
+        try:
+            while True:
+                try:
+                    return run.future.result(timeout=0.1 if cancel else None)
+                except FutureTimeoutError:
+                    if cancel.is_set():
+                        raise QueryCancelled(
+                            f"Lookup of {wallet_address} cancelled")
+        finally:
+            with self.lock:
+                run.waiters -= 1
+                if run.waiters == 0 and not run.future.done():
+                    run.cancelled.set()
+                    if self.in_flight.get(key) is run:
+                        del self.in_flight[key]
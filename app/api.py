@@ -1,43 +1,463 @@
+from batch_pnl import run_batch
+from cache import create_cache, create_shared
+from db.connect import pool_stats
+from db.metrics import metrics, start_profile, dump_profile
+from db.prices import latest_job_ts, listen_for_jobs, price_cache
+from datetime import datetime, timezone
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, make_response
+from formats import binary_formats, encode_pnl
+from flask import Flask, Response, after_this_request, g, request, jsonify, make_response, send_file
+from allium import QueryCancelled
+import hashlib
+import json
 import os
-from lib import run_pnl_flow
+import socket
+import threading
+import time
+from jobs import JobQueue, QueueFull, PNL_JOB_STORE_URL, PNL_JOB_TTL
+from lib import run_pnl_flow, run_pnl_frame, run_pnl_exact, get_portfolio_pnl, split_by_asset, default_interval
+from stream import stream_formats, stream_ndjson, stream_json
 
 load_dotenv()
 
 # load env vars
 FLASK_SECRET_KEY = os.getenv("FLASK_SECRET_KEY")
 API_PORT = os.getenv("API_PORT")
+PNL_MAX_PENDING = int(os.getenv("PNL_MAX_PENDING", 16))
+PNL_QUEUE_TIMEOUT = float(os.getenv("PNL_QUEUE_TIMEOUT", 5))
+BATCH_OUTPUT_DIR = os.getenv("BATCH_OUTPUT_DIR", "batch_output")
+BATCH_MAX_WALLETS = int(os.getenv("BATCH_MAX_WALLETS", 10000))
+# requests with profile=1 are run under cProfile and dumped here when set
+PNL_PROFILE_DIR = os.getenv("PNL_PROFILE_DIR")
+# LISTEN for ELT completion so cached prices are dropped immediately instead of after LATEST_JOB_TTL
+PRICE_CACHE_LISTEN = os.getenv("PRICE_CACHE_LISTEN", "false").lower() in ("1", "true", "yes")
+# seconds between checks of whether a /get-pnl client is still connected
+PNL_DISCONNECT_POLL = float(os.getenv("PNL_DISCONNECT_POLL", 0.5))
 
 app = Flask(__name__)
 app.secret_key = FLASK_SECRET_KEY
 
+pnl_cache = create_cache()
+
+# PnL computations (cache misses) allowed to run at once in this process. Further
+# misses wait up to PNL_QUEUE_TIMEOUT for a slot and are then rejected with 503
+pnl_slots = threading.BoundedSemaphore(PNL_MAX_PENDING)
+
+pnl_jobs = JobQueue(store=create_shared(PNL_JOB_STORE_URL, PNL_JOB_TTL, 'pnljob:')
+                    if PNL_JOB_STORE_URL else None)
+
+if PRICE_CACHE_LISTEN:
+    listen_for_jobs()
+
+
+def run_in_slot(func, *args, **kwargs):
+    """
+    Run a slow PnL lookup once one of PNL_MAX_PENDING slots is free. Callers wait up to
+    PNL_QUEUE_TIMEOUT seconds for a slot, after which QueueFull is raised so the request
+    is rejected instead of piling up behind slow Allium polls.
+    """
+    if not pnl_slots.acquire(timeout=PNL_QUEUE_TIMEOUT):
+        raise QueueFull("Too many pending PnL requests, retry later")
+    try:
+        return func(*args, **kwargs)
+    finally:
+        pnl_slots.release()
+
+
+def watch_disconnect(environ, interval=PNL_DISCONNECT_POLL):
+    """
+    Return an Event that is set once the client of a request closes its connection,
+    so a computation waiting on Allium can stop. The connection is peeked every
+    interval seconds until the event is set; set it when the response is closed.
+
+    Parameters:
+    - environ (dict): WSGI environ of the request.
+    - interval (float): Optional argument, default PNL_DISCONNECT_POLL. Seconds between checks.
+
+    Returns:
+    threading.Event: Set on disconnect, or by the caller once the request is done.
+    """
+    cancel = threading.Event()
+    sock = environ.get('gunicorn.socket') or environ.get('werkzeug.socket')
+    if sock is None:
+        return cancel
+
+    def watch():
+        while not cancel.wait(interval):
+            try:
+                if sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b'':
+                    cancel.set()
+            except (BlockingIOError, InterruptedError):
+                continue
+            except (OSError, ValueError):
+                # closed socket, or one (TLS) that cannot be peeked
+                if sock.fileno() == -1:
+                    cancel.set()
+                return
+
+    threading.Thread(target=watch, daemon=True).start()
+    return cancel
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.profiler = None
+    if PNL_PROFILE_DIR and request.args.get('profile') == '1':
+        g.profiler = start_profile()
+
+
+@app.after_request
+def record_request_metrics(response):
+    if g.get('profiler') is not None:
+        dump_profile(g.profiler, PNL_PROFILE_DIR, request.endpoint or 'unknown')
+    if 'request_start' in g:
+        labels = {'endpoint': request.endpoint or 'unknown',
+                  'status': response.status_code}
+        metrics.observe('http_request_seconds',
+                        time.perf_counter() - g.request_start, **labels)
+        metrics.inc('http_requests_total', **labels)
+    return response
+
+
+def pnl_cache_key(wallet_address, interval, start, end):
+    """
+    Response cache key of a PnL request. Keyed on the wallet, the requested window and
+    the latest successful ELT job, so a new price load never serves stale prices.
+    """
+    return f"{wallet_address.lower()}:{interval}:{start}:{end}:{latest_job_ts()}"
+
+
+def cached_pnl_flow(wallet_address, interval=default_interval, start=None, end=None, cancel=None):
+    """
+    Serve run_pnl_flow results from the response cache.
+    """
+    key = pnl_cache_key(wallet_address, interval, start, end)
+    data = pnl_cache.get(key)
+    if data is None:
+        data = run_in_slot(run_pnl_flow, wallet_address, cancel=cancel, interval=interval,
+                           start=start, end=end)
+        pnl_cache.set(key, data)
+    return data
+
+
+def cached_pnl_frame(wallet_address, interval=default_interval, start=None, end=None, cancel=None):
+    """
+    Serve run_pnl_frame results from the response cache, keyed like cached_pnl_flow.
+    """
+    key = 'frame:' + pnl_cache_key(wallet_address, interval, start, end)
+    pnl_df = pnl_cache.get(key)
+    if pnl_df is None:
+        pnl_df = run_in_slot(run_pnl_frame, wallet_address, cancel=cancel, interval=interval,
+                             start=start, end=end)
+        pnl_cache.set(key, pnl_df)
+    return pnl_df
+
+
+def cached_pnl_exact(wallet_address, interval=default_interval, start=None, end=None, cancel=None):
+    """
+    Serve exact decimal run_pnl_exact results from the response cache, keyed like cached_pnl_flow.
+    """
+    key = 'exact:' + pnl_cache_key(wallet_address, interval, start, end)
+    data = pnl_cache.get(key)
+    if data is None:
+        data = split_by_asset(run_in_slot(run_pnl_exact, wallet_address, cancel=cancel,
+                                          interval=interval, start=start, end=end))
+        pnl_cache.set(key, data)
+    return data
+
+
+def stream_pnl(wallet_address, interval, start, end, stream, columnar, cancel=None):
+    """
+    Build a streaming /get-pnl response. The PnL frame is computed before the
+    response starts so errors still return a status code; rows are then encoded
+    and sent batch by batch instead of being serialized into one body.
+    """
+    if stream not in stream_formats:
+        raise ValueError(
+            f"Unsupported stream format {stream}, use one of {', '.join(stream_formats)}")
+    pnl_df = cached_pnl_frame(wallet_address, interval, start, end, cancel)
+    encoder = stream_ndjson if stream == 'ndjson' else stream_json
+    return Response(encoder(pnl_df, app.json.dumps, columnar), mimetype=stream_formats[stream])
+
+
+def binary_pnl(wallet_address, interval, start, end, mimetype, cancel=None):
+    """
+    Build a /get-pnl response in a binary columnar format (Arrow IPC stream or Parquet),
+    one long table with native timestamp and float64 columns.
+    """
+    pnl_df = cached_pnl_frame(wallet_address, interval, start, end, cancel)
+    with metrics.span('serialize', format=binary_formats[mimetype]):
+        body = encode_pnl(pnl_df, binary_formats[mimetype])
+    return Response(body, mimetype=mimetype)
+
+
+def naive_utc(ts):
+    """
+    Convert an offset-aware datetime to naive UTC, leaving naive ones unchanged.
+    """
+    if ts.tzinfo is None:
+        return ts
+    return ts.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def parse_window_args(args):
+    """
+    Read the interval, start and end query parameters of a PnL request.
+    start and end are ISO 8601 timestamps; invalid values raise ValueError.
+    Timestamps with an offset are converted to naive UTC, like the stored timestamps.
+    """
+    interval = args.get('interval', default_interval)
+    start = args.get('start')
+    end = args.get('end')
+    start = naive_utc(datetime.fromisoformat(start)) if start else None
+    end = naive_utc(datetime.fromisoformat(end)) if end else None
+    return interval, start, end
+
 
 @app.route('/get-pnl', methods=['GET'])
 def serve_pnl():
     wallet_address = request.args.get('wallet_address')
     data = {}
+    cancel = watch_disconnect(request.environ)
+
+    @after_this_request
+    def stop_watching(response):
+        # streamed responses are closed once the last row is sent or the client goes away
+        response.call_on_close(cancel.set)
+        return response
 
     if not wallet_address:
         message = 'Missing required parameter: asset'
         status_code = 422
     else:
         try:
-            data = run_pnl_flow(wallet_address)
+            interval, start, end = parse_window_args(request.args)
+            mimetype = request.accept_mimetypes.best_match(
+                ['application/json', *binary_formats])
+            if mimetype in binary_formats:
+                return binary_pnl(wallet_address, interval, start, end, mimetype, cancel)
+            stream = request.args.get('stream')
+            if stream:
+                columnar = request.args.get('columnar', '').lower() in ('1', 'true')
+                return stream_pnl(wallet_address, interval, start, end, stream, columnar,
+                                  cancel)
+            if request.args.get('precise', '').lower() in ('1', 'true'):
+                data = cached_pnl_exact(wallet_address, interval, start, end, cancel)
+            else:
+                data = cached_pnl_flow(wallet_address, interval, start, end, cancel)
             message = 'Success'
             status_code = 200
         except ValueError as e:
             message = str(e)
             status_code = 400
+        except QueueFull as e:
+            message = str(e)
+            status_code = 503
+        except QueryCancelled as e:
+            # the client is gone, nobody reads this response
+            message = str(e)
+            status_code = 499
         except Exception as e:
             message = 'Internal server error'
             status_code = 500
             print(e)
 
     resp_data = {'data': data, 'message': message}
-    response = make_response(jsonify(resp_data), status_code)
+    with metrics.span('serialize', format='json'):
+        response = make_response(jsonify(resp_data), status_code)
+    if status_code == 503:
+        response.headers['Retry-After'] = str(max(1, int(PNL_QUEUE_TIMEOUT)))
     return response
 
 
+def submit_pnl_job(wallet_address, interval, start, end, priority=0):
+    """
+    Queue a PnL computation on the job workers. Jobs for the same request share one
+    run and store their result in the response cache like /get-pnl.
+    """
+    key = pnl_cache_key(wallet_address, interval, start, end)
+
+    def run_job(cancel):
+        data = pnl_cache.get(key)
+        if data is None:
+            data = run_pnl_flow(wallet_address, cancel=cancel, interval=interval,
+                                start=start, end=end)
+            pnl_cache.set(key, data)
+        return data
+
+    return pnl_jobs.submit(key, run_job, priority)
+
+
+@app.route('/get-portfolio-pnl', methods=['GET'])
+def serve_portfolio_pnl():
+    wallet_address = request.args.get('wallet_address')
+    data = {}
+    cancel = watch_disconnect(request.environ)
+
+    @after_this_request
+    def stop_watching(response):
+        # stops the watcher once the response is sent
+        response.call_on_close(cancel.set)
+        return response
+
+    if not wallet_address:
+        message = 'Missing required parameter: wallet_address'
+        status_code = 422
+    else:
+        try:
+            interval, start, end = parse_window_args(request.args)
+            max_points = request.args.get('max_points')
+            max_points = int(max_points) if max_points else None
+            if max_points is not None and max_points < 1:
+                raise ValueError("max_points must be a positive integer")
+            pnl_df = cached_pnl_frame(wallet_address, interval, start, end, cancel)
+            data = get_portfolio_pnl(pnl_df, max_points)
+            message = 'Success'
+            status_code = 200
+        except ValueError as e:
+            message = str(e)
+            status_code = 400
+        except QueueFull as e:
+            message = str(e)
+            status_code = 503
+        except QueryCancelled as e:
+            message = str(e)
+            status_code = 499
+        except Exception as e:
+            message = 'Internal server error'
+            status_code = 500
+            print(e)
+
+    with metrics.span('serialize', format='json'):
+        response = make_response(
+            jsonify({'data': data, 'message': message}), status_code)
+    return response
+
+
+@app.route('/pnl-jobs', methods=['POST'])
+def serve_submit_pnl_job():
+    args = request.get_json(silent=True) or request.args
+    wallet_address = args.get('wallet_address')
+    data = {}
+
+    if not wallet_address:
+        message = 'Missing required parameter: wallet_address'
+        status_code = 422
+    else:
+        try:
+            interval, start, end = parse_window_args(args)
+            job = submit_pnl_job(wallet_address, interval, start, end,
+                                 int(args.get('priority', 0)))
+            data = job.to_dict()
+            message = 'Accepted'
+            status_code = 202
+        except ValueError as e:
+            message = str(e)
+            status_code = 400
+        except QueueFull as e:
+            message = str(e)
+            status_code = 503
+        except Exception as e:
+            message = 'Internal server error'
+            status_code = 500
+            print(e)
+
+    response = make_response(
+        jsonify({'data': data, 'message': message}), status_code)
+    if status_code == 202:
+        response.headers['Location'] = f"/pnl-jobs/{data['job_id']}"
+    return response
+
+
+@app.route('/pnl-batches', methods=['POST'])
+def serve_submit_pnl_batch():
+    args = request.get_json(silent=True) or {}
+    wallets = args.get('wallets')
+    data = {}
+
+    if not wallets or not isinstance(wallets, list):
+        message = 'Missing required parameter: wallets'
+        status_code = 422
+    else:
+        try:
+            if len(wallets) > BATCH_MAX_WALLETS:
+                raise ValueError(f"At most {BATCH_MAX_WALLETS} wallets per batch")
+            output_format = args.get('format', 'ndjson')
+            if output_format not in ('ndjson', 'parquet'):
+                raise ValueError("Unsupported format, use ndjson or parquet")
+            interval, start, end = parse_window_args(args)
+            wallets = sorted({i.lower() for i in wallets})
+            key = 'batch:' + hashlib.sha256(json.dumps(
+                [wallets, interval, str(start), str(end), output_format, str(latest_job_ts())]).encode()).hexdigest()
+            output = os.path.join(BATCH_OUTPUT_DIR, f"{key[6:22]}.{output_format}")
+            os.makedirs(BATCH_OUTPUT_DIR, exist_ok=True)
+
+            job = pnl_jobs.submit(key, lambda cancel: run_batch(
+                wallets, output, interval, start, end, cancel=cancel), int(args.get('priority', 0)))
+            data = job.to_dict()
+            message = 'Accepted'
+            status_code = 202
+        except ValueError as e:
+            message = str(e)
+            status_code = 400
+        except QueueFull as e:
+            message = str(e)
+            status_code = 503
+        except Exception as e:
+            message = 'Internal server error'
+            status_code = 500
+            print(e)
+
+    response = make_response(
+        jsonify({'data': data, 'message': message}), status_code)
+    if status_code == 202:
+        response.headers['Location'] = f"/pnl-jobs/{data['job_id']}"
+    return response
+
+
+@app.route('/pnl-batches/<job_id>/output', methods=['GET'])
+def serve_pnl_batch_output(job_id):
+    job = pnl_jobs.get(job_id)
+    if job is None or job.status != 'success' or not isinstance(job.result, dict) \
+            or 'output' not in job.result:
+        return make_response(jsonify({'data': {}, 'message': 'No batch output for job'}), 404)
+    return send_file(os.path.abspath(job.result['output']), as_attachment=True)
+
+
+@app.route('/pnl-jobs/<job_id>', methods=['GET', 'DELETE'])
+def serve_pnl_job(job_id):
+    if request.method == 'DELETE':
+        job = pnl_jobs.cancel(job_id)
+    else:
+        job = pnl_jobs.get(job_id)
+
+    if job is None:
+        return make_response(jsonify({'data': {}, 'message': 'Unknown job'}), 404)
+    return make_response(jsonify({'data': job.to_dict(), 'message': 'Success'}), 200)
+
+
+@app.route('/metrics', methods=['GET'])
+def serve_metrics():
+    lines = [metrics.render()]
+    for name, value in pnl_cache.stats().items():
+        lines.append(f'# TYPE pnl_cache_{name} gauge\npnl_cache_{name} {value}\n')
+    for name, value in price_cache.stats().items():
+        lines.append(f'# TYPE price_cache_{name} gauge\nprice_cache_{name} {value}\n')
+    for pool, stats in pool_stats().items():
+        for name, value in stats.items():
+            lines.append(f'db_pool_{name}{{pool="{pool}"}} {value}\n')
+    lines.append('# TYPE pnl_jobs gauge\n')
+    for status, count in pnl_jobs.stats().items():
+        lines.append(f'pnl_jobs{{status="{status}"}} {count}\n')
+    return Response(''.join(lines), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/cache-stats', methods=['GET'])
+def serve_cache_stats():
+    return make_response(jsonify({**pnl_cache.stats(), 'jobs': pnl_jobs.stats(),
+                                  'prices': price_cache.stats()}), 200)
+
+
 if __name__ == '__main__':
     app.run(debug=True, port=API_PORT)
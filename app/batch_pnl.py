@@ -0,0 +1,235 @@
+"""
+Bulk PnL for many wallets. Balances are fetched for every wallet, each asset's price
+series is loaded once for the whole batch, and wallets are computed in a process pool.
+Results are streamed to an NDJSON or Parquet file.
+
+Run from the app directory:
+    python batch_pnl.py wallets.txt --output pnl.ndjson
+    python batch_pnl.py wallets.txt --output pnl.parquet --interval 1d --start 2024-01-01T00:00:00
+"""
+from allium import QueryCancelled
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from dotenv import load_dotenv
+import json
+import lib
+import multiprocessing
+import os
+import pandas as pd
+import time
+
+load_dotenv()
+
+BATCH_FETCH_WORKERS = int(os.getenv("BATCH_FETCH_WORKERS", 8))
+BATCH_PROCESSES = int(os.getenv("BATCH_PROCESSES", os.cpu_count() or 1))
+BATCH_ROW_GROUP_ROWS = int(os.getenv("BATCH_ROW_GROUP_ROWS", 500000))
+# pool processes are not forked from the caller, which may be a threaded API worker whose
+# other threads hold locks (metrics, connection pools) that a forked child would inherit
+BATCH_START_METHOD = os.getenv("BATCH_START_METHOD", "forkserver")
+
+# per process price series shared by every wallet computed there
+_prices_by_asset = {}
+
+
+def _init_worker(prices_df):
+    _prices_by_asset.clear()
+    _prices_by_asset.update(
+        {asset: asset_df for asset, asset_df in prices_df.groupby('token_id', sort=False)})
+
+
+def compute_wallet(wallet_address, balance_records, interval, start, end):
+    """
+    Compute one wallet's PnL frame from its balance records and the shared prices.
+    Runs in a pool process initialized with _init_worker.
+
+    Returns:
+    Tuple: (wallet_address, PnL Dataframe or None, error message or None)
+    """
+    try:
+        wallet_balance_df_all = pd.DataFrame.from_dict(balance_records)
+        assets = list(wallet_balance_df_all['token_id'].unique())
+        hour_range = lib.build_grid(interval, start, end)
+        price_frames = [_prices_by_asset[i] for i in assets if i in _prices_by_asset]
+        prices_df = pd.concat(price_frames) if price_frames else \
+            pd.DataFrame(columns=['hourly_ts', 'token_id', 'price']).astype(
+                {'hourly_ts': 'datetime64[ns]', 'price': 'float64'})
+        merged_prices = lib.get_usd_values(
+            wallet_balance_df_all, assets, hour_range, interval, prices_df)
+        return wallet_address, lib.add_pnl(merged_prices), None
+    except ValueError as e:
+        return wallet_address, None, str(e)
+    except Exception as e:
+        # recorded as this wallet's error so the rest of the batch still completes
+        return wallet_address, None, f"{type(e).__name__}: {e}"
+
+
+class NdjsonWriter:
+    """
+    Writes one JSON line per wallet: its PnL records per asset, or its error.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'w')
+
+    def write(self, wallet_address, pnl_df, error):
+        if error is not None:
+            line = {'wallet_address': wallet_address, 'error': error}
+        else:
+            pnl_df = pnl_df.assign(hourly_ts=pnl_df['hourly_ts'].dt.strftime('%Y-%m-%dT%H:%M:%S'))
+            line = {'wallet_address': wallet_address, 'data': lib.split_by_asset(pnl_df)}
+        self.file.write(json.dumps(line) + '\n')
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    """
+    Writes every wallet's PnL rows to one Parquet file with a wallet_address column,
+    buffering wallets into row groups of about BATCH_ROW_GROUP_ROWS rows. Wallets that
+    failed are only counted.
+    """
+
+    def __init__(self, path, row_group_rows=BATCH_ROW_GROUP_ROWS):
+        self.path = path
+        self.row_group_rows = row_group_rows
+        self.buffer = []
+        self.buffered_rows = 0
+        self.writer = None
+
+    def write(self, wallet_address, pnl_df, error):
+        if error is not None:
+            return
+        self.buffer.append(pnl_df.assign(wallet_address=wallet_address))
+        self.buffered_rows += len(pnl_df)
+        if self.buffered_rows >= self.row_group_rows:
+            self.flush()
+
+    def flush(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        from formats import pnl_table
+
+        if not self.buffer:
+            return
+        batch_df = pd.concat(self.buffer, ignore_index=True)
+        table = pnl_table(batch_df).append_column(
+            'wallet_address', pa.array(batch_df['wallet_address'], pa.string()))
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+        self.buffer = []
+        self.buffered_rows = 0
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+
+
+def fetch_balances(wallets, workers=BATCH_FETCH_WORKERS, cancel=None):
+    """
+    Load balance records for every wallet on a thread pool, syncing wallets not yet
+    in the local store from Allium. Raises QueryCancelled once cancel is set.
+
+    Returns:
+    Dict: wallet -> list of balance records, or the error message for wallets that failed.
+    """
+    def fetch(wallet_address):
+        try:
+            return wallet_address, lib.load_wallet_balances(
+                wallet_address, cancel).to_dict(orient='records')
+        except QueryCancelled:
+            raise
+        except ValueError as e:
+            return wallet_address, str(e)
+        except Exception as e:
+            return wallet_address, f"{type(e).__name__}: {e}"
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(executor.map(fetch, wallets))
+
+
+def run_batch(wallets, output, interval=lib.default_interval, start=None, end=None,
+              processes=BATCH_PROCESSES, cancel=None):
+    """
+    Compute PnL for a list of wallets and stream the results to a file.
+
+    Parameters:
+    - wallets (list): Wallet addresses.
+    - output (str): Output path, .parquet writes Parquet, anything else NDJSON.
+    - interval (str): Optional argument, default '1h'. Key of lib.intervals.
+    - start (datetime.datetime): Optional argument. Window start, defaults to 7 days before end.
+    - end (datetime.datetime): Optional argument. Window end, defaults to now.
+    - processes (int): Optional argument, default BATCH_PROCESSES. Pool processes.
+    - cancel (threading.Event): Optional argument. When set, pending wallets are dropped,
+      the partial output is removed and QueryCancelled is raised.
+
+    Returns:
+    Dict: wallets, failed, seconds and wallets_per_sec of the run, and the output path.
+    """
+    started = time.perf_counter()
+    wallets = list(dict.fromkeys(i.lower() for i in wallets))
+    # fix the window once so every wallet shares the same grid and price fetch
+    hour_range = lib.build_grid(interval, start, end)
+    start, end = hour_range[0].to_pydatetime(), hour_range[-1].to_pydatetime()
+
+    balances = fetch_balances(wallets, cancel=cancel)
+    assets = sorted({i['token_id'] for records in balances.values()
+                     if isinstance(records, list) for i in records})
+    step = pd.Timedelta(lib.intervals[interval][0])
+    prices_df = lib.get_prices_batch(assets, hour_range[0], hour_range[-1] + step, interval) \
+        if assets else pd.DataFrame(columns=['hourly_ts', 'token_id', 'price'])
+
+    writer = ParquetWriter(output) if output.endswith('.parquet') else NdjsonWriter(output)
+    failed = 0
+    cancelled = False
+    try:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(prices_df,),
+                                 mp_context=multiprocessing.get_context(BATCH_START_METHOD)) as executor:
+            computable = [i for i in wallets if isinstance(balances[i], list)]
+            computable_set = set(computable)
+            results = executor.map(compute_wallet, computable, [balances[i] for i in computable],
+                                   [interval] * len(computable), [start] * len(computable),
+                                   [end] * len(computable), chunksize=16)
+            for wallet_address in wallets:
+                if wallet_address not in computable_set:
+                    failed += 1
+                    writer.write(wallet_address, None, balances[wallet_address])
+            for wallet_address, pnl_df, error in results:
+                if cancel is not None and cancel.is_set():
+                    cancelled = True
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    break
+                failed += error is not None
+                writer.write(wallet_address, pnl_df, error)
+    finally:
+        writer.close()
+    if cancelled:
+        if os.path.exists(output):
+            os.remove(output)
+        raise QueryCancelled(f"Batch of {len(wallets)} wallets cancelled")
+
+    seconds = time.perf_counter() - started
+    return {'wallets': len(wallets), 'failed': failed, 'seconds': seconds,
+            'wallets_per_sec': len(wallets) / seconds, 'output': output}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compute PnL for many wallets')
+    parser.add_argument('wallets', help='file with one wallet address per line')
+    parser.add_argument('--output', required=True,
+                        help='.parquet for Parquet, any other extension for NDJSON')
+    parser.add_argument('--interval', default=lib.default_interval, choices=list(lib.intervals))
+    parser.add_argument('--start', type=datetime.fromisoformat)
+    parser.add_argument('--end', type=datetime.fromisoformat)
+    parser.add_argument('--processes', type=int, default=BATCH_PROCESSES)
+    args = parser.parse_args()
+
+    with open(args.wallets) as f:
+        wallet_list = [line.strip() for line in f if line.strip()]
+    summary = run_batch(wallet_list, args.output, args.interval, args.start, args.end,
+                        args.processes)
+    print(f"{summary['wallets']} wallets ({summary['failed']} failed) in {summary['seconds']:.1f}s, "
+          f"{summary['wallets_per_sec']:.1f} wallets/sec -> {summary['output']}")
@@ -0,0 +1,109 @@
+"""
+Benchmark for the running balance engine in lib.get_pnl.
+
+Times lib.fill_balances against the original iterrows loop on synthetic wallets across a
+range of grid sizes. tests/test_balances.py checks that both produce the same balances.
+
+Run from the app directory:
+    python -m benchmarks.bench_balances
+"""
+from lib import fill_balances
+import numpy as np
+import pandas as pd
+import time
+
+LEGACY_MAX_ROWS = 10_000
+ROW_COUNTS = [168, 2_016, 10_000, 105_120, 1_051_200]
+
+
+def make_wallet(n_rows, freq='H', density=0.1, seed=0):
+    """
+    Build a synthetic grid and balance history. The first record sits before the grid
+    so the legacy loop always has a starting balance.
+
+    Parameters:
+    - n_rows (int): Number of grid timestamps.
+    - freq (str): Pandas frequency of the grid.
+    - density (float): Share of grid buckets that contain a balance record.
+    - seed (int): Random seed.
+
+    Returns:
+    Tuple: (grid DatetimeIndex, balance record DataFrame)
+    """
+    rng = np.random.default_rng(seed)
+    grid = pd.date_range('2020-01-01', periods=n_rows, freq=freq)
+    step = grid[1] - grid[0]
+
+    n_records = max(1, int(n_rows * density))
+    buckets = np.sort(rng.choice(n_rows, size=n_records, replace=False))
+    offsets = pd.to_timedelta(rng.integers(0, step.total_seconds(), n_records), unit='s')
+    record_ts = grid[buckets] + offsets
+
+    balances = pd.DataFrame({
+        'timestamp_dt': record_ts.insert(0, grid[0] - step),
+        'balance': rng.uniform(1, 1000, n_records + 1),
+    })
+    balances['hourly_ts'] = balances['timestamp_dt'].dt.floor(freq)
+    return grid, balances
+
+
+def legacy_fill_balances(grid, wallet_balance_df):
+    """
+    The original merge + iterrows running balance from lib.get_pnl, kept as the
+    reference implementation for the timings and the golden-output test.
+    """
+    min_hour = grid.min()
+    max_wallet_balance_before_hour_range = wallet_balance_df[
+        wallet_balance_df['timestamp_dt'] <= min_hour]['timestamp_dt'].max()
+    last_balance_before_hour_range = wallet_balance_df[
+        wallet_balance_df['timestamp_dt'] == max_wallet_balance_before_hour_range].copy()
+    last_balance_before_hour_range['join_col'] = min_hour
+
+    hourly_range_df = pd.DataFrame(grid, columns=['hourly_ts'])
+    merged_start_bal = hourly_range_df.merge(
+        last_balance_before_hour_range[['join_col', 'balance']], how='left', left_on='hourly_ts', right_on='join_col')
+    merged_balances = merged_start_bal.merge(
+        wallet_balance_df, how='left', on='hourly_ts')
+
+    for i, v in merged_balances.fillna(0).iterrows():
+        balance_null = v['balance_x'] == 0
+
+        if balance_null:
+            merged_balances.loc[i,
+                                'balance_x'] = merged_balances.loc[i-1, 'balance_x']
+
+        if v['balance_y'] != 0:
+            current_balance = merged_balances.loc[i, 'balance_y']
+            merged_balances.loc[i, 'balance_x'] = current_balance
+        else:
+            current_balance = merged_balances.loc[i, 'balance_x']
+
+        merged_balances.loc[i, 'balance_actual'] = current_balance
+
+    return merged_balances['balance_actual'].to_numpy()
+
+
+def timed(func, *args, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    print(f"{'rows':>10} {'legacy_s':>10} {'vectorized_s':>13} {'speedup':>9}")
+    for n_rows in ROW_COUNTS:
+        grid, balances = make_wallet(n_rows)
+        vectorized = timed(fill_balances, grid.values,
+                           balances['hourly_ts'].values, balances['balance'].values)
+        if n_rows <= LEGACY_MAX_ROWS:
+            legacy = timed(legacy_fill_balances, grid, balances, repeat=1)
+            print(f"{n_rows:>10} {legacy:>10.4f} {vectorized:>13.6f} {legacy / vectorized:>8.0f}x")
+        else:
+            print(f"{n_rows:>10} {'-':>10} {vectorized:>13.6f} {'-':>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Load test /get-pnl under concurrent callers.
+
+Sends requests from a pool of threads to a running API server and reports
+throughput, p50/p95/p99 latency and status codes per concurrency level. Start the
+server first, either the dev server (python api.py) or the production entry point
+(gunicorn -c gunicorn.conf.py wsgi:app), then run from the app directory:
+    python -m benchmarks.bench_load --wallets 0xabc,0xdef
+
+With --miss every request asks for a distinct window so it bypasses the response
+cache and exercises the PnL lookup queue.
+"""
+import argparse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+import numpy as np
+import os
+import requests
+from requests.adapters import HTTPAdapter
+import time
+
+load_dotenv()
+
+API_PORT = os.getenv("API_PORT", "9999")
+
+CONCURRENCY = [1, 8, 32, 64]
+REQUESTS_PER_LEVEL = 200
+
+
+def make_session(pool_size):
+    session = requests.Session()
+    session.mount('http://', HTTPAdapter(pool_maxsize=pool_size))
+    return session
+
+
+def call(session, url, wallet, miss, i):
+    params = {'wallet_address': wallet}
+    if miss:
+        end = datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=i)
+        params['end'] = end.isoformat()
+    start = time.perf_counter()
+    try:
+        status = session.get(url, params=params, timeout=300).status_code
+    except requests.RequestException:
+        status = 'error'
+    return (time.perf_counter() - start) * 1000, status
+
+
+def run_level(url, wallets, concurrency, n_requests, miss):
+    session = make_session(concurrency)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(
+            lambda i: call(session, url, wallets[i % len(wallets)], miss, i), range(n_requests)))
+    elapsed = time.perf_counter() - start
+    session.close()
+
+    latencies = np.array([latency for latency, _ in results])
+    statuses = Counter(status for _, status in results)
+    return n_requests / elapsed, np.percentile(latencies, [50, 95, 99]), statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--url', default=f'http://127.0.0.1:{API_PORT}/get-pnl')
+    parser.add_argument('--wallets', required=True,
+                        help='comma separated wallet addresses, requests cycle through them')
+    parser.add_argument('--concurrency', default=','.join(map(str, CONCURRENCY)))
+    parser.add_argument('--requests', type=int, default=REQUESTS_PER_LEVEL)
+    parser.add_argument('--miss', action='store_true',
+                        help='vary the window per request to bypass the response cache')
+    args = parser.parse_args()
+
+    wallets = args.wallets.split(',')
+    print(f"{'concurrency':>11} {'req_per_s':>10} {'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9}  statuses")
+    for concurrency in map(int, args.concurrency.split(',')):
+        throughput, (p50, p95, p99), statuses = run_level(
+            args.url, wallets, concurrency, args.requests, args.miss)
+        status_summary = ' '.join(f'{k}:{v}' for k, v in sorted(statuses.items(), key=str))
+        print(f"{concurrency:>11} {throughput:>10.1f} {p50:>9.1f} {p95:>9.1f} {p99:>9.1f}  {status_summary}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Benchmark price lookup latency as SRC.PRICE_HISTORY grows.
+
+Seeds a BENCH schema in the configured Postgres database with synthetic hourly
+prices and compares the original string-formatted query (MAX(job_start_ts) scan and
+join, no indexes) with the bound-parameter query backed by the (asset, timestamp) and
+(job_start_ts) indexes.
+
+Run from the app directory against a local database:
+    python -m benchmarks.bench_price_query
+"""
+from db.connect import engine
+import numpy as np
+from sqlalchemy import text
+import time
+
+ROW_COUNTS = [100_000, 1_000_000, 5_000_000]
+N_ASSETS = 100
+N_JOBS = 10
+REPEAT = 20
+
+setup_bench_schema = """
+DROP SCHEMA IF EXISTS BENCH CASCADE;
+CREATE SCHEMA BENCH;
+CREATE TABLE BENCH.PRICE_HISTORY (
+timestamp TIMESTAMP WITHOUT TIME ZONE,
+asset TEXT,
+price NUMERIC,
+job_start_ts TIMESTAMP WITHOUT TIME ZONE,
+UNIQUE(timestamp, asset)
+);
+CREATE TABLE BENCH.ELT_LOG (
+job_start_ts TIMESTAMP WITHOUT TIME ZONE,
+status TEXT,
+error CHARACTER VARYING
+);
+"""
+
+seed_bench_prices = """
+INSERT INTO BENCH.PRICE_HISTORY (timestamp, asset, price, job_start_ts)
+SELECT
+    TIMESTAMP '2024-01-01' - (h * INTERVAL '1 hour')
+    , 'coin-' || a
+    , random() * 1000
+    , TIMESTAMP '2024-01-01' + ((h % :n_jobs) * INTERVAL '1 day')
+FROM generate_series(0, :n_hours - 1) h
+CROSS JOIN generate_series(0, :n_assets - 1) a
+"""
+
+seed_bench_log = """
+INSERT INTO BENCH.ELT_LOG (job_start_ts, status, error)
+SELECT TIMESTAMP '2024-01-01' + (j * INTERVAL '1 day'), 'success', ''
+FROM generate_series(0, :n_jobs - 1) j
+"""
+
+create_bench_indexes = """
+CREATE INDEX ON BENCH.PRICE_HISTORY (asset, timestamp);
+CREATE INDEX ON BENCH.PRICE_HISTORY (job_start_ts);
+CREATE INDEX ON BENCH.ELT_LOG (status, job_start_ts);
+ANALYZE BENCH.PRICE_HISTORY;
+ANALYZE BENCH.ELT_LOG;
+"""
+
+legacy_query = """
+with max_ts as (
+SELECT
+	MAX(job_start_ts) as ts
+FROM BENCH.ELT_LOG)
+SELECT
+    date_trunc('hour', ph.timestamp) as hourly_ts
+    , ph.asset as token_id
+    , ph.price
+    , ph.job_start_ts
+FROM BENCH.PRICE_HISTORY ph
+JOIN max_ts on max_ts.ts = ph.job_start_ts
+WHERE ph.asset = '{asset}';
+"""
+
+latest_job_query = """
+SELECT MAX(job_start_ts) FROM BENCH.ELT_LOG WHERE status = 'success'
+"""
+
+bound_query = """
+SELECT
+    date_trunc('hour', ph.timestamp) as hourly_ts
+    , ph.asset as token_id
+    , ph.price
+    , ph.job_start_ts
+FROM BENCH.PRICE_HISTORY ph
+WHERE ph.asset = ANY(:assets)
+AND ph.job_start_ts >= :job_start_ts
+"""
+
+
+def run_statements(conn, sql, params=None):
+    for statement in sql.split(';'):
+        if statement.strip():
+            conn.execute(text(statement), params or {})
+
+
+def seed(n_rows):
+    with engine.begin() as conn:
+        run_statements(conn, setup_bench_schema)
+        params = {'n_hours': n_rows // N_ASSETS,
+                  'n_assets': N_ASSETS, 'n_jobs': N_JOBS}
+        conn.execute(text(seed_bench_prices), params)
+        conn.execute(text(seed_bench_log), params)
+        conn.execute(text('ANALYZE BENCH.PRICE_HISTORY'))
+
+
+def percentiles(func):
+    latencies = []
+    for i in range(REPEAT):
+        start = time.perf_counter()
+        func(f'coin-{i % N_ASSETS}')
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.percentile(latencies, 50), np.percentile(latencies, 95)
+
+
+def main():
+    print(f"{'rows':>10} {'legacy_p50_ms':>14} {'legacy_p95_ms':>14} {'bound_p50_ms':>13} {'bound_p95_ms':>13}")
+    for n_rows in ROW_COUNTS:
+        seed(n_rows)
+        with engine.connect() as conn:
+            legacy = percentiles(lambda asset: conn.execute(
+                text(legacy_query.format(asset=asset))).fetchall())
+
+        with engine.begin() as conn:
+            run_statements(conn, create_bench_indexes)
+
+        with engine.connect() as conn:
+            job_start_ts = conn.execute(text(latest_job_query)).scalar()
+            bound = percentiles(lambda asset: conn.execute(
+                text(bound_query), {'assets': [asset], 'job_start_ts': job_start_ts}).fetchall())
+
+        print(f"{n_rows:>10} {legacy[0]:>14.2f} {legacy[1]:>14.2f} {bound[0]:>13.2f} {bound[1]:>13.2f}")
+
+    with engine.begin() as conn:
+        conn.execute(text('DROP SCHEMA IF EXISTS BENCH CASCADE'))
+
+
+if __name__ == '__main__':
+    main()
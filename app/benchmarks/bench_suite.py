@@ -0,0 +1,296 @@
+"""
+Benchmark suite for the PnL pipeline, price queries and the ELT load path.
+
+Generates synthetic price histories and wallets (benchmarks/synthetic.py), loads the
+prices through the real ELT against a stub Coingecko server, serves wallets from a stub
+Allium client and times the pipeline against the configured Postgres database. Each
+result reports throughput, p50/p95/p99 latency and peak traced memory, and the run is
+written as JSON tagged with the git commit so runs can be compared.
+
+All rows use bench- assets and 0xbench wallets and are deleted afterwards, but the ELT
+truncates STG and logs a job, so point DB_NAME at a scratch database initialized with
+db_init.py. Run from the app directory:
+    python -m benchmarks.bench_suite --quick
+    python -m benchmarks.bench_suite --output bench-head.json
+    python -m benchmarks.bench_suite --compare bench-base.json bench-head.json
+"""
+import argparse
+from benchmarks.synthetic import (BENCH_WALLET_PREFIX, StubAlliumClient, StubCoingecko, bench_assets,
+                                  make_balance_history, make_price_history)
+from datetime import datetime, timedelta
+from db.connect import engine
+import json
+import lib
+import numpy as np
+import os
+import platform
+import subprocess
+import sys
+from sqlalchemy import text
+import time
+import tracemalloc
+
+# the ELT imports its siblings directly, as when run from the db directory
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'db'))
+import elt  # noqa: E402
+
+REPEAT = 20
+
+full_config = {
+    'price_assets': 50,
+    'price_span_days': 90,
+    'stg_rows': [10_000, 100_000, 1_000_000],
+    'price_assets_per_query': [1, 10, 50],
+    'pnl_scenarios': [
+        {'n_tokens': 1, 'records_per_day': 2, 'span_days': 7, 'interval': '1h'},
+        {'n_tokens': 10, 'records_per_day': 2, 'span_days': 30, 'interval': '1h'},
+        {'n_tokens': 10, 'records_per_day': 24, 'span_days': 30, 'interval': '5m'},
+        {'n_tokens': 50, 'records_per_day': 2, 'span_days': 90, 'interval': '1h'},
+        {'n_tokens': 50, 'records_per_day': 24, 'span_days': 90, 'interval': '5m'},
+    ],
+    'wallets_per_scenario': 5,
+}
+
+quick_config = {
+    'price_assets': 10,
+    'price_span_days': 14,
+    'stg_rows': [10_000, 100_000],
+    'price_assets_per_query': [1, 10],
+    'pnl_scenarios': [
+        {'n_tokens': 1, 'records_per_day': 2, 'span_days': 7, 'interval': '1h'},
+        {'n_tokens': 10, 'records_per_day': 24, 'span_days': 14, 'interval': '5m'},
+    ],
+    'wallets_per_scenario': 2,
+}
+
+cleanup_bench_rows = """
+DELETE FROM SRC.PRICE_HISTORY WHERE asset LIKE 'bench-%';
+DELETE FROM SRC.PRICE_ROLLUP WHERE asset LIKE 'bench-%';
+DELETE FROM SRC.PRICE_WATERMARK WHERE asset LIKE 'bench-%';
+DELETE FROM SRC.WALLET_BALANCE WHERE wallet_address LIKE '0xbench%';
+DELETE FROM SRC.WALLET_SYNC WHERE wallet_address LIKE '0xbench%';
+DELETE FROM SRC.PNL_SNAPSHOT WHERE wallet_address LIKE '0xbench%';
+DELETE FROM SRC.ASSET_PRECISION WHERE asset LIKE 'bench-%';
+TRUNCATE STG.PRICE_HISTORY
+"""
+
+cleanup_bench_jobs = """
+DELETE FROM SRC.ELT_LOG WHERE job_start_ts >= :started_at
+"""
+
+latest_job_status = """
+SELECT status, error FROM SRC.ELT_LOG ORDER BY job_start_ts DESC LIMIT 1
+"""
+
+
+def run_statements(sql, params=None):
+    with engine.begin() as conn:
+        for statement in sql.split(';'):
+            if statement.strip():
+                conn.execute(text(statement), params or {})
+
+
+def summarize(benchmark, params, latencies, elapsed, peak_mb=None, **extra):
+    latencies_ms = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    return {'benchmark': benchmark, 'params': params, 'n': len(latencies),
+            'throughput_per_s': len(latencies) / elapsed, 'p50_ms': p50, 'p95_ms': p95,
+            'p99_ms': p99, 'peak_mb': peak_mb, **extra}
+
+
+def timed_runs(func, repeat=REPEAT):
+    """
+    Call func repeat times, returning per call latencies in seconds and total elapsed.
+    """
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        call_start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - call_start)
+    return latencies, time.perf_counter() - start
+
+
+def peak_memory(func):
+    """
+    Peak memory traced by tracemalloc (Python and numpy allocations) during one call, in MB.
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+
+def bench_elt(config):
+    """
+    Load the synthetic price history through elt.main in backfill mode against the
+    stub Coingecko server: extract, STG load, transform and rollup refresh.
+    """
+    history = make_price_history(
+        config['price_assets'], config['price_span_days'], freq='5min')
+    with StubCoingecko(history) as stub:
+        start = time.perf_counter()
+        elt.main(stub.url, elt.endpoints, 'bench', top_n=len(history),
+                 rate_per_minute=1_000_000, mode='backfill')
+        elapsed = time.perf_counter() - start
+
+    with engine.connect() as conn:
+        status, error = conn.execute(text(latest_job_status)).one()
+    if status != 'success':
+        raise RuntimeError(f"ELT benchmark run failed: {error}")
+
+    params = {'assets': len(history), 'span_days': config['price_span_days'], 'freq': '5min'}
+    return summarize('elt_backfill', params, [elapsed], elapsed,
+                     rows=stub.rows_served, rows_per_s=stub.rows_served / elapsed)
+
+
+def bench_stg_load(config):
+    """
+    Time elt.load_data into STG for each load mode and row count.
+    """
+    results = []
+    unix_ms, prices = make_price_history(1, 3650, freq='5min')['bench-0']
+    for n_rows in config['stg_rows']:
+        price_data = [[int(t), float(p)] for t, p in zip(unix_ms[:n_rows], prices[:n_rows])]
+        for mode in ['copy', 'values', 'insert']:
+            if mode == 'insert' and n_rows > 100_000:
+                continue
+            latencies, elapsed = timed_runs(
+                lambda: elt.load_data('bench-0', price_data, mode), repeat=3)
+            peak_mb = peak_memory(lambda: elt.load_data('bench-0', price_data, mode))
+            results.append(summarize('stg_load', {'mode': mode, 'rows': n_rows}, latencies, elapsed,
+                                     peak_mb, rows_per_s=n_rows / np.median(latencies)))
+    run_statements('TRUNCATE STG.PRICE_HISTORY')
+    return results
+
+
+def bench_prices(config, end):
+    """
+    Time lib.get_prices_batch over a 7 day window for growing asset counts.
+    """
+    results = []
+    for interval in ['5m', '1h']:
+        for n_assets in config['price_assets_per_query']:
+            assets = bench_assets(n_assets)
+
+            def fetch():
+                return lib.get_prices_batch(assets, end - timedelta(days=7), end, interval)
+            latencies, elapsed = timed_runs(fetch)
+            results.append(summarize('get_prices_batch', {'interval': interval, 'assets': n_assets},
+                                     latencies, elapsed, peak_memory(fetch)))
+    return results
+
+
+def bench_pnl(config, end):
+    """
+    Time run_pnl_flow on synthetic wallets served by a stub Allium client: the batched
+    path, the snapshot backed path after a warm-up call, and the per asset path for
+    smaller wallets.
+    """
+    results = []
+    histories = {}
+    for s, scenario in enumerate(config['pnl_scenarios']):
+        for w in range(config['wallets_per_scenario']):
+            wallet = f'{BENCH_WALLET_PREFIX}{s}x{w}'
+            histories[wallet] = make_balance_history(
+                scenario['n_tokens'], scenario['records_per_day'], scenario['span_days'],
+                end=end, seed=s * 1000 + w)
+    lib.allium_client = StubAlliumClient(histories)
+    lib.WALLET_REFRESH_SECONDS = float('inf')
+
+    for s, scenario in enumerate(config['pnl_scenarios']):
+        wallets = [f'{BENCH_WALLET_PREFIX}{s}x{w}' for w in range(config['wallets_per_scenario'])]
+        window = {'interval': scenario['interval'], 'end': end,
+                  'start': end - timedelta(days=scenario['span_days'])}
+        variants = {'batched': {'snapshots': False}, 'incremental': {'snapshots': True}}
+        if scenario['n_tokens'] <= 10:
+            variants['per_asset'] = {'batched': False}
+
+        for variant, kwargs in variants.items():
+            # first call syncs the wallet into the store and, for snapshots, persists them
+            for wallet in wallets:
+                lib.run_pnl_flow(wallet, **window, **kwargs)
+            calls = iter(range(10**9))
+
+            def run():
+                wallet = wallets[next(calls) % len(wallets)]
+                return lib.run_pnl_flow(wallet, **window, **kwargs)
+            latencies, elapsed = timed_runs(run)
+            results.append(summarize('run_pnl_flow', {**scenario, 'variant': variant},
+                                     latencies, elapsed, peak_memory(run)))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    return result['benchmark'] + ' ' + json.dumps(result['params'], sort_keys=True)
+
+
+def compare(base_path, head_path):
+    """
+    Print p50 latency and throughput of two result files side by side.
+    """
+    with open(base_path) as f:
+        base = {result_key(i): i for i in json.load(f)['results']}
+    with open(head_path) as f:
+        head = {result_key(i): i for i in json.load(f)['results']}
+
+    print(f"{'benchmark':<90} {'base_p50_ms':>12} {'head_p50_ms':>12} {'p50_ratio':>10} {'tput_ratio':>10}")
+    for key in sorted(base.keys() & head.keys()):
+        b, h = base[key], head[key]
+        print(f"{key:<90} {b['p50_ms']:>12.2f} {h['p50_ms']:>12.2f} "
+              f"{h['p50_ms'] / b['p50_ms']:>10.2f} {h['throughput_per_s'] / b['throughput_per_s']:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the PnL pipeline and ELT load path')
+    parser.add_argument('--quick', action='store_true', help='smaller data set for a fast check')
+    parser.add_argument('--output', help='result file, default bench-<commit>.json')
+    parser.add_argument('--keep', action='store_true', help='keep the bench rows afterwards')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'HEAD'),
+                        help='compare two result files instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    config = quick_config if args.quick else full_config
+    commit = git_commit()
+    started_at = datetime.now()
+    run_statements(cleanup_bench_rows)
+    results = []
+    try:
+        results.append(bench_elt(config))
+        end = datetime.now().replace(minute=0, second=0, microsecond=0)
+        results += bench_prices(config, end)
+        results += bench_pnl(config, end)
+        results += bench_stg_load(config)
+    finally:
+        if not args.keep:
+            run_statements(cleanup_bench_rows)
+            run_statements(cleanup_bench_jobs, {'started_at': started_at})
+
+    print(f"{'benchmark':<90} {'per_s':>9} {'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9} {'peak_mb':>8}")
+    for result in results:
+        peak_mb = f"{result['peak_mb']:.1f}" if result['peak_mb'] is not None else '-'
+        print(f"{result_key(result):<90} {result['throughput_per_s']:>9.2f} {result['p50_ms']:>9.2f} "
+              f"{result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f} {peak_mb:>8}")
+
+    output = args.output or f"bench-{commit or 'local'}.json"
+    with open(output, 'w') as f:
+        json.dump({'commit': commit, 'created_at': started_at.isoformat(), 'quick': args.quick,
+                   'python': platform.python_version(), 'results': results}, f, indent=2, default=str)
+    print(f"results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
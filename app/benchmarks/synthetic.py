@@ -0,0 +1,142 @@
+"""
+Synthetic wallets and price histories for the benchmarks, plus stand-ins for the
+Allium client and the Coingecko API so the PnL pipeline and the ELT can run against a
+local Postgres without network access.
+"""
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import json
+import numpy as np
+import pandas as pd
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+BENCH_ASSET_PREFIX = 'bench-'
+BENCH_WALLET_PREFIX = '0xbench'
+
+
+def bench_assets(n_assets):
+    return [f'{BENCH_ASSET_PREFIX}{i}' for i in range(n_assets)]
+
+
+def make_balance_history(n_tokens, records_per_day, span_days, end=None, seed=0):
+    """
+    Build a wallet's balance records in the Allium result shape.
+
+    Parameters:
+    - n_tokens (int): Number of tokens held, named bench-0 to bench-{n_tokens - 1}.
+    - records_per_day (float): Average balance changes per token and day.
+    - span_days (int): Days of history before end.
+    - end (datetime.datetime): Optional argument, default now. Last possible record time.
+    - seed (int): Optional argument, default 0. Random seed.
+
+    Returns:
+    List: Dicts with token_id, block_timestamp ('%Y-%m-%dT%H:%M:%S') and balance.
+    """
+    rng = np.random.default_rng(seed)
+    end = end or datetime.now()
+    span_seconds = span_days * 86400
+    records = []
+    for token_id in bench_assets(n_tokens):
+        n_records = max(1, rng.poisson(records_per_day * span_days))
+        offsets = np.sort(rng.integers(0, span_seconds, n_records))
+        balances = np.abs(np.cumsum(rng.normal(0, 10, n_records))) + 1
+        records += [{'token_id': token_id,
+                     'block_timestamp': (end - timedelta(seconds=int(offset))).strftime('%Y-%m-%dT%H:%M:%S'),
+                     'balance': float(balance)}
+                    for offset, balance in zip(offsets[::-1], balances)]
+    return records
+
+
+def make_price_history(n_assets, span_days, freq='1H', end=None, seed=0):
+    """
+    Build random walk prices for bench assets at a fixed frequency.
+
+    Parameters:
+    - n_assets (int): Number of assets, named bench-0 to bench-{n_assets - 1}.
+    - span_days (int): Days of history before end.
+    - freq (str): Optional argument, default '1H'. Pandas frequency, e.g. '5min'.
+    - end (datetime.datetime): Optional argument, default now.
+    - seed (int): Optional argument, default 0. Random seed.
+
+    Returns:
+    Dict: asset -> (unix_ms int64 array, price float64 array), sorted by time.
+    """
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp(end or datetime.now()).floor(freq)
+    grid = pd.date_range(end - pd.Timedelta(days=span_days), end, freq=freq)
+    unix_ms = grid.values.astype('datetime64[ms]').astype(np.int64)
+    history = {}
+    for asset in bench_assets(n_assets):
+        steps = rng.normal(0, 0.01, len(grid))
+        history[asset] = (unix_ms, 100 * np.exp(np.cumsum(steps)))
+    return history
+
+
+class StubAlliumClient:
+    """
+    Drop-in for lib.allium_client serving synthetic balance histories, with an optional
+    fixed latency standing in for the query run.
+    """
+
+    def __init__(self, histories, latency=0.0):
+        self.histories = histories
+        self.latency = latency
+        self.calls = 0
+
+    def fetch_wallet(self, wallet_address, cancel=None):
+        self.calls += 1
+        time.sleep(self.latency)
+        return self.histories.get(wallet_address.lower(), [])
+
+
+class StubCoingecko:
+    """
+    Local HTTP server answering the Coingecko endpoints used by the ELT (coins/markets,
+    market_chart/range and coin detail) from a make_price_history result.
+    """
+
+    def __init__(self, history):
+        self.history = history
+        self.rows_served = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = parse_qs(url.query)
+                if url.path.endswith('/coins/markets'):
+                    body = [{'id': asset} for asset in stub.history] \
+                        if params.get('page', ['1'])[0] == '1' else []
+                elif '/market_chart/' not in url.path:
+                    body = {'id': url.path.split('/')[-1],
+                            'detail_platforms': {'ethereum': {'decimal_place': 18}}}
+                else:
+                    asset = url.path.split('/')[-3]
+                    unix_ms, prices = stub.history[asset]
+                    lo, hi = np.searchsorted(
+                        unix_ms, [int(params['from'][0]) * 1000, int(params['to'][0]) * 1000 + 1])
+                    body = {'prices': [[int(t), float(p)] for t, p in zip(unix_ms[lo:hi], prices[lo:hi])]}
+                    stub.rows_served += hi - lo
+                payload = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
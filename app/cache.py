@@ -0,0 +1,167 @@
+from collections import OrderedDict
+from dotenv import load_dotenv
+import os
+import pickle
+import threading
+import time
+
+load_dotenv()
+
+PNL_CACHE_TTL = int(os.getenv("PNL_CACHE_TTL", 300))
+PNL_CACHE_SIZE = int(os.getenv("PNL_CACHE_SIZE", 1024))
+PNL_CACHE_URL = os.getenv("PNL_CACHE_URL")
+
+
+class LRUCache:
+    """
+    Thread-safe in-process cache with per-entry TTL and least recently used eviction
+    once maxsize entries are held.
+    """
+
+    def __init__(self, maxsize=PNL_CACHE_SIZE, ttl=PNL_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class SharedCache:
+    """
+    Cache backed by a shared key-value store so several API processes reuse each
+    other's results. The client needs redis-py style get(key) and set(key, value, ex=ttl);
+    values are pickled. Expiry and eviction are left to the store.
+    """
+
+    def __init__(self, client, ttl=PNL_CACHE_TTL, prefix='pnl:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=self.ttl)
+
+
+class LocalStore:
+    """
+    In-memory stand-in for a shared store client, for running without Redis.
+    """
+
+    def __init__(self):
+        self.cache = LRUCache(maxsize=PNL_CACHE_SIZE)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, ex=None):
+        self.cache.ttl = ex or PNL_CACHE_TTL
+        self.cache.set(key, value)
+
+
+class ResponseCache:
+    """
+    Two level response cache: an in-process LRU in front of an optional shared backend.
+    Counts hits (per level) and misses.
+    """
+
+    def __init__(self, local, shared=None):
+        self.local = local
+        self.shared = shared
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            self._count('hits')
+            return value
+
+        if self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self._count('shared_hits')
+                self.local.set(key, value)
+                return value
+
+        self._count('misses')
+        return None
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value)
+
+    def stats(self):
+        return {'hits': self.hits, 'shared_hits': self.shared_hits, 'misses': self.misses,
+                'evictions': self.local.evictions, 'size': len(self.local.entries)}
+
+
+def create_shared(url, ttl=PNL_CACHE_TTL, prefix='pnl:'):
+    """
+    Build a shared key-value backend. 'local://' gives the in-memory stand-in and any
+    other url is passed to redis.from_url.
+
+    Parameters:
+    - url (str): Shared backend url.
+    - ttl (int): Optional argument, default PNL_CACHE_TTL. Seconds values are kept.
+    - prefix (str): Optional argument, default 'pnl:'. Prefix of the keys written.
+
+    Returns:
+    SharedCache: Backend with get and set.
+    """
+    if url.startswith('local://'):
+        return SharedCache(LocalStore(), ttl, prefix)
+
+    import redis
+    return SharedCache(redis.from_url(url), ttl, prefix)
+
+
+def create_cache(url=PNL_CACHE_URL):
+    """
+    Build the response cache. With url unset only the in-process LRU is used,
+    otherwise the shared backend from create_shared sits behind it.
+
+    Parameters:
+    - url (str): Optional argument, default PNL_CACHE_URL. Shared backend url.
+
+    Returns:
+    ResponseCache: Cache for API responses.
+    """
+    local = LRUCache()
+    if not url:
+        return ResponseCache(local)
+    return ResponseCache(local, create_shared(url))
@@ -0,0 +1,78 @@
+from db.connect import execute_pd, execute_query
+from db.queries import get_wallet_sync, get_wallet_balances, insert_wallet_balance, upsert_wallet_sync, numeric_types
+from db.snapshots import invalidate_balance_snapshots
+from decimal import Decimal
+
+# declared at read time so balances are float64 however the driver returns them
+balance_dtypes = {'balance': 'float64'}
+
+
+def wallet_sync_state(wallet_address):
+    """
+    Return the latest stored block timestamp of a wallet and how long ago it was
+    last synced from Allium.
+
+    Parameters:
+    - wallet_address (str): Wallet address, lower case.
+
+    Returns:
+    Tuple: (last_block_timestamp, sync_age_seconds), or None if the wallet was never synced.
+    """
+    sync_df = execute_pd(get_wallet_sync, {'wallet_address': wallet_address})
+    if len(sync_df) == 0:
+        return None
+    row = sync_df.iloc[0]
+    return row['last_block_timestamp'], float(row['sync_age_seconds'])
+
+
+def stored_balances(wallet_address, exact=False):
+    """
+    Return all stored balance records for a wallet in the same shape as the
+    Allium query results.
+
+    Parameters:
+    - wallet_address (str): Wallet address, lower case.
+    - exact (bool): Optional argument, default False. Return balances as the exact
+      NUMERIC values in Decimal objects instead of floats.
+
+    Returns:
+    List: Dicts with token_id, block_timestamp and balance.
+    """
+    query = get_wallet_balances.format(numeric_type=numeric_types['exact' if exact else 'float'])
+    balances_df = execute_pd(query, {'wallet_address': wallet_address},
+                             dtype=None if exact else balance_dtypes)
+    if exact:
+        balances_df['balance'] = [None if i is None else Decimal(i) for i in balances_df['balance']]
+    return balances_df.to_dict(orient='records')
+
+
+def store_balances(wallet_address, records):
+    """
+    Insert Allium balance records for a wallet, skipping ones already held, drop
+    PnL snapshots the new records affect and advance the wallet's sync state. Snapshots
+    are dropped again once the sync state has advanced, so a write that raced the
+    refresh cannot persist rows computed from the old balances.
+
+    Parameters:
+    - wallet_address (str): Wallet address, lower case.
+    - records (list): Allium result dicts with token_id, block_timestamp and balance.
+
+    Returns:
+    None
+    """
+    balance_data = [{'wallet_address': wallet_address,
+                     'token_id': i['token_id'],
+                     'block_timestamp': i['block_timestamp'],
+                     'balance': i['balance']} for i in records]
+    if balance_data:
+        execute_query(insert_wallet_balance, balance_data)
+        invalidate_balance_snapshots(wallet_address, records)
+
+    last_block_timestamp = max(
+        (i['block_timestamp'] for i in records), default=None)
+    execute_query(upsert_wallet_sync, {'wallet_address': wallet_address,
+                                       'last_block_timestamp': last_block_timestamp})
+    if balance_data:
+        # a snapshot write computed from the old balances may have merged between the first
+        # pass and the sync update; writes merging after it are dropped by upsert_pnl_snapshot
+        invalidate_balance_snapshots(wallet_address, records)
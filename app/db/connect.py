@@ -1,10 +1,13 @@
+import csv
 from dotenv import load_dotenv
+import io
 import os
 import pandas as pd
 import pg8000
+import pg8000.native
 from sqlalchemy import create_engine, URL, text
-from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import DBAPIError
+import threading
 import time
 
 load_dotenv()
@@ -14,6 +17,15 @@ DB_PORT = os.getenv("DB_PORT")
 DB_NAME = os.getenv("DB_NAME")
 DB_PW = os.getenv("DB_PW")
 
+# separate pools so ELT bulk loads and API writes can't take the connections API reads need
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", 10))
+DB_READ_MAX_OVERFLOW = int(os.getenv("DB_READ_MAX_OVERFLOW", 10))
+DB_WRITE_POOL_SIZE = int(os.getenv("DB_WRITE_POOL_SIZE", 4))
+DB_WRITE_MAX_OVERFLOW = int(os.getenv("DB_WRITE_MAX_OVERFLOW", 2))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+# rows fetched per round trip when streaming results from a server-side cursor
+DB_FETCH_SIZE = int(os.getenv("DB_FETCH_SIZE", 10000))
+
 url_obj = URL.create(
     "postgresql+pg8000",
     username=DB_USER,
@@ -23,17 +35,107 @@ url_obj = URL.create(
     password=DB_PW
 )
 
-engine = create_engine(url_obj, pool_pre_ping=True, pool_recycle=1800)
 
-Session = sessionmaker(bind=engine)
+class CheckoutStats:
+    """
+    Thread-safe counters of how long callers waited for a pooled connection.
+    """
+
+    def __init__(self):
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds, timed_out=False):
+        with self.lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+
+def create_pool_engine(name, pool_size, max_overflow):
+    return create_engine(url_obj, pool_size=pool_size, max_overflow=max_overflow,
+                         pool_timeout=DB_POOL_TIMEOUT, pool_pre_ping=True, pool_recycle=1800,
+                         connect_args={'application_name': f'pnl-{name}'})
+
+
+read_engine = create_pool_engine('read', DB_READ_POOL_SIZE, DB_READ_MAX_OVERFLOW)
+write_engine = create_pool_engine('write', DB_WRITE_POOL_SIZE, DB_WRITE_MAX_OVERFLOW)
+engine = write_engine
+
+checkout_stats = {'read': CheckoutStats(), 'write': CheckoutStats()}
+engines = {'read': read_engine, 'write': write_engine}
 
 MAX_RETRIES = 3
 RETRY_BACKOFF = 2
 
 
+def checkout(name, raw=False):
+    """
+    Check a connection out of the read or write pool, recording the wait.
+
+    Parameters:
+    - name (str): 'read' or 'write'.
+    - raw (bool): Optional argument, default False. Return the DBAPI connection instead
+      of a SQLAlchemy Connection.
+
+    Returns:
+    Connection: Pooled connection, close it to return it to the pool.
+    """
+    start = time.perf_counter()
+    try:
+        conn = engines[name].raw_connection() if raw else engines[name].connect()
+    except Exception:
+        checkout_stats[name].record(time.perf_counter() - start, timed_out=True)
+        raise
+    checkout_stats[name].record(time.perf_counter() - start)
+    return conn
+
+
+def pool_stats():
+    """
+    Return the state of the read and write pools and their checkout wait times.
+
+    Returns:
+    Dict: Per pool size, checked_out, overflow, checkouts, wait_total_seconds,
+    wait_max_seconds and timeouts.
+    """
+    stats = {}
+    for name, pool_engine in engines.items():
+        pool = pool_engine.pool
+        checkouts = checkout_stats[name]
+        with checkouts.lock:
+            stats[name] = {'size': pool.size(), 'checked_out': pool.checkedout(),
+                           'overflow': max(0, pool.overflow()), 'checkouts': checkouts.checkouts,
+                           'wait_total_seconds': checkouts.wait_total,
+                           'wait_max_seconds': checkouts.wait_max, 'timeouts': checkouts.timeouts}
+    return stats
+
+
+def listen_connection(name='listen'):
+    """
+    Open a dedicated connection outside the pools for LISTEN, which has to hold its
+    connection for as long as it wants notifications.
+
+    Parameters:
+    - name (str): Optional argument, default 'listen'. Suffix of the application_name.
+
+    Returns:
+    pg8000.native.Connection: Connection, notifications arrive in its notifications deque.
+    """
+    return pg8000.native.Connection(DB_USER, host=DB_HOST or 'localhost',
+                                    port=int(DB_PORT or 5432), database=DB_NAME,
+                                    password=DB_PW, application_name=f'pnl-{name}')
+
+
 def execute_query(query, *args):
     """
-    Executes a given SQL query using SQLAlchemy and commits the transaction.
+    Executes a given SQL query on the write pool and commits the transaction.
 
     This function attempts to execute a provided SQL query and commit the changes.
     If a DBAPIError occurs during execution, the function will rollback the transaction,
@@ -44,29 +146,28 @@ def execute_query(query, *args):
     - *args: args/data that is passed to the query.
 
     Returns:
-    - result: The result of the executed query. The type of this result can vary depending
-              on the query (e.g., raw results for SELECT, None for INSERT/UPDATE/DELETE).
-
+    - list or int: Fetched rows for queries returning rows, otherwise the affected row count.
     """
     for attempt in range(MAX_RETRIES):
-        session = Session()
+        conn = checkout('write')
         try:
-            result = session.execute(text(query), *args)
-            session.commit()
-            return result
+            result = conn.execute(text(query), *args)
+            rows = result.all() if result.returns_rows else result.rowcount
+            conn.commit()
+            return rows
         except DBAPIError as e:
-            session.rollback()
+            conn.rollback()
             print(f"Attempt {attempt + 1} failed with error: {e}")
             time.sleep(RETRY_BACKOFF ** attempt)
             if attempt == MAX_RETRIES - 1:
                 raise e
         finally:
-            session.close()
+            conn.close()
 
 
-def execute_pd(query, *args):
+def execute_pd(query, params=None, chunksize=None, dtype=None):
     """
-    Executes a given SQL query using SQLAlchemy and pandas to return a DataFrame.
+    Executes a given SQL query on the read pool and returns a DataFrame.
 
     This function attempts to execute a provided SQL query and fetch the result as a pandas DataFrame.
     If a DBAPIError occurs during the query execution, the function will rollback the transaction,
@@ -74,19 +175,76 @@ def execute_pd(query, *args):
 
     Parameters:
     - query (str): The SQL query to be executed.
-    - *args: Positional arguments that will be passed to the query as parameters.
+    - params (dict): Optional bound parameters for the query, referenced as :name in the SQL.
+    - chunksize (int): Optional argument. Stream the result through a server-side cursor,
+      chunksize rows per fetch, instead of buffering every row before building the frame.
+    - dtype (dict): Optional column dtypes, applied as each frame is built so numeric
+      columns are typed even when the result is empty or all NULL.
 
     Returns:
     - DataFrame: A pandas DataFrame containing the results of the query.
     """
     for attempt in range(MAX_RETRIES):
-        with Session() as session:
-            try:
-                result = pd.read_sql(query, session.bind, params=args)
-                return result
-            except DBAPIError as e:
-                session.rollback()
-                print(f"Attempt {attempt + 1} failed with error: {e}")
-                time.sleep(RETRY_BACKOFF ** attempt)
-                if attempt == MAX_RETRIES - 1:
-                    raise e
+        conn = checkout('read')
+        try:
+            if chunksize is None:
+                return pd.read_sql(text(query), conn, params=params, dtype=dtype)
+
+            conn = conn.execution_options(
+                stream_results=True, max_row_buffer=chunksize)
+            chunks = pd.read_sql(text(query), conn, params=params, chunksize=chunksize,
+                                 dtype=dtype)
+            return pd.concat(chunks, ignore_index=True)
+        except DBAPIError as e:
+            conn.rollback()
+            print(f"Attempt {attempt + 1} failed with error: {e}")
+            time.sleep(RETRY_BACKOFF ** attempt)
+            if attempt == MAX_RETRIES - 1:
+                raise e
+        finally:
+            conn.close()
+
+
+def execute_copy(query, rows, before=(), after=()):
+    """
+    Streams rows into Postgres with COPY ... FROM STDIN and commits the transaction.
+
+    The rows are written to an in-memory CSV buffer and passed to pg8000 as the COPY
+    stream on a raw DBAPI connection from the write pool. Failed attempts are rolled
+    back and retried with the same backoff as execute_query.
+
+    Parameters:
+    - query (str): COPY ... FROM STDIN WITH (FORMAT csv) statement.
+    - rows (list): Row tuples in the column order of the COPY statement.
+    - before (tuple): Optional statements run in the same transaction before the COPY,
+      e.g. creating a temporary staging table.
+    - after (tuple): Optional statements run in the same transaction after the COPY,
+      e.g. merging the staging table into its target.
+
+    Returns:
+    - int: Number of rows copied.
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+
+    for attempt in range(MAX_RETRIES):
+        buffer.seek(0)
+        conn = checkout('write', raw=True)
+        try:
+            cursor = conn.cursor()
+            for statement in before:
+                cursor.execute(statement)
+            cursor.execute(query, stream=buffer)
+            copied = cursor.rowcount
+            for statement in after:
+                cursor.execute(statement)
+            conn.commit()
+            return copied
+        except pg8000.dbapi.DatabaseError as e:
+            conn.rollback()
+            print(f"Attempt {attempt + 1} failed with error: {e}")
+            time.sleep(RETRY_BACKOFF ** attempt)
+            if attempt == MAX_RETRIES - 1:
+                raise e
+        finally:
+            conn.close()
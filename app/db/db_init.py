@@ -1,5 +1,7 @@
 from dotenv import load_dotenv
-from queries import db_exists, create_db, create_schemas, create_src_price_history, create_src_elt_log
+from datetime import datetime
+from partitions import price_history_partitions, next_month
+from queries import db_exists, create_db, create_schemas, create_src_price_history, create_src_price_history_indexes, create_src_elt_log, create_src_elt_log_indexes, create_stg_price_history, create_src_price_watermark, create_src_wallet_balance, create_src_wallet_sync, create_src_price_rollup, create_src_pnl_snapshot, create_src_asset_precision, rebuild_price_rollup, rollup_resolutions, get_src_price_history_kind, rename_unpartitioned_price_history, get_unpartitioned_price_history_range, migrate_unpartitioned_price_history
 import os
 import pg8000
 
@@ -37,14 +39,57 @@ with init_conn.cursor() as cur:
     init_conn.close()
 
 conn = create_conn(DB_NAME)
-run_list = [create_schemas, create_src_price_history, create_src_elt_log]
+run_list = [create_src_price_history_indexes,
+            create_src_elt_log, create_src_elt_log_indexes, create_stg_price_history,
+            create_src_price_watermark, create_src_wallet_balance, create_src_wallet_sync,
+            create_src_price_rollup, create_src_pnl_snapshot, create_src_asset_precision]
+run_list += [rebuild_price_rollup.format(resolution=resolution, bucket=bucket)
+             for resolution, bucket in rollup_resolutions.items()]
+
+
+def migrate_price_history(cur):
+    """
+    Create the range partitioned SRC.PRICE_HISTORY. If an unpartitioned table from an
+    earlier version exists, it is renamed, its rows are copied into monthly partitions
+    and it is dropped, all inside the caller's transaction.
+
+    Parameters:
+    - cur (pg8000.Cursor): Cursor on the app database.
+
+    Returns:
+    None
+    """
+    cur.execute(get_src_price_history_kind)
+    kind = cur.fetchone()
+    unpartitioned = kind is not None and kind[0] == 'r'
+
+    if unpartitioned:
+        cur.execute(rename_unpartitioned_price_history)
+    cur.execute(create_src_price_history)
+
+    if unpartitioned:
+        cur.execute(get_unpartitioned_price_history_range)
+        min_ts, max_ts = cur.fetchone()
+        if min_ts is not None:
+            for statement in price_history_partitions(min_ts, max_ts):
+                cur.execute(statement)
+        cur.execute(migrate_unpartitioned_price_history)
+
+    # current and next month, the ELT creates later ones as data arrives
+    now = datetime.utcnow()
+    for statement in price_history_partitions(now, next_month(now)):
+        cur.execute(statement)
+
 
 with conn.cursor() as cur:
     try:
+        cur.execute(create_schemas)
+        migrate_price_history(cur)
         for i in run_list:
             cur.execute(i)
         conn.commit()
         message = 'successfully commited migrations'
     except Exception as e:
+        conn.rollback()
         message = e
     print(message)
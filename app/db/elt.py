@@ -1,9 +1,16 @@
-from connect import execute_query
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from connect import execute_query, execute_copy, execute_pd
 from datetime import datetime
 from dotenv import load_dotenv
+from metrics import metrics, profiled
 import os
-from queries import create_stg_price_history, drop_stg_price_history, load_stg_price_history, load_src_price_history, create_src_elt_log, insert_elt_log
+from partitions import price_history_partitions, unix_ms_range, next_month
+from price_store import write_series, write_generation, PRICE_STORE_DIR
+from queries import create_stg_price_history, truncate_stg_price_history, load_stg_price_history, copy_stg_price_history, load_stg_price_history_values, load_src_price_history, insert_new_src_price_history, create_src_price_watermark, get_price_watermarks, upsert_price_watermark, create_src_price_rollup, refresh_price_rollup, rollup_resolutions, invalidate_pnl_snapshot_prices, create_src_elt_log, insert_elt_log, notify_elt_job, get_latest_job_ts, get_price_rollup_series, get_price_rollup_assets, create_src_asset_precision, get_asset_precision, upsert_asset_precision
+from rate_limit import TokenBucket
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import HTTPError, ConnectionError, Timeout, InvalidURL
 import time
 
@@ -11,15 +18,61 @@ import time
 load_dotenv()
 
 COINGECKO_API_KEY = os.getenv('COINGECKO_API_KEY')
+ELT_LOAD_MODE = os.getenv('ELT_LOAD_MODE', 'copy')
+ELT_VALUES_BATCH_SIZE = int(os.getenv('ELT_VALUES_BATCH_SIZE', 1000))
+ELT_WORKERS = int(os.getenv('ELT_WORKERS', 4))
+ELT_TOP_N = int(os.getenv('ELT_TOP_N', 10))
+COINGECKO_RATE_PER_MINUTE = int(os.getenv('COINGECKO_RATE_PER_MINUTE', 30))
+ELT_MODE = os.getenv('ELT_MODE', 'incremental')
+# Coingecko returns hourly points for ranges up to 90 days
+ELT_CHUNK_DAYS = int(os.getenv('ELT_CHUNK_DAYS', 90))
+ELT_BACKFILL_MAX_CHUNKS = int(os.getenv('ELT_BACKFILL_MAX_CHUNKS', 80))
+ELT_INITIAL_DAYS = 7
+# optional node_exporter textfile for the run's stage timings, and cProfile output dir
+ELT_METRICS_FILE = os.getenv('ELT_METRICS_FILE')
+ELT_PROFILE_DIR = os.getenv('ELT_PROFILE_DIR')
 
-coingecko_api_base = 'https://api.coingecko.com/api/v3'
+coingecko_api_base = os.getenv(
+    'COINGECKO_API_BASE', 'https://api.coingecko.com/api/v3')
+markets_page_size = 250
 endpoints = {
     'coins_market_cap_desc': '/coins/markets',
-    'market_data': '/coins/{id}/market_chart'
+    'market_data': '/coins/{id}/market_chart',
+    'market_data_range': '/coins/{id}/market_chart/range',
+    'coin_detail': '/coins/{id}'
 }
 
 
-def extract_data(base, endpoint, key, retries=3, delay=60, **kwargs):
+def create_session(pool_size=ELT_WORKERS):
+    """
+    Create a requests Session with a keep-alive connection pool sized for the
+    extraction workers.
+
+    Parameters:
+    - pool_size (int): Optional argument, default ELT_WORKERS. Max pooled connections.
+
+    Returns:
+    requests.Session: Session shared by extraction workers.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def retry_after_seconds(resp, default):
+    """
+    Parse the Retry-After header of a rate limited response in seconds,
+    falling back to default when it is missing or not a number.
+    """
+    try:
+        return float(resp.headers['Retry-After'])
+    except (KeyError, ValueError):
+        return default
+
+
+def extract_data(base, endpoint, key, retries=3, delay=60, session=None, limiter=None, **kwargs):
     """
     Make a GET request and return the JSON response.
 
@@ -28,7 +81,10 @@ def extract_data(base, endpoint, key, retries=3, delay=60, **kwargs):
     - endpoint (str): API endpoint.
     - key (str): API key for authentication.
     - retries (int): Number of retries for rate limit errors.
-    - delay (int): Delay between retries in seconds.
+    - delay (int): Delay between retries in seconds, used when no Retry-After header is sent.
+    - session (requests.Session): Optional pooled session, a new connection is used if None.
+    - limiter (TokenBucket): Optional rate limiter shared across workers. A 429 pauses it
+      for Retry-After seconds so every worker backs off.
     - **kwargs: Additional query parameters.
 
     Returns:
@@ -37,17 +93,24 @@ def extract_data(base, endpoint, key, retries=3, delay=60, **kwargs):
     headers = {'x-cg-api-key': key}
     url = f"{base}{endpoint}"
     params = kwargs
+    http = session or requests
 
     for attempt in range(retries + 1):
+        if limiter:
+            metrics.observe('rate_limit_wait_seconds', limiter.acquire())
         try:
-            resp = requests.get(url, headers=headers, params=params)
+            resp = http.get(url, headers=headers, params=params)
             resp.raise_for_status()
             return resp.json()
         except requests.exceptions.HTTPError as e:
             # handle rate limit error
             if resp.status_code == 429:
-                print(f"Rate limit reached. Retrying in {delay} seconds...")
-                time.sleep(delay)
+                wait = retry_after_seconds(resp, delay)
+                print(f"Rate limit reached. Retrying in {wait} seconds...")
+                if limiter:
+                    limiter.pause(wait)
+                else:
+                    time.sleep(wait)
             else:
                 print(f"HTTP error occurred: {e}")
                 return None
@@ -62,44 +125,338 @@ def extract_data(base, endpoint, key, retries=3, delay=60, **kwargs):
     return None
 
 
-def load_data(coin_id, price_data):
+def extract_coin_ids(api_base_url, endpoints, api_key, top_n, session=None, limiter=None):
+    """
+    Page through the market cap endpoint and return the ids of the top_n coins.
+
+    Parameters:
+    - api_base_url (str): Base url for API calls
+    - endpoints (dict): Dictionary of Coingecko endpoints
+    - api_key (str): Coingecko API key
+    - top_n (int): Number of coins to return, ordered by market cap
+    - session (requests.Session): Optional pooled session
+    - limiter (TokenBucket): Optional rate limiter
+
+    Returns:
+    List: Coin ids
+    """
+    coin_ids = []
+    page = 1
+    while len(coin_ids) < top_n:
+        coin_data = extract_data(api_base_url, endpoints['coins_market_cap_desc'], api_key,
+                                 session=session, limiter=limiter, vs_currency='usd',
+                                 order='market_cap_desc', per_page=markets_page_size, page=page)
+        if not coin_data:
+            break
+        coin_ids.extend(i['id'] for i in coin_data)
+        page += 1
+    return coin_ids[:top_n]
+
+
+def extract_asset_precision(api_base_url, endpoints, api_key, coin_ids, session=None, limiter=None,
+                            workers=ELT_WORKERS):
+    """
+    Store the ERC-20 token decimals of coins missing from SRC.ASSET_PRECISION, read from
+    the Ethereum entry of the coin detail endpoint. Requests run on a thread pool under
+    the shared rate limiter and the results are upserted in one batch. Coins without an
+    Ethereum entry are stored with NULL decimals so they are not requested again; failed
+    requests are retried next run.
+
+    Parameters:
+    - api_base_url (str): Base url for API calls
+    - endpoints (dict): Dictionary of Coingecko endpoints
+    - api_key (str): Coingecko API key
+    - coin_ids (list): Coins to check
+    - session (requests.Session): Optional pooled session
+    - limiter (TokenBucket): Optional rate limiter
+    - workers (int): Optional argument, default ELT_WORKERS. Request threads.
+
+    Returns:
+    Int: Coins stored.
+    """
+    known = set(execute_pd(get_asset_precision, {'assets': list(coin_ids)})['asset'])
+    missing = [coin_id for coin_id in coin_ids if coin_id not in known]
+
+    def extract_coin_precision(coin_id):
+        coin_data = extract_data(api_base_url, endpoints['coin_detail'].format(id=coin_id), api_key,
+                                 session=session, limiter=limiter, localization='false',
+                                 tickers='false', market_data='false', community_data='false',
+                                 developer_data='false')
+        if coin_data is None:
+            return None
+        platform = (coin_data.get('detail_platforms') or {}).get('ethereum') or {}
+        return {'asset': coin_id, 'decimals': platform.get('decimal_place')}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        precision_data = [i for i in executor.map(extract_coin_precision, missing) if i is not None]
+    if precision_data:
+        execute_query(upsert_asset_precision, precision_data)
+    return len(precision_data)
+
+
+def extract_price_range(api_base_url, endpoints, api_key, coin_id, from_unix, to_unix,
+                        session=None, limiter=None):
+    """
+    Extract price data between two unix times (seconds) from the market chart range
+    endpoint, one request per ELT_CHUNK_DAYS chunk.
+
+    Parameters:
+    - api_base_url (str): Base url for API calls
+    - endpoints (dict): Dictionary of Coingecko endpoints
+    - api_key (str): Coingecko API key
+    - coin_id (str): Coin to extract prices for
+    - from_unix (int): Range start in unix seconds
+    - to_unix (int): Range end in unix seconds
+    - session (requests.Session): Optional pooled session
+    - limiter (TokenBucket): Optional rate limiter
+
+    Returns:
+    List: [unix_ms, price] pairs, empty if any chunk failed so the coin is skipped
+    """
+    formatted_endpoint = endpoints['market_data_range'].format(id=coin_id)
+    chunk_seconds = ELT_CHUNK_DAYS * 86400
+    price_data = []
+    chunk_start = from_unix
+    while chunk_start < to_unix:
+        chunk_end = min(chunk_start + chunk_seconds, to_unix)
+        data = extract_data(api_base_url, formatted_endpoint, api_key, session=session,
+                            limiter=limiter, vs_currency='usd', **{'from': chunk_start, 'to': chunk_end})
+        if not data or data.get('prices') is None:
+            print(f"no price data for {coin_id} from {chunk_start} to {chunk_end}, skipping")
+            return []
+        price_data.extend(data['prices'])
+        chunk_start = chunk_end
+    return price_data
+
+
+def extract_backfill(api_base_url, endpoints, api_key, coin_id, before_unix,
+                     session=None, limiter=None):
+    """
+    Page backwards through a coin's history in ELT_CHUNK_DAYS chunks, starting at
+    before_unix, until a chunk comes back empty (the coin's genesis) or
+    ELT_BACKFILL_MAX_CHUNKS chunks have been read.
+
+    Parameters:
+    - api_base_url (str): Base url for API calls
+    - endpoints (dict): Dictionary of Coingecko endpoints
+    - api_key (str): Coingecko API key
+    - coin_id (str): Coin to extract prices for
+    - before_unix (int): Unix seconds to backfill from, exclusive
+    - session (requests.Session): Optional pooled session
+    - limiter (TokenBucket): Optional rate limiter
+
+    Returns:
+    List: [unix_ms, price] pairs in time order
+    """
+    chunk_seconds = ELT_CHUNK_DAYS * 86400
+    price_data = []
+    chunk_end = before_unix
+    for _ in range(ELT_BACKFILL_MAX_CHUNKS):
+        chunk_start = chunk_end - chunk_seconds
+        chunk_data = extract_price_range(api_base_url, endpoints, api_key, coin_id,
+                                         chunk_start, chunk_end, session, limiter)
+        chunk_data = [i for i in chunk_data if i[0] < chunk_end * 1000]
+        if not chunk_data:
+            break
+        price_data = chunk_data + price_data
+        chunk_end = chunk_start
+    return price_data
+
+
+def extract_prices(api_base_url, endpoints, api_key, coin_id, mode='full', watermark=None,
+                   session=None, limiter=None):
+    """
+    Extract price data for a coin.
+
+    Parameters:
+    - api_base_url (str): Base url for API calls
+    - endpoints (dict): Dictionary of Coingecko endpoints
+    - api_key (str): Coingecko API key
+    - coin_id (str): Coin to extract prices for
+    - mode (str): 'full' extracts the last 7 days of hourly prices. 'incremental' extracts
+      only prices after the coin's watermark (7 days for a new coin). 'backfill' extracts
+      history before the earliest loaded price back to the coin's genesis.
+    - watermark (tuple): (first_unix_time, last_unix_time) in ms of loaded prices, or None
+    - session (requests.Session): Optional pooled session
+    - limiter (TokenBucket): Optional rate limiter
+
+    Returns:
+    List: [unix_ms, price] pairs
+    """
+    now_unix = int(time.time())
+
+    if mode == 'incremental':
+        if watermark:
+            last_unix_time = watermark[1]
+            from_unix = last_unix_time // 1000 + 1
+        else:
+            last_unix_time = -1
+            from_unix = now_unix - ELT_INITIAL_DAYS * 86400
+        price_data = extract_price_range(api_base_url, endpoints, api_key, coin_id,
+                                         from_unix, now_unix, session, limiter)
+        return [i for i in price_data if i[0] > last_unix_time]
+
+    if mode == 'backfill':
+        before_unix = watermark[0] // 1000 if watermark else now_unix
+        return extract_backfill(api_base_url, endpoints, api_key, coin_id,
+                                before_unix, session, limiter)
+
+    formatted_endpoint = endpoints['market_data'].format(id=coin_id)
+    data = extract_data(api_base_url, formatted_endpoint, api_key,
+                        session=session, limiter=limiter, vs_currency='usd', days='7')
+    if not data or data.get('prices') is None:
+        print(f"no price data for {coin_id}, skipping")
+        return []
+    return data['prices']
+
+
+def get_watermarks():
+    """
+    Read the per-asset high-water marks of loaded price data.
+
+    Returns:
+    Dict: asset -> (first_unix_time, last_unix_time) in ms
+    """
+    watermarks_df = execute_pd(get_price_watermarks)
+    return {row.asset: (int(row.first_unix_time), int(row.last_unix_time))
+            for row in watermarks_df.itertuples()}
+
+
+def load_values(rows, batch_size=ELT_VALUES_BATCH_SIZE):
+    """
+    Load rows into the STG table with multi-row INSERT ... VALUES statements.
+    Fallback for load_data when COPY is not available.
+
+    Parameters:
+    - rows (list): (unix_time, price, asset) tuples
+    - batch_size (int): Optional argument, default ELT_VALUES_BATCH_SIZE. Rows per INSERT.
+
+    Returns:
+    None
+    """
+    for batch_start in range(0, len(rows), batch_size):
+        batch = rows[batch_start:batch_start + batch_size]
+        placeholders = ', '.join(
+            f"(:unix_time_{i}, :price_{i}, :asset_{i})" for i in range(len(batch)))
+        params = {}
+        for i, (unix_time, price, asset) in enumerate(batch):
+            params[f'unix_time_{i}'] = unix_time
+            params[f'price_{i}'] = price
+            params[f'asset_{i}'] = asset
+        execute_query(
+            load_stg_price_history_values.format(values=placeholders), params)
+
+
+def load_data(coin_id, price_data, mode=ELT_LOAD_MODE):
     """
     Load extracted price data from API into STG table.
+    The persistent unlogged STG table is truncated rather than dropped and recreated.
 
     Parameters:
     - coin_id (str): Coin being loaded
     - price_data (str): Extracted api price data
+    - mode (str): Optional argument, default ELT_LOAD_MODE. 'copy' streams rows with
+      COPY FROM STDIN, 'values' uses batched multi-row INSERTs, 'insert' uses one
+      INSERT per row.
+
+    Returns:
+    Int: Number of rows loaded
+    """
+    execute_query(truncate_stg_price_history)
+    rows = [(ts, price, coin_id) for ts, price in price_data]
+
+    if mode == 'copy':
+        execute_copy(copy_stg_price_history, rows)
+    elif mode == 'values':
+        load_values(rows)
+    else:
+        price_asset_data = [{'unix_time': ts, 'price': price,
+                             'asset': asset} for ts, price, asset in rows]
+        execute_query(load_stg_price_history, price_asset_data)
+    return len(rows)
+
+
+def create_partitions(price_data):
+    """
+    Create any SRC.PRICE_HISTORY partitions needed for the extracted price data,
+    plus the partition for next month so inserts never hit a missing range.
+
+    Parameters:
+    - price_data (list): Extracted api price data
 
     Returns:
     None
     """
-    drop_stg_result = execute_query(drop_stg_price_history)
-    create_stg_result = execute_query(create_stg_price_history)
-    price_asset_data = [{'unix_time': ts, 'price': price,
-                         'asset': coin_id} for ts, price in price_data]
-    insert_data_result = execute_query(
-        load_stg_price_history, price_asset_data)
+    start, end = unix_ms_range(price_data)
+    end = max(end, next_month(datetime.utcnow()))
+    for statement in price_history_partitions(start, end):
+        execute_query(statement)
 
 
-def transform_data(job_start_ts):
+def transform_data(job_start_ts, mode='full'):
     """
     Execute query to transform raw data and load into SRC table. 
     Insert job_start_ts into SRC table for job run tracking and use by API.
+    Advance the asset's watermark to cover the STG data and refresh the
+    5m/1h/1d price rollup buckets it touches. PnL snapshots from the first day
+    of the new prices are dropped so the API recomputes them.
 
     Parameters:
     - job_start_ts (datetime.datetime): timestamp when job was started
+    - mode (str): 'full' updates job_start_ts on existing rows, other modes only
+      insert rows that are not loaded yet
 
     Returns:
     None
     """
-    formated_load_src_price_history = load_src_price_history.format(
-        job_start_ts=job_start_ts)
+    query = load_src_price_history if mode == 'full' else insert_new_src_price_history
+    formated_load_src_price_history = query.format(job_start_ts=job_start_ts)
     load_src_result = execute_query(formated_load_src_price_history)
+    execute_query(upsert_price_watermark)
+    for resolution, bucket in rollup_resolutions.items():
+        execute_query(refresh_price_rollup.format(
+            resolution=resolution, bucket=bucket))
+    execute_query(invalidate_pnl_snapshot_prices)
+
+
+def export_price_store(assets=None, root=PRICE_STORE_DIR, job_start_ts=None):
+    """
+    Export the closing prices of every rollup resolution to the memory-mapped price
+    store the API reads, one file per resolution and asset. Does nothing when root is unset.
+    Once every file is written the store is marked with job_start_ts; the API only reads
+    a store whose mark matches the latest successful job.
+
+    Parameters:
+    - assets (list): Optional argument. Assets to export, defaults to every asset in SRC.PRICE_ROLLUP.
+    - root (str): Optional argument, default PRICE_STORE_DIR. Price store directory.
+    - job_start_ts (datetime.datetime): Optional argument. Job the export belongs to,
+      defaults to the latest successful job in SRC.ELT_LOG.
+
+    Returns:
+    None
+    """
+    if not root:
+        return
+    if assets is None:
+        assets = execute_pd(get_price_rollup_assets)['asset'].tolist()
+    for asset in assets:
+        with metrics.span('export', coin=asset):
+            for resolution in rollup_resolutions:
+                series_df = execute_pd(get_price_rollup_series,
+                                       {'resolution': resolution, 'asset': asset})
+                write_series(root, resolution, asset, series_df)
+    if job_start_ts is None:
+        job_ts = execute_pd(get_latest_job_ts)['job_start_ts'].dropna()
+        job_start_ts = job_ts.iloc[0] if len(job_ts) else None
+    if job_start_ts is not None:
+        write_generation(root, job_start_ts)
+    print(f"exported {len(assets)} assets to {root}")
 
 
 def log_job_run(job_start_ts, status, error):
     """
-    Log job meta data to log table in database
+    Log job meta data to log table in database. Successful runs also notify the
+    elt_job channel so API processes drop their cached prices.
 
     Parameters:
     - job_start_ts (datetime.datetime): Coin being loaded
@@ -112,55 +469,140 @@ def log_job_run(job_start_ts, status, error):
     job_data = [{'job_start_ts': job_start_ts,
                  'status': status, 'error': error}]
     load_job_data = execute_query(insert_elt_log, job_data)
+    if status == 'success':
+        execute_query(notify_elt_job, {'job_start_ts': job_start_ts})
 
 
-def main(api_base_url, endpoints, api_key):
+def coin_timings(coin_id):
+    """
+    Format the extract/load/transform seconds recorded for a coin in this run.
+    """
+    timings = {dict(labels)['stage']: seconds for labels, (_, seconds) in metrics.summary().items()
+               if dict(labels).get('coin') == coin_id}
+    return ', '.join(f"{stage} {seconds:.2f}s" for stage, seconds in timings.items())
+
+
+def write_metrics(path=ELT_METRICS_FILE):
+    """
+    Write the run's metrics in Prometheus text format, e.g. for the node_exporter
+    textfile collector. Does nothing when path is unset.
+    """
+    if not path:
+        return
+    with open(path, 'w') as f:
+        f.write(metrics.render())
+
+
+def main(api_base_url, endpoints, api_key, top_n=ELT_TOP_N, workers=ELT_WORKERS,
+         rate_per_minute=COINGECKO_RATE_PER_MINUTE, mode=ELT_MODE):
     """
     Run ELT flow:
         - Extract market cap data from Coingecko API
-        - Extract top 10 coins in market cap from market cap data
-        - For each coin in top 10:
-            - Extract 7 day hourly price data for each coin in top 10 market cap list
-            - Load price data to table in STG schema
-            - Transform STG data and load price data to SRC table via SQL query
+        - Extract top_n coins in market cap from market cap data
+        - Extract price data for each coin concurrently on a thread pool, sharing one
+          token bucket rate limiter and a pooled session. Incremental mode only requests
+          prices after each coin's watermark, backfill mode pages back to genesis.
+        - As each extraction finishes, recording extract/load/transform timings per coin:
+            - Load price data to table in STG schema, reporting rows/sec for the run
+            - Transform STG data and load price data to SRC table via SQL query,
+              then refresh the price rollups for the loaded range
+          Loading runs on the main thread, so DB writes overlap the remaining network waits
+        - Export the loaded coins' price series to PRICE_STORE_DIR when set
         -Log flow result to DB table
+        - Store token decimals of coins new to SRC.ASSET_PRECISION
 
     Parameters:
     - api_base_url (str): Base url for API calls
     - endpoints (dict): Dictionary of Coingecko endpoints 
     - apikey (str): Coingecko API key
+    - top_n (int): Optional argument, default ELT_TOP_N. Number of coins to load.
+    - workers (int): Optional argument, default ELT_WORKERS. Extraction threads.
+    - rate_per_minute (int): Optional argument, default COINGECKO_RATE_PER_MINUTE.
+      Coingecko request quota shared by all workers.
+    - mode (str): Optional argument, default ELT_MODE. 'incremental', 'backfill' or 'full'.
 
     Returns:
     None
     """
     job_start_ts = datetime.now()
+    rows_loaded = 0
+    loaded_coins = []
+    load_seconds = 0.0
+    session = create_session(workers)
+    limiter = TokenBucket(rate_per_minute)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    coin_ids = []
     try:
-        coin_data = extract_data(api_base_url,
-                                 endpoints['coins_market_cap_desc'], api_key, vs_currency='usd', order='market_cap_desc')
-        top_10 = coin_data[:10]
-        coin_ids = [i['id'] for i in top_10]
-
-        for coin_id in coin_ids:
-            formatted_endpoint = endpoints['market_data'].format(id=coin_id)
-            data = extract_data(
-                api_base_url, formatted_endpoint, api_key, vs_currency='usd', days='7')
-            price_data = data['prices']
-            price_data_len = len(price_data)
-            # remove last element in list which is not an hourly candle
-            hourly_price_data = price_data[:price_data_len]
-            load_data(coin_id, price_data)
-            print(f"loaded data for {coin_id}")
-
-            transform_data(job_start_ts)
+        execute_query(create_stg_price_history)
+        execute_query(create_src_price_watermark)
+        execute_query(create_src_price_rollup)
+        execute_query(create_src_asset_precision)
+        watermarks = get_watermarks()
+        coin_ids = extract_coin_ids(
+            api_base_url, endpoints, api_key, top_n, session, limiter)
+
+        def extract_coin(coin_id):
+            with metrics.span('extract', coin=coin_id):
+                return extract_prices(api_base_url, endpoints, api_key, coin_id,
+                                      mode, watermarks.get(coin_id), session, limiter)
+
+        futures = {executor.submit(extract_coin, coin_id): coin_id
+                   for coin_id in coin_ids}
+        for future in as_completed(futures):
+            coin_id = futures[future]
+            price_data = future.result()
+            if not price_data:
+                print(f"no new data for {coin_id}")
+                continue
+            load_start = time.perf_counter()
+            with metrics.span('load', coin=coin_id):
+                rows_loaded += load_data(coin_id, price_data)
+            load_seconds += time.perf_counter() - load_start
+
+            with metrics.span('transform', coin=coin_id):
+                create_partitions(price_data)
+                transform_data(job_start_ts, mode)
+            loaded_coins.append(coin_id)
+            print(f"loaded data for {coin_id}: {coin_timings(coin_id)}")
         print("Data loaded to SRC")
+        export_price_store(loaded_coins, job_start_ts=job_start_ts)
+        if load_seconds:
+            print(f"STG load ({ELT_LOAD_MODE}): {rows_loaded} rows in {load_seconds:.2f}s, "
+                  f"{rows_loaded / load_seconds:.0f} rows/sec")
         status = 'success'
         error = ''
     except Exception as e:
         error = e
         status = 'error'
+    finally:
+        executor.shutdown(cancel_futures=True)
 
     log_job_run(job_start_ts, status, error)
 
+    # token decimals only matter for precise output, so they are fetched after the job
+    # is logged and its prices are already being served
+    try:
+        with metrics.span('asset_precision'):
+            stored = extract_asset_precision(api_base_url, endpoints, api_key, coin_ids,
+                                             session, limiter, workers)
+        print(f"stored token decimals for {stored} coins")
+    except Exception as e:
+        print(f"token decimals not updated: {e}")
+    finally:
+        session.close()
+        write_metrics()
+
 
 if __name__ == '__main__':
-    main(coingecko_api_base, endpoints, COINGECKO_API_KEY)
+    parser = argparse.ArgumentParser(description='Load Coingecko price data')
+    parser.add_argument('--mode', choices=['incremental', 'backfill', 'full'], default=ELT_MODE,
+                        help='incremental loads prices after each watermark, backfill loads '
+                        'history back to genesis, full reloads the last 7 days')
+    parser.add_argument('--export-store', action='store_true',
+                        help='only export every asset in SRC.PRICE_ROLLUP to PRICE_STORE_DIR')
+    args = parser.parse_args()
+    with profiled(ELT_PROFILE_DIR, 'elt'):
+        if args.export_store:
+            export_price_store()
+        else:
+            main(coingecko_api_base, endpoints, COINGECKO_API_KEY, mode=args.mode)
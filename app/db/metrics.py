@@ -0,0 +1,144 @@
+from contextlib import contextmanager
+import cProfile
+import os
+import threading
+import time
+
+# histogram buckets in seconds, from sub-ms numpy work to slow Allium polls
+default_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60, 300)
+
+
+class Metrics:
+    """
+    Thread-safe in-process registry of counters and histograms, rendered in the
+    Prometheus text exposition format. Series are keyed by metric name and labels.
+    """
+
+    def __init__(self, buckets=default_buckets):
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {
+                    'buckets': [0] * len(self.buckets), 'count': 0, 'sum': 0.0}
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+
+    @contextmanager
+    def span(self, stage, **labels):
+        """
+        Time a block and record it in the stage_seconds histogram under stage
+        and labels. Failed blocks are also counted in stage_errors_total.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc('stage_errors_total', stage=stage, **labels)
+            raise
+        finally:
+            self.observe('stage_seconds', time.perf_counter() - start,
+                         stage=stage, **labels)
+
+    def summary(self, name='stage_seconds'):
+        """
+        Return {labels: (count, total seconds)} for one histogram, e.g. for logging.
+        """
+        with self.lock:
+            return {labels: (h['count'], h['sum'])
+                    for (metric, labels), h in self.histograms.items() if metric == name}
+
+    def render(self):
+        """
+        Render all series in the Prometheus text format.
+
+        Returns:
+        Str: Exposition text for a /metrics endpoint or a node_exporter textfile.
+        """
+        def fmt(labels, extra=()):
+            pairs = [f'{k}="{v}"' for k, v in list(labels) + list(extra)]
+            return '{' + ','.join(pairs) + '}' if pairs else ''
+
+        lines = []
+        with self.lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f'# TYPE {name} counter')
+                for (metric, labels), value in sorted(self.counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{fmt(labels)} {value}')
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f'# TYPE {name} histogram')
+                for (metric, labels), h in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in zip(self.buckets, h['buckets']):
+                        lines.append(
+                            f'{name}_bucket{fmt(labels, [("le", bound)])} {count}')
+                    lines.append(
+                        f'{name}_bucket{fmt(labels, [("le", "+Inf")])} {h["count"]}')
+                    lines.append(f'{name}_sum{fmt(labels)} {h["sum"]:.6f}')
+                    lines.append(f'{name}_count{fmt(labels)} {h["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def start_profile():
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def dump_profile(profiler, profile_dir, name):
+    """
+    Stop a profiler from start_profile and dump its stats to profile_dir/<name>-<time>.prof,
+    readable with pstats or snakeviz.
+    """
+    profiler.disable()
+    os.makedirs(profile_dir, exist_ok=True)
+    profiler.dump_stats(os.path.join(
+        profile_dir, f'{name}-{time.time_ns()}.prof'))
+
+
+@contextmanager
+def profiled(profile_dir, name):
+    """
+    Run a block under cProfile and dump the stats with dump_profile.
+    Does nothing when profile_dir is empty.
+
+    Parameters:
+    - profile_dir (str): Directory for .prof files, created if missing.
+    - name (str): File name prefix, e.g. the endpoint.
+
+    Returns:
+    Generator: Context manager.
+    """
+    if not profile_dir:
+        yield
+        return
+
+    profiler = start_profile()
+    try:
+        yield
+    finally:
+        dump_profile(profiler, profile_dir, name)
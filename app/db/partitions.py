@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+from queries import create_src_price_history_partition
+
+
+def month_start(dt):
+    return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(dt):
+    return month_start(month_start(dt) + timedelta(days=32))
+
+
+def price_history_partitions(start, end):
+    """
+    Build CREATE TABLE statements for the monthly SRC.PRICE_HISTORY partitions
+    covering start through end. Partitions are created IF NOT EXISTS so the
+    statements can be run on every ELT run.
+
+    Parameters:
+    - start (datetime.datetime): Earliest timestamp that needs a partition.
+    - end (datetime.datetime): Latest timestamp that needs a partition.
+
+    Returns:
+    List: DDL statements, one per month.
+    """
+    statements = []
+    partition_start = month_start(start)
+    while partition_start <= end:
+        partition_end = next_month(partition_start)
+        statements.append(create_src_price_history_partition.format(
+            suffix=partition_start.strftime('%Y_%m'),
+            start=partition_start.strftime('%Y-%m-%d'),
+            end=partition_end.strftime('%Y-%m-%d')))
+        partition_start = partition_end
+    return statements
+
+
+def unix_ms_range(price_data):
+    """
+    Return the datetime range of CoinGecko [unix_ms, price] pairs, padded by a day
+    on each side so session time zone differences in the transform can't land a row
+    outside the created partitions.
+
+    Parameters:
+    - price_data (list): Extracted api price data.
+
+    Returns:
+    Tuple: (start datetime, end datetime)
+    """
+    unix_times = [ts for ts, _ in price_data]
+    start = datetime.utcfromtimestamp(min(unix_times) / 1000) - timedelta(days=1)
+    end = datetime.utcfromtimestamp(max(unix_times) / 1000) + timedelta(days=1)
+    return start, end
@@ -0,0 +1,45 @@
+from db.connect import execute_pd
+from db.queries import get_asset_precision
+from dotenv import load_dotenv
+import os
+import pandas as pd
+import threading
+import time
+
+load_dotenv()
+
+# decimals used for assets without a SRC.ASSET_PRECISION row, ETH tokens mostly use 18
+ASSET_DEFAULT_DECIMALS = int(os.getenv("ASSET_DEFAULT_DECIMALS", 18))
+# seconds a looked up asset's decimals, or its lack of a row, are cached in process
+ASSET_PRECISION_TTL = int(os.getenv("ASSET_PRECISION_TTL", 3600))
+
+_decimals = {}
+_decimals_lock = threading.Lock()
+
+
+def asset_decimals(assets, ttl=ASSET_PRECISION_TTL):
+    """
+    Return the token decimals of each asset from SRC.ASSET_PRECISION. Lookups are cached
+    in process for ttl seconds, including assets without a row, so only assets not looked
+    up recently are queried.
+
+    Parameters:
+    - assets (list): Assets to return decimals for.
+    - ttl (int): Optional argument, default ASSET_PRECISION_TTL. Seconds to cache a lookup.
+
+    Returns:
+    Dict: Asset -> decimals, ASSET_DEFAULT_DECIMALS when the asset has no row or no decimals.
+    """
+    now = time.time()
+    with _decimals_lock:
+        missing = [i for i in assets if i not in _decimals or now - _decimals[i][1] >= ttl]
+    if missing:
+        precision_df = execute_pd(get_asset_precision, {'assets': missing})
+        found = {row.asset: int(row.decimals) for row in precision_df.itertuples(index=False)
+                 if pd.notna(row.decimals)}
+        with _decimals_lock:
+            _decimals.update(
+                {i: (found.get(i, ASSET_DEFAULT_DECIMALS), now) for i in missing})
+    with _decimals_lock:
+        return {asset: _decimals[asset][0] if asset in _decimals else ASSET_DEFAULT_DECIMALS
+                for asset in assets}
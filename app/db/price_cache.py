@@ -0,0 +1,145 @@
+from collections import OrderedDict
+from dotenv import load_dotenv
+import numpy as np
+import os
+import pandas as pd
+import threading
+
+load_dotenv()
+
+PRICE_CACHE_MAX_BYTES = int(os.getenv("PRICE_CACHE_MAX_BYTES", 64 * 2**20))
+
+
+class PriceSeriesCache:
+    """
+    Process-wide cache of bucketed price series, one entry per asset and bucket holding
+    int64 epoch ns bucket starts and float64 prices for a covered [start, end) range.
+    Entries are evicted least recently used once their arrays exceed max_bytes. Price
+    data only changes when an ELT job completes, so the whole cache is tied to the job id
+    it was filled under and cleared when a newer one is seen.
+    """
+
+    def __init__(self, max_bytes=PRICE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.job_id = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def clear(self):
+        with self.lock:
+            self._clear()
+
+    def _put(self, key, entry):
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.nbytes -= old[2].nbytes + old[3].nbytes
+        self.entries[key] = entry
+        self.nbytes += entry[2].nbytes + entry[3].nbytes
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.nbytes -= evicted[2].nbytes + evicted[3].nbytes
+            self.evictions += 1
+
+    @staticmethod
+    def _split(loaded_df, assets):
+        loaded_df = loaded_df.sort_values('hourly_ts', kind='stable')
+        ts_values = loaded_df['hourly_ts'].values.astype('datetime64[ns]').astype(np.int64)
+        price_values = loaded_df['price'].to_numpy(dtype=np.float64)
+        token_ids = loaded_df['token_id'].to_numpy()
+        return {asset: (ts_values[token_ids == asset], price_values[token_ids == asset])
+                for asset in assets}
+
+    def get(self, assets, start, end, bucket, job_id, loader):
+        """
+        Return prices for assets in [start, end), loading only what the cache does not
+        cover. An asset whose cached range overlaps or touches the window only loads the
+        missing sub-ranges before and after it, which are merged into the entry; a window
+        disjoint from the cached range replaces the entry. Assets missing the same
+        sub-range are loaded together with one loader call.
+
+        Parameters:
+        - assets (list): Assets to return prices for.
+        - start (datetime.datetime): Inclusive window start, aligned to bucket.
+        - end (datetime.datetime): Exclusive window end, aligned to bucket.
+        - bucket (str): Postgres interval the prices are bucketed by.
+        - job_id (datetime.datetime): Latest successful ELT job; a new value clears the cache.
+        - loader (function): loader(assets, start, end, bucket) returning hourly_ts, token_id
+          and price columns, e.g. prices.query_prices.
+
+        Returns:
+        Dataframe: Price data with hourly_ts, token_id and price columns.
+        """
+        start_ns, end_ns = pd.Timestamp(start).value, pd.Timestamp(end).value
+        with self.lock:
+            if job_id != self.job_id:
+                self._clear()
+                self.job_id = job_id
+
+            cached, missing = {}, {}
+            for asset in assets:
+                entry = self.entries.get((asset, bucket))
+                if entry is not None and entry[0] <= start_ns and end_ns <= entry[1]:
+                    self.entries.move_to_end((asset, bucket))
+                    cached[asset] = entry
+                elif entry is None or end_ns < entry[0] or entry[1] < start_ns:
+                    missing[asset] = (entry, None, [(start_ns, end_ns)])
+                else:
+                    ranges = [(start_ns, entry[0]), (entry[1], end_ns)]
+                    missing[asset] = (entry, entry, [i for i in ranges if i[0] < i[1]])
+            self.hits += len(cached)
+            self.misses += len(missing)
+
+        if missing:
+            loads = {}
+            for asset, (_, _, ranges) in missing.items():
+                for load_range in ranges:
+                    loads.setdefault(load_range, []).append(asset)
+            parts = {}
+            for (load_start, load_end), load_assets in loads.items():
+                loaded_df = loader(load_assets, pd.Timestamp(load_start).to_pydatetime(),
+                                   pd.Timestamp(load_end).to_pydatetime(), bucket)
+                for asset, part in self._split(loaded_df, load_assets).items():
+                    parts[(asset, (load_start, load_end))] = part
+
+            with self.lock:
+                for asset, (seen, base, ranges) in missing.items():
+                    if base is None:
+                        pieces = [parts[(asset, ranges[0])]]
+                        entry_start, entry_end = start_ns, end_ns
+                    else:
+                        pieces = [parts[(asset, i)] for i in ranges if i[1] <= base[0]] + \
+                            [(base[2], base[3])] + \
+                            [parts[(asset, i)] for i in ranges if i[0] >= base[1]]
+                        entry_start, entry_end = min(start_ns, base[0]), max(end_ns, base[1])
+                    entry = (entry_start, entry_end, np.concatenate([i[0] for i in pieces]),
+                             np.concatenate([i[1] for i in pieces]))
+                    # a job finishing mid-load may have cleared the cache, and another
+                    # request may have replaced the entry this one extends
+                    if job_id == self.job_id and self.entries.get((asset, bucket)) is seen:
+                        self._put((asset, bucket), entry)
+                    cached[asset] = entry
+
+        frames = []
+        for asset in assets:
+            _, _, ts, prices = cached[asset]
+            lo, hi = np.searchsorted(ts, [start_ns, end_ns])
+            frames.append(pd.DataFrame({'hourly_ts': ts[lo:hi].view('datetime64[ns]'),
+                                        'token_id': asset, 'price': prices[lo:hi]}))
+        if not frames:
+            return pd.DataFrame({'hourly_ts': pd.Series(dtype='datetime64[ns]'),
+                                 'token_id': pd.Series(dtype=object),
+                                 'price': pd.Series(dtype=np.float64)})
+        return pd.concat(frames, ignore_index=True)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self.entries), 'bytes': self.nbytes}
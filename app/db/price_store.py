@@ -0,0 +1,203 @@
+from dotenv import load_dotenv
+from collections import OrderedDict
+import numpy as np
+import os
+import pandas as pd
+import threading
+from urllib.parse import quote
+
+load_dotenv()
+
+# directory the ELT exports price series to and the API memory-maps them from, unset to disable
+PRICE_STORE_DIR = os.getenv("PRICE_STORE_DIR")
+# series kept memory-mapped per process, least recently read ones are closed first
+PRICE_STORE_MAX_MAPS = int(os.getenv("PRICE_STORE_MAX_MAPS", 1024))
+
+# one record per rollup bucket, sorted by ts: bucket start in epoch ns and close price
+price_dtype = np.dtype([('ts', '<i8'), ('price', '<f8')])
+# origin the price queries date_bin buckets from
+bucket_origin = pd.Timestamp('2000-01-01').value
+
+
+def store_path(root, resolution, asset):
+    """
+    Return the file holding an asset's price series for a rollup resolution.
+
+    Parameters:
+    - root (str): Price store directory.
+    - resolution (str): Rollup resolution, a key of queries.rollup_resolutions.
+    - asset (str): Asset id.
+
+    Returns:
+    Str: Path of the series file.
+    """
+    return os.path.join(root, resolution, quote(asset, safe='') + '.bin')
+
+
+def write_series(root, resolution, asset, prices_df):
+    """
+    Write an asset's price series as fixed-width price_dtype records. The file is written
+    next to the target and renamed over it, so readers never see a partial file and
+    existing memory maps keep the previous version until they reopen.
+
+    Parameters:
+    - root (str): Price store directory.
+    - resolution (str): Rollup resolution, a key of queries.rollup_resolutions.
+    - asset (str): Asset id.
+    - prices_df (Dataframe): bucket_ts and price columns, sorted by bucket_ts.
+
+    Returns:
+    Int: Records written.
+    """
+    path = store_path(root, resolution, asset)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    records = np.empty(len(prices_df), dtype=price_dtype)
+    records['ts'] = prices_df['bucket_ts'].values.astype('datetime64[ns]').astype(np.int64)
+    records['price'] = prices_df['price'].astype(np.float64).to_numpy()
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    records.tofile(tmp_path)
+    os.replace(tmp_path, path)
+    return len(records)
+
+
+def generation_path(root):
+    """
+    Return the file holding the job_start_ts of the ELT job the store was last exported by.
+    """
+    return os.path.join(root, 'GENERATION')
+
+
+def write_generation(root, job_start_ts):
+    """
+    Mark the store as exported by an ELT job, written and renamed like write_series.
+
+    Parameters:
+    - root (str): Price store directory.
+    - job_start_ts (datetime.datetime): job_start_ts of the job the store is current for.
+
+    Returns:
+    None
+    """
+    os.makedirs(root, exist_ok=True)
+    path = generation_path(root)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(pd.Timestamp(job_start_ts).isoformat())
+    os.replace(tmp_path, path)
+
+
+def last_per_bucket(ts, prices, bucket):
+    """
+    Re-bucket a sorted series to a coarser bucket, keeping the last price in each bucket
+    like the price queries' DISTINCT ON.
+
+    Parameters:
+    - ts (np.ndarray): Sorted int64 epoch ns timestamps.
+    - prices (np.ndarray): float64 prices matching ts.
+    - bucket (str): Postgres interval to bucket by.
+
+    Returns:
+    Tuple: int64 bucket starts and float64 closing prices.
+    """
+    bucket_ns = pd.Timedelta(bucket).value
+    buckets = (ts - bucket_origin) // bucket_ns * bucket_ns + bucket_origin
+    last = np.ones(len(buckets), dtype=bool)
+    last[:-1] = buckets[1:] != buckets[:-1]
+    return buckets[last], prices[last]
+
+
+class PriceStore:
+    """
+    Read-only view of the exported price series. Files are memory-mapped, so every API
+    worker on a host shares the same pages through the OS page cache, and ranges are
+    sliced with a binary search on the sorted timestamps. A file replaced by a newer
+    export is reopened on its next read, at most max_maps series stay mapped, and every
+    mapping is closed when the store's generation changes.
+    """
+
+    def __init__(self, root=PRICE_STORE_DIR, max_maps=PRICE_STORE_MAX_MAPS):
+        self.root = root
+        self.max_maps = max_maps
+        self.maps = OrderedDict()
+        self.generation = (None, None)
+        self.lock = threading.Lock()
+
+    def is_current(self, job_start_ts):
+        """
+        Return whether the store was exported by the ELT job job_start_ts, the latest
+        successful one. A store left behind by a failed or skipped export is not current
+        and must not be read.
+        """
+        if job_start_ts is None:
+            return False
+        path = generation_path(self.root)
+        try:
+            stat = os.stat(path)
+            version = (stat.st_ino, stat.st_mtime_ns)
+            with self.lock:
+                if self.generation[0] != version:
+                    with open(path) as f:
+                        self.generation = (version, pd.Timestamp(f.read().strip()))
+                    self.maps.clear()
+                generation = self.generation[1]
+        except (FileNotFoundError, ValueError):
+            return False
+        return generation == pd.Timestamp(job_start_ts)
+
+    def series(self, resolution, asset):
+        """
+        Return the memory-mapped series of an asset, None if it was never exported.
+        """
+        path = store_path(self.root, resolution, asset)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            cached = self.maps.get(path)
+            if cached is not None and cached[0] == version:
+                self.maps.move_to_end(path)
+                return cached[1]
+            if stat.st_size == 0:
+                records = np.empty(0, dtype=price_dtype)
+            else:
+                records = np.memmap(path, dtype=price_dtype, mode='r')
+            self.maps[path] = (version, records)
+            self.maps.move_to_end(path)
+            while len(self.maps) > self.max_maps:
+                self.maps.popitem(last=False)
+            return records
+
+    def read(self, assets, start, end, bucket, resolution):
+        """
+        Read prices in [start, end) for the assets that have been exported.
+
+        Parameters:
+        - assets (list): Assets to return prices for.
+        - start (datetime.datetime): Inclusive start of the price window.
+        - end (datetime.datetime): Exclusive end of the price window.
+        - bucket (str): Postgres interval to bucket prices by.
+        - resolution (str): Rollup resolution to read, from prices.rollup_resolution.
+
+        Returns:
+        Tuple: Dataframe with hourly_ts, token_id and price columns, and the list of
+        assets not in the store.
+        """
+        start_ns, end_ns = pd.Timestamp(start).value, pd.Timestamp(end).value
+        frames, missing = [], []
+        for asset in assets:
+            records = self.series(resolution, asset)
+            if records is None:
+                missing.append(asset)
+                continue
+            lo, hi = np.searchsorted(records['ts'], [start_ns, end_ns])
+            ts, prices = last_per_bucket(np.asarray(records['ts'][lo:hi]),
+                                         np.asarray(records['price'][lo:hi]), bucket)
+            frames.append(pd.DataFrame({'hourly_ts': ts.view('datetime64[ns]'),
+                                        'token_id': asset, 'price': prices}))
+        if not frames:
+            return pd.DataFrame({'hourly_ts': pd.Series(dtype='datetime64[ns]'),
+                                 'token_id': pd.Series(dtype=object),
+                                 'price': pd.Series(dtype=np.float64)}), missing
+        return pd.concat(frames, ignore_index=True), missing
@@ -0,0 +1,215 @@
+from db.connect import execute_pd, listen_connection, DB_FETCH_SIZE
+from db.metrics import metrics
+from db.price_cache import PriceSeriesCache
+from db.price_store import PriceStore, PRICE_STORE_DIR
+from db.queries import get_latest_job_ts, get_src_prices, get_rollup_prices, rollup_resolutions, numeric_types
+from decimal import Decimal
+from dotenv import load_dotenv
+import os
+import pandas as pd
+import threading
+import time
+
+load_dotenv()
+
+LATEST_JOB_TTL = int(os.getenv("LATEST_JOB_TTL", 60))
+# price fetches expected to return more rows than this stream from a server-side cursor
+PRICE_STREAM_ROWS = int(os.getenv("PRICE_STREAM_ROWS", 200000))
+PRICE_CACHE_ENABLED = os.getenv("PRICE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+# seconds between checks for elt_job notifications on the listen connection
+PRICE_LISTEN_POLL = float(os.getenv("PRICE_LISTEN_POLL", 1))
+
+# declared at read time so prices are float64 however the driver returns them
+price_dtypes = {'price': 'float64'}
+
+price_cache = PriceSeriesCache()
+price_store = PriceStore(PRICE_STORE_DIR) if PRICE_STORE_DIR else None
+
+_latest_job = {'job_start_ts': None, 'fetched_at': 0.0}
+_latest_job_lock = threading.Lock()
+
+
+def latest_job_ts(ttl=LATEST_JOB_TTL):
+    """
+    Return the job_start_ts of the latest successful ELT run.
+    The value is cached in process for ttl seconds so the ELT_LOG lookup
+    runs once per ttl instead of once per request.
+
+    Parameters:
+    - ttl (int): Optional argument, default LATEST_JOB_TTL. Seconds to cache the job id.
+
+    Returns:
+    Timestamp: job_start_ts of the latest successful job, None if no job has succeeded.
+    """
+    with _latest_job_lock:
+        if time.time() - _latest_job['fetched_at'] < ttl:
+            return _latest_job['job_start_ts']
+
+        job_df = execute_pd(get_latest_job_ts)
+        job_start_ts = job_df['job_start_ts'].iloc[0] if len(job_df) else None
+        if pd.isna(job_start_ts):
+            job_start_ts = None
+        else:
+            job_start_ts = pd.Timestamp(job_start_ts).to_pydatetime()
+        _latest_job['job_start_ts'] = job_start_ts
+        _latest_job['fetched_at'] = time.time()
+        return job_start_ts
+
+
+def reset_latest_job():
+    """
+    Drop the cached job id so the next call to latest_job_ts queries the database.
+    """
+    with _latest_job_lock:
+        _latest_job['fetched_at'] = 0.0
+
+
+def listen_for_jobs(poll_seconds=PRICE_LISTEN_POLL):
+    """
+    Start a daemon thread that LISTENs on the elt_job channel notified by the ELT's
+    log_job_run, and clears the cached job id and price_cache as soon as a job succeeds
+    rather than up to LATEST_JOB_TTL seconds later. The connection is reopened after
+    errors, falling back to the TTL while it is down.
+
+    Parameters:
+    - poll_seconds (float): Optional argument, default PRICE_LISTEN_POLL. Seconds between
+      round trips that deliver pending notifications.
+
+    Returns:
+    threading.Thread: The listener thread.
+    """
+    def listen():
+        while True:
+            try:
+                conn = listen_connection()
+                try:
+                    conn.run("LISTEN elt_job")
+                    while True:
+                        # pg8000 only reads notifications off the socket during a query
+                        conn.run("SELECT 1")
+                        if conn.notifications:
+                            conn.notifications.clear()
+                            reset_latest_job()
+                            price_cache.clear()
+                        time.sleep(poll_seconds)
+                finally:
+                    conn.close()
+            except Exception as e:
+                print(f"elt_job listener failed, reconnecting: {e}")
+                time.sleep(max(poll_seconds, 5))
+
+    thread = threading.Thread(target=listen, name='elt-job-listener', daemon=True)
+    thread.start()
+    return thread
+
+
+def rollup_resolution(bucket):
+    """
+    Pick the coarsest rollup resolution that evenly divides the requested bucket.
+
+    Parameters:
+    - bucket (str): Postgres interval prices are bucketed by, e.g. '1 hour'.
+
+    Returns:
+    Str: Key of rollup_resolutions, or None if no rollup fits.
+    """
+    bucket_td = pd.Timedelta(bucket)
+    fitting = [(pd.Timedelta(interval), resolution)
+               for resolution, interval in rollup_resolutions.items()
+               if bucket_td % pd.Timedelta(interval) == pd.Timedelta(0)]
+    return max(fitting)[1] if fitting else None
+
+
+def fetch_prices(assets, start, end, bucket='1 hour'):
+    """
+    Fetch bucketed prices for one or more assets. When PRICE_STORE_DIR is set and the store
+    was exported by the latest successful ELT job, assets the ELT has exported are read
+    from the memory-mapped price_store. Other assets in windows
+    aligned to the bucket are served from the in-process price_cache when
+    PRICE_CACHE_ENABLED, which only queries the database for assets it does not cover and
+    is cleared when a new ELT job succeeds.
+
+    Parameters:
+    - assets (list): Assets to return prices for.
+    - start (datetime.datetime): Inclusive start of the price window.
+    - end (datetime.datetime): Exclusive end of the price window.
+    - bucket (str): Optional argument, default '1 hour'. Postgres interval to bucket prices by.
+
+    Returns:
+    Dataframe: Price data with hourly_ts (bucket start), token_id and price columns.
+    """
+    assets = list(assets)
+    resolution = rollup_resolution(bucket)
+    if price_store is None or resolution is None:
+        return cached_prices(assets, start, end, bucket)
+    if not price_store.is_current(latest_job_ts()):
+        metrics.inc('price_store_stale_total')
+        return cached_prices(assets, start, end, bucket)
+
+    with metrics.span('price_store_read'):
+        stored_df, missing = price_store.read(assets, start, end, bucket, resolution)
+    if not missing:
+        return stored_df
+    return pd.concat([stored_df, cached_prices(missing, start, end, bucket)], ignore_index=True)
+
+
+def cached_prices(assets, start, end, bucket='1 hour'):
+    """
+    Fetch prices through price_cache, querying the database directly when the cache is
+    disabled or the window is not aligned to the bucket.
+
+    Parameters:
+    - assets (list): Assets to return prices for.
+    - start (datetime.datetime): Inclusive start of the price window.
+    - end (datetime.datetime): Exclusive end of the price window.
+    - bucket (str): Optional argument, default '1 hour'. Postgres interval to bucket prices by.
+
+    Returns:
+    Dataframe: Price data with hourly_ts (bucket start), token_id and price columns.
+    """
+    bucket_td = pd.Timedelta(bucket)
+    aligned = pd.Timestamp(start).floor(bucket_td) == pd.Timestamp(start) and \
+        pd.Timestamp(end).floor(bucket_td) == pd.Timestamp(end)
+    if not PRICE_CACHE_ENABLED or not aligned:
+        return query_prices(assets, start, end, bucket)
+    return price_cache.get(assets, start, end, bucket, latest_job_ts(), query_prices)
+
+
+def query_prices(assets, start, end, bucket='1 hour', exact=False):
+    """
+    Query prices for one or more assets with bound parameters, so Postgres can
+    reuse the plan across requests. Prices are read from the coarsest rollup that
+    fits the bucket, falling back to SRC.PRICE_HISTORY, and bucketing happens in the
+    query so only one closing price per asset and bucket is returned. The time bounds
+    let the planner prune partitions outside the window. Fetches expected to return more
+    than PRICE_STREAM_ROWS rows are streamed in DB_FETCH_SIZE chunks.
+
+    Parameters:
+    - assets (list): Assets to return prices for.
+    - start (datetime.datetime): Inclusive start of the price window.
+    - end (datetime.datetime): Exclusive end of the price window.
+    - bucket (str): Optional argument, default '1 hour'. Postgres interval to bucket prices by.
+    - exact (bool): Optional argument, default False. Return prices as the exact NUMERIC
+      values in Decimal objects instead of float64.
+
+    Returns:
+    Dataframe: Price data with hourly_ts (bucket start), token_id and price columns.
+    """
+    numeric_type = numeric_types['exact' if exact else 'float']
+    dtypes = None if exact else price_dtypes
+    params = {'assets': list(assets), 'start': start, 'end': end, 'bucket': bucket}
+    resolution = rollup_resolution(bucket)
+    expected_rows = len(params['assets']) * \
+        (pd.Timestamp(end) - pd.Timestamp(start)) / pd.Timedelta(bucket)
+    chunksize = DB_FETCH_SIZE if expected_rows > PRICE_STREAM_ROWS else None
+    with metrics.span('price_query', source=resolution or 'raw'):
+        if resolution is None:
+            prices_df = execute_pd(get_src_prices.format(numeric_type=numeric_type),
+                                   params, chunksize, dtypes)
+        else:
+            params['resolution'] = resolution
+            prices_df = execute_pd(get_rollup_prices.format(numeric_type=numeric_type),
+                                   params, chunksize, dtypes)
+    if exact:
+        prices_df['price'] = [None if i is None else Decimal(i) for i in prices_df['price']]
+    return prices_df
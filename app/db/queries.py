@@ -21,11 +21,73 @@ CREATE SCHEMA IF NOT EXISTS SRC;
 
 create_src_price_history = """
 CREATE TABLE IF NOT EXISTS SRC.PRICE_HISTORY (
-timestamp TIMESTAMP WITHOUT TIME ZONE,
+timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
 asset TEXT,
 price NUMERIC,
 job_start_ts TIMESTAMP WITHOUT TIME ZONE,
 UNIQUE(timestamp, asset)
+) PARTITION BY RANGE (timestamp)
+"""
+
+create_src_price_history_partition = """
+CREATE TABLE IF NOT EXISTS SRC.PRICE_HISTORY_{suffix}
+PARTITION OF SRC.PRICE_HISTORY
+FOR VALUES FROM ('{start}') TO ('{end}')
+"""
+
+get_src_price_history_kind = """
+SELECT c.relkind
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = 'src' AND c.relname = 'price_history'
+"""
+
+# move an unpartitioned SRC.PRICE_HISTORY aside so the partitioned table can take its name
+rename_unpartitioned_price_history = """
+DROP INDEX IF EXISTS SRC.price_history_asset_timestamp_idx;
+DROP INDEX IF EXISTS SRC.price_history_job_start_ts_idx;
+ALTER TABLE SRC.PRICE_HISTORY RENAME TO PRICE_HISTORY_UNPARTITIONED;
+"""
+
+get_unpartitioned_price_history_range = """
+SELECT MIN(timestamp), MAX(timestamp)
+FROM SRC.PRICE_HISTORY_UNPARTITIONED
+"""
+
+migrate_unpartitioned_price_history = """
+INSERT INTO SRC.PRICE_HISTORY (timestamp, asset, price, job_start_ts)
+SELECT timestamp, asset, price, job_start_ts
+FROM SRC.PRICE_HISTORY_UNPARTITIONED
+WHERE timestamp IS NOT NULL;
+DROP TABLE SRC.PRICE_HISTORY_UNPARTITIONED;
+"""
+
+create_src_price_history_indexes = """
+CREATE INDEX IF NOT EXISTS price_history_asset_timestamp_idx
+ON SRC.PRICE_HISTORY (asset, timestamp);
+CREATE INDEX IF NOT EXISTS price_history_job_start_ts_idx
+ON SRC.PRICE_HISTORY (job_start_ts);
+"""
+
+create_src_price_watermark = """
+CREATE TABLE IF NOT EXISTS SRC.PRICE_WATERMARK (
+asset TEXT PRIMARY KEY,
+first_unix_time BIGINT,
+last_unix_time BIGINT,
+updated_at TIMESTAMP WITHOUT TIME ZONE
+)
+"""
+
+create_src_price_rollup = """
+CREATE TABLE IF NOT EXISTS SRC.PRICE_ROLLUP (
+resolution TEXT NOT NULL,
+asset TEXT NOT NULL,
+bucket_ts TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+open NUMERIC,
+high NUMERIC,
+low NUMERIC,
+close NUMERIC,
+PRIMARY KEY (resolution, asset, bucket_ts)
 )
 """
 
@@ -37,17 +99,67 @@ error CHARACTER VARYING
 )
 """
 
+create_src_elt_log_indexes = """
+CREATE INDEX IF NOT EXISTS elt_log_status_job_start_ts_idx
+ON SRC.ELT_LOG (status, job_start_ts);
+"""
+
+create_src_wallet_balance = """
+CREATE TABLE IF NOT EXISTS SRC.WALLET_BALANCE (
+wallet_address TEXT NOT NULL,
+token_id TEXT NOT NULL,
+block_timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+balance NUMERIC,
+UNIQUE(wallet_address, token_id, block_timestamp)
+);
+CREATE INDEX IF NOT EXISTS wallet_balance_wallet_block_timestamp_idx
+ON SRC.WALLET_BALANCE (wallet_address, block_timestamp);
+"""
+
+create_src_wallet_sync = """
+CREATE TABLE IF NOT EXISTS SRC.WALLET_SYNC (
+wallet_address TEXT PRIMARY KEY,
+last_block_timestamp TIMESTAMP WITHOUT TIME ZONE,
+synced_at TIMESTAMP WITHOUT TIME ZONE
+)
+"""
+
+# token decimals per asset, used to round balances when PnL is returned as exact decimals
+create_src_asset_precision = """
+CREATE TABLE IF NOT EXISTS SRC.ASSET_PRECISION (
+asset TEXT PRIMARY KEY,
+decimals INTEGER,
+updated_at TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW()
+)
+"""
+
+create_src_pnl_snapshot = """
+CREATE TABLE IF NOT EXISTS SRC.PNL_SNAPSHOT (
+wallet_address TEXT NOT NULL,
+asset TEXT NOT NULL,
+interval TEXT NOT NULL,
+bucket_ts TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+balance_actual DOUBLE PRECISION,
+price DOUBLE PRECISION,
+usd_value DOUBLE PRECISION,
+PRIMARY KEY(wallet_address, asset, interval, bucket_ts)
+);
+CREATE INDEX IF NOT EXISTS pnl_snapshot_asset_bucket_ts_idx
+ON SRC.PNL_SNAPSHOT (asset, bucket_ts);
+"""
+
 # ========== ELT QUERIES ==========
 create_stg_price_history = """
-CREATE TABLE IF NOT EXISTS STG.PRICE_HISTORY (
+CREATE UNLOGGED TABLE IF NOT EXISTS STG.PRICE_HISTORY (
 unix_time BIGINT,
 asset TEXT,
 price NUMERIC
-)
+);
+ALTER TABLE STG.PRICE_HISTORY SET UNLOGGED;
 """
 
-drop_stg_price_history = """
-DROP TABLE IF EXISTS STG.PRICE_HISTORY
+truncate_stg_price_history = """
+TRUNCATE STG.PRICE_HISTORY
 """
 
 load_stg_price_history = """
@@ -55,6 +167,15 @@ INSERT INTO STG.PRICE_HISTORY (unix_time, price, asset)
 VALUES (:unix_time, :price, :asset)
 """
 
+copy_stg_price_history = """
+COPY STG.PRICE_HISTORY (unix_time, price, asset) FROM STDIN WITH (FORMAT csv)
+"""
+
+load_stg_price_history_values = """
+INSERT INTO STG.PRICE_HISTORY (unix_time, price, asset)
+VALUES {values}
+"""
+
 load_src_price_history = """
 INSERT INTO SRC.PRICE_HISTORY (timestamp, asset, price, job_start_ts)
 SELECT
@@ -67,24 +188,294 @@ ON CONFLICT (timestamp, asset)
 DO UPDATE SET job_start_ts = '{job_start_ts}'::timestamp
 """
 
+insert_new_src_price_history = """
+INSERT INTO SRC.PRICE_HISTORY (timestamp, asset, price, job_start_ts)
+SELECT
+    DISTINCT TO_CHAR(TO_TIMESTAMP(unix_time/1000), 'YYYY-MM-DD HH24:MI')::timestamp as ts
+	, asset
+    , price
+    , '{job_start_ts}'::timestamp
+FROM stg.price_history
+ON CONFLICT (timestamp, asset)
+DO NOTHING
+"""
+
+get_price_watermarks = """
+SELECT asset, first_unix_time, last_unix_time
+FROM SRC.PRICE_WATERMARK
+"""
+
+upsert_price_watermark = """
+INSERT INTO SRC.PRICE_WATERMARK (asset, first_unix_time, last_unix_time, updated_at)
+SELECT
+    asset
+    , MIN(unix_time)
+    , MAX(unix_time)
+    , NOW()::timestamp
+FROM stg.price_history
+GROUP BY asset
+ON CONFLICT (asset)
+DO UPDATE SET
+    first_unix_time = LEAST(SRC.PRICE_WATERMARK.first_unix_time, EXCLUDED.first_unix_time)
+    , last_unix_time = GREATEST(SRC.PRICE_WATERMARK.last_unix_time, EXCLUDED.last_unix_time)
+    , updated_at = EXCLUDED.updated_at
+"""
+
+# drop PnL snapshots from the first day touched by the prices in STG
+invalidate_pnl_snapshot_prices = """
+DELETE FROM SRC.PNL_SNAPSHOT s
+USING (
+    SELECT
+        asset
+        , DATE_TRUNC('day', MIN(TO_CHAR(TO_TIMESTAMP(unix_time/1000), 'YYYY-MM-DD HH24:MI')::timestamp)) as min_day
+    FROM stg.price_history
+    GROUP BY asset
+) stg
+WHERE s.asset = stg.asset
+AND s.bucket_ts >= stg.min_day
+"""
+
+# ========== ROLLUPS ==========
+# resolution name -> Postgres interval, maintained by the ELT after each transform
+rollup_resolutions = {
+    '5m': '5 minutes',
+    '1h': '1 hour',
+    '1d': '1 day',
+}
+
+# recompute every rollup bucket touched by the data in STG
+refresh_price_rollup = """
+INSERT INTO SRC.PRICE_ROLLUP (resolution, asset, bucket_ts, open, high, low, close)
+SELECT
+    '{resolution}'
+    , ph.asset
+    , date_bin(INTERVAL '{bucket}', ph.timestamp, TIMESTAMP '2000-01-01') as bucket_ts
+    , (ARRAY_AGG(ph.price ORDER BY ph.timestamp))[1]
+    , MAX(ph.price)
+    , MIN(ph.price)
+    , (ARRAY_AGG(ph.price ORDER BY ph.timestamp DESC))[1]
+FROM SRC.PRICE_HISTORY ph
+JOIN (
+    SELECT
+        asset
+        , MIN(TO_CHAR(TO_TIMESTAMP(unix_time/1000), 'YYYY-MM-DD HH24:MI')::timestamp) as min_ts
+        , MAX(TO_CHAR(TO_TIMESTAMP(unix_time/1000), 'YYYY-MM-DD HH24:MI')::timestamp) as max_ts
+    FROM stg.price_history
+    GROUP BY asset
+) stg ON stg.asset = ph.asset
+WHERE ph.timestamp >= date_bin(INTERVAL '{bucket}', stg.min_ts, TIMESTAMP '2000-01-01')
+AND ph.timestamp < date_bin(INTERVAL '{bucket}', stg.max_ts, TIMESTAMP '2000-01-01') + INTERVAL '{bucket}'
+GROUP BY ph.asset, bucket_ts
+ON CONFLICT (resolution, asset, bucket_ts)
+DO UPDATE SET
+    open = EXCLUDED.open
+    , high = EXCLUDED.high
+    , low = EXCLUDED.low
+    , close = EXCLUDED.close
+"""
+
+# closing prices of one asset and resolution, exported to the memory-mapped price store
+get_price_rollup_series = """
+SELECT
+    bucket_ts
+    , CAST(close AS DOUBLE PRECISION) as price
+FROM SRC.PRICE_ROLLUP
+WHERE resolution = :resolution
+AND asset = :asset
+ORDER BY bucket_ts
+"""
+
+get_price_rollup_assets = """
+SELECT DISTINCT asset
+FROM SRC.PRICE_ROLLUP
+"""
+
+# build a resolution from all of SRC.PRICE_HISTORY, only while the rollup is empty
+rebuild_price_rollup = """
+INSERT INTO SRC.PRICE_ROLLUP (resolution, asset, bucket_ts, open, high, low, close)
+SELECT
+    '{resolution}'
+    , ph.asset
+    , date_bin(INTERVAL '{bucket}', ph.timestamp, TIMESTAMP '2000-01-01') as bucket_ts
+    , (ARRAY_AGG(ph.price ORDER BY ph.timestamp))[1]
+    , MAX(ph.price)
+    , MIN(ph.price)
+    , (ARRAY_AGG(ph.price ORDER BY ph.timestamp DESC))[1]
+FROM SRC.PRICE_HISTORY ph
+WHERE NOT EXISTS (
+    SELECT 1 FROM SRC.PRICE_ROLLUP WHERE resolution = '{resolution}'
+)
+GROUP BY ph.asset, bucket_ts
+"""
+
 insert_elt_log = """
 INSERT INTO SRC.ELT_LOG (job_start_ts, status, error)
 VALUES
     (:job_start_ts, :status, :error)
 """
 
+# Tells API processes listening on elt_job that new prices are loaded
+notify_elt_job = """
+SELECT pg_notify('elt_job', CAST(:job_start_ts AS text))
+"""
+
 # ========== API Queries ==========
+get_latest_job_ts = """
+SELECT
+    MAX(job_start_ts) as job_start_ts
+FROM SRC.ELT_LOG
+WHERE status = 'success'
+"""
+
+# price and balance reads take numeric_type: DOUBLE PRECISION for the float64 pipeline,
+# or TEXT to get the exact NUMERIC values for decimal output
+numeric_types = {'float': 'DOUBLE PRECISION', 'exact': 'TEXT'}
+
 get_src_prices = """
-with max_ts as (
+SELECT DISTINCT ON (p.token_id, p.hourly_ts)
+    p.hourly_ts
+    , p.token_id
+    , CAST(p.price AS {numeric_type}) as price
+    , p.job_start_ts
+FROM (
+    SELECT
+        date_bin(CAST(:bucket AS INTERVAL), ph.timestamp, TIMESTAMP '2000-01-01') as hourly_ts
+        , ph.asset as token_id
+        , ph.price
+        , ph.job_start_ts
+        , ph.timestamp
+    FROM SRC.PRICE_HISTORY ph
+    WHERE ph.asset = ANY(:assets)
+    AND ph.timestamp >= :start
+    AND ph.timestamp < :end
+) p
+ORDER BY p.token_id, p.hourly_ts, p.timestamp DESC
+"""
+
+get_rollup_prices = """
+SELECT DISTINCT ON (p.token_id, p.hourly_ts)
+    p.hourly_ts
+    , p.token_id
+    , CAST(p.price AS {numeric_type}) as price
+FROM (
+    SELECT
+        date_bin(CAST(:bucket AS INTERVAL), r.bucket_ts, TIMESTAMP '2000-01-01') as hourly_ts
+        , r.asset as token_id
+        , r.close as price
+        , r.bucket_ts
+    FROM SRC.PRICE_ROLLUP r
+    WHERE r.resolution = :resolution
+    AND r.asset = ANY(:assets)
+    AND r.bucket_ts >= :start
+    AND r.bucket_ts < :end
+) p
+ORDER BY p.token_id, p.hourly_ts, p.bucket_ts DESC
+"""
+
+get_asset_precision = """
 SELECT
-	MAX(job_start_ts) as ts
-FROM SRC.ELT_LOG)
+    asset
+    , decimals
+FROM SRC.ASSET_PRECISION
+WHERE asset = ANY(:assets)
+"""
+
+upsert_asset_precision = """
+INSERT INTO SRC.ASSET_PRECISION (asset, decimals, updated_at)
+VALUES (:asset, :decimals, NOW())
+ON CONFLICT (asset)
+DO UPDATE SET
+    decimals = EXCLUDED.decimals
+    , updated_at = EXCLUDED.updated_at
+"""
+
+get_wallet_sync = """
 SELECT
-    date_trunc('hour', ph.timestamp) as hourly_ts 
-    , ph.asset as token_id
-    , ph.price
-    , ph.job_start_ts
-FROM SRC.PRICE_HISTORY ph
-JOIN max_ts on max_ts.ts = ph.job_start_ts
-WHERE ph.asset = '{asset}';
+    last_block_timestamp
+    , EXTRACT(EPOCH FROM NOW()::timestamp - synced_at) as sync_age_seconds
+FROM SRC.WALLET_SYNC
+WHERE wallet_address = :wallet_address
+"""
+
+get_wallet_balances = """
+SELECT
+    token_id
+    , TO_CHAR(block_timestamp, 'YYYY-MM-DD"T"HH24:MI:SS') as block_timestamp
+    , CAST(balance AS {numeric_type}) as balance
+FROM SRC.WALLET_BALANCE
+WHERE wallet_address = :wallet_address
+ORDER BY block_timestamp
+"""
+
+insert_wallet_balance = """
+INSERT INTO SRC.WALLET_BALANCE (wallet_address, token_id, block_timestamp, balance)
+VALUES (:wallet_address, :token_id, CAST(:block_timestamp AS TIMESTAMP), :balance)
+ON CONFLICT (wallet_address, token_id, block_timestamp)
+DO NOTHING
+"""
+
+upsert_wallet_sync = """
+INSERT INTO SRC.WALLET_SYNC (wallet_address, last_block_timestamp, synced_at)
+VALUES (:wallet_address, CAST(:last_block_timestamp AS TIMESTAMP), NOW()::timestamp)
+ON CONFLICT (wallet_address)
+DO UPDATE SET
+    last_block_timestamp = GREATEST(SRC.WALLET_SYNC.last_block_timestamp, EXCLUDED.last_block_timestamp)
+    , synced_at = EXCLUDED.synced_at
+"""
+
+get_pnl_snapshot = """
+SELECT
+    bucket_ts as hourly_ts
+    , asset as token_id
+    , balance_actual
+    , price
+    , usd_value
+FROM SRC.PNL_SNAPSHOT
+WHERE wallet_address = :wallet_address
+AND interval = :interval
+AND bucket_ts >= :start
+AND bucket_ts <= :end
+ORDER BY asset, bucket_ts
+"""
+
+# snapshot rows are COPYed into a transaction-scoped staging table, then merged in one statement.
+# Each row carries the wallet's last_block_timestamp it was computed from; the merge locks the
+# wallet's sync row and drops rows computed before a newer sync, whose balances may be stale
+create_pnl_snapshot_stage = """
+CREATE TEMP TABLE pnl_snapshot_stage (
+LIKE SRC.PNL_SNAPSHOT,
+last_block_timestamp TIMESTAMP WITHOUT TIME ZONE
+) ON COMMIT DROP
+"""
+
+copy_pnl_snapshot_stage = """
+COPY pnl_snapshot_stage (wallet_address, asset, interval, bucket_ts, balance_actual, price, usd_value,
+                         last_block_timestamp)
+FROM STDIN WITH (FORMAT csv)
+"""
+
+upsert_pnl_snapshot = """
+INSERT INTO SRC.PNL_SNAPSHOT (wallet_address, asset, interval, bucket_ts, balance_actual, price, usd_value)
+SELECT s.wallet_address, s.asset, s.interval, s.bucket_ts, s.balance_actual, s.price, s.usd_value
+FROM pnl_snapshot_stage s
+JOIN (
+    SELECT wallet_address, last_block_timestamp
+    FROM SRC.WALLET_SYNC
+    WHERE wallet_address IN (SELECT wallet_address FROM pnl_snapshot_stage)
+    FOR SHARE
+) w ON w.wallet_address = s.wallet_address
+WHERE DATE_TRUNC('second', w.last_block_timestamp) <= s.last_block_timestamp
+ON CONFLICT (wallet_address, asset, interval, bucket_ts)
+DO UPDATE SET
+    balance_actual = EXCLUDED.balance_actual
+    , price = EXCLUDED.price
+    , usd_value = EXCLUDED.usd_value
+"""
+
+# drop a wallet's PnL snapshots from the first day touched by new balance records
+invalidate_pnl_snapshot_balances = """
+DELETE FROM SRC.PNL_SNAPSHOT
+WHERE wallet_address = :wallet_address
+AND asset = :asset
+AND bucket_ts >= DATE_TRUNC('day', CAST(:block_timestamp AS TIMESTAMP))
 """
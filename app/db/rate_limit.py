@@ -0,0 +1,63 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by all extraction workers.
+
+    Tokens refill continuously at rate_per_minute up to capacity. Each request takes
+    one token, blocking until one is available. pause() stops all callers until a
+    given time, used to honor Retry-After on rate limit responses.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity or max(1, int(rate_per_minute // 6))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens +
+                          (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """
+        Block until a token is available and take it.
+
+        Returns:
+        Float: Seconds spent waiting.
+        """
+        start = time.monotonic()
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self._refill(now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return now - start
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Stop handing out tokens for the given number of seconds and drain the bucket,
+        so requests resume at the refill rate once the pause ends.
+
+        Parameters:
+        - seconds (float): Seconds to pause all callers for.
+
+        Returns:
+        None
+        """
+        with self.lock:
+            self.paused_until = max(self.paused_until,
+                                    time.monotonic() + seconds)
+            self.tokens = 0
+            self.updated = self.paused_until
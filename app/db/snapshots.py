@@ -0,0 +1,72 @@
+from db.connect import execute_pd, execute_query, execute_copy
+from db.queries import get_pnl_snapshot, create_pnl_snapshot_stage, copy_pnl_snapshot_stage, upsert_pnl_snapshot, invalidate_pnl_snapshot_balances
+import pandas as pd
+
+
+def pnl_snapshots(wallet_address, interval, start, end):
+    """
+    Return a wallet's persisted PnL rows for an interval within [start, end].
+
+    Parameters:
+    - wallet_address (str): Wallet address, lower case.
+    - interval (str): PnL interval key, e.g. '1h'.
+    - start (datetime.datetime): First grid timestamp.
+    - end (datetime.datetime): Last grid timestamp.
+
+    Returns:
+    Dataframe: hourly_ts, token_id, balance_actual, price and usd_value, ordered by asset and time.
+    """
+    snapshot_df = execute_pd(get_pnl_snapshot, {'wallet_address': wallet_address, 'interval': interval,
+                                                'start': pd.Timestamp(start).to_pydatetime(),
+                                                'end': pd.Timestamp(end).to_pydatetime()})
+    snapshot_df['hourly_ts'] = snapshot_df['hourly_ts'].astype('datetime64[ns]')
+    return snapshot_df
+
+
+def save_pnl_snapshots(wallet_address, interval, pnl_df, last_block_timestamp):
+    """
+    Upsert computed PnL rows for a wallet. Only rows that can no longer change
+    should be passed, later requests reuse them instead of recomputing. Rows are
+    COPYed into a staging table and merged with one INSERT ... ON CONFLICT, so a
+    long window costs a few round trips instead of one per row. Nothing is merged
+    when the wallet has been synced past last_block_timestamp since the rows were computed.
+
+    Parameters:
+    - wallet_address (str): Wallet address, lower case.
+    - interval (str): PnL interval key, e.g. '1h'.
+    - pnl_df (Dataframe): Rows with hourly_ts, token_id, balance_actual, price and usd_value.
+    - last_block_timestamp (str): Latest block timestamp of the balances the rows were computed from.
+
+    Returns:
+    Int: Rows copied to the staging table.
+    """
+    snapshot_rows = zip([wallet_address] * len(pnl_df), pnl_df['token_id'], [interval] * len(pnl_df),
+                        pnl_df['hourly_ts'].dt.strftime('%Y-%m-%d %H:%M:%S'),
+                        pnl_df['balance_actual'].astype(float), pnl_df['price'].astype(float),
+                        pnl_df['usd_value'].astype(float), [last_block_timestamp] * len(pnl_df))
+    return execute_copy(copy_pnl_snapshot_stage, list(snapshot_rows),
+                        before=(create_pnl_snapshot_stage,), after=(upsert_pnl_snapshot,))
+
+
+def invalidate_balance_snapshots(wallet_address, records):
+    """
+    Drop a wallet's snapshots that new balance records may have changed, from the
+    day of each asset's earliest new record onwards.
+
+    Parameters:
+    - wallet_address (str): Wallet address, lower case.
+    - records (list): Balance dicts with token_id and block_timestamp.
+
+    Returns:
+    None
+    """
+    first_records = {}
+    for i in records:
+        token_id = i['token_id']
+        if token_id not in first_records or i['block_timestamp'] < first_records[token_id]:
+            first_records[token_id] = i['block_timestamp']
+
+    invalidate_data = [{'wallet_address': wallet_address, 'asset': asset, 'block_timestamp': block_timestamp}
+                       for asset, block_timestamp in first_records.items()]
+    if invalidate_data:
+        execute_query(invalidate_pnl_snapshot_balances, invalidate_data)
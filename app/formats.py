@@ -0,0 +1,53 @@
+import io
+
+# media type -> binary format of /get-pnl, negotiated from the Accept header
+binary_formats = {
+    'application/vnd.apache.arrow.stream': 'arrow',
+    'application/vnd.apache.parquet': 'parquet',
+}
+
+pnl_float_columns = ['balance_actual', 'price', 'usd_value', 'PnL']
+
+
+def pnl_table(pnl_df):
+    """
+    Convert a PnL frame to an Arrow table with a native timestamp column, a
+    dictionary encoded token_id and float64 values.
+
+    Parameters:
+    - pnl_df (Dataframe): Output of lib.run_pnl_frame.
+
+    Returns:
+    pyarrow.Table: hourly_ts, token_id, balance_actual, price, usd_value and PnL.
+    """
+    import pyarrow as pa
+
+    pnl_df = pnl_df[['hourly_ts', 'token_id'] + pnl_float_columns].astype(
+        {column: 'float64' for column in pnl_float_columns})
+    table = pa.Table.from_pandas(pnl_df, preserve_index=False)
+    return table.set_column(1, 'token_id', table.column('token_id').dictionary_encode())
+
+
+def encode_pnl(pnl_df, binary_format):
+    """
+    Serialize a PnL frame as an Arrow IPC stream or a Parquet file.
+    pyarrow is only needed when a binary format is requested.
+
+    Parameters:
+    - pnl_df (Dataframe): Output of lib.run_pnl_frame.
+    - binary_format (str): 'arrow' or 'parquet'.
+
+    Returns:
+    Bytes: Encoded table.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pnl_table(pnl_df)
+    sink = io.BytesIO()
+    if binary_format == 'arrow':
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        pq.write_table(table, sink)
+    return sink.getvalue()
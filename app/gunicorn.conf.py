@@ -0,0 +1,22 @@
+from dotenv import load_dotenv
+import multiprocessing
+import os
+
+load_dotenv()
+
+# gunicorn settings for the API, run from the app directory:
+#     gunicorn -c gunicorn.conf.py wsgi:app
+# Each worker is a separate process with its own caches and Allium client; threads
+# let a worker keep serving while some requests wait on Allium or Postgres.
+bind = f"0.0.0.0:{os.getenv('API_PORT', '9999')}"
+# PnL job state is only visible across workers through a shared store (PNL_JOB_STORE_URL,
+# default PNL_CACHE_URL); without one, default to a single worker so job polls and batch
+# downloads reach the process that ran the job
+job_store = os.getenv('PNL_JOB_STORE_URL', os.getenv('PNL_CACHE_URL'))
+default_workers = multiprocessing.cpu_count() * 2 + 1 if job_store else 1
+workers = int(os.getenv('API_WORKERS', default_workers))
+threads = int(os.getenv('API_THREADS', 32))
+worker_class = 'gthread'
+timeout = int(os.getenv('API_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
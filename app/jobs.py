@@ -0,0 +1,244 @@
+from allium import QueryCancelled
+from dotenv import load_dotenv
+import itertools
+import os
+import queue
+import threading
+import time
+import uuid
+
+load_dotenv()
+
+PNL_JOB_WORKERS = int(os.getenv("PNL_JOB_WORKERS", 4))
+PNL_JOB_QUEUE_SIZE = int(os.getenv("PNL_JOB_QUEUE_SIZE", 256))
+PNL_JOB_TTL = int(os.getenv("PNL_JOB_TTL", 600))
+# shared store for job state, so any API process can answer for a job; defaults to the
+# response cache backend and is required when gunicorn runs more than one worker
+PNL_JOB_STORE_URL = os.getenv("PNL_JOB_STORE_URL", os.getenv("PNL_CACHE_URL"))
+# seconds between checks of the shared store for cancels sent to other processes
+PNL_JOB_POLL = float(os.getenv("PNL_JOB_POLL", 1))
+
+finished_statuses = ['success', 'error', 'cancelled']
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    """
+    One submitted PnL computation and its outcome.
+    """
+
+    def __init__(self, key, func, priority):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.func = func
+        self.priority = priority
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.finished_at = None
+        self.cancel = threading.Event()
+
+    def to_dict(self):
+        job_data = {'job_id': self.id, 'status': self.status}
+        if self.status == 'success':
+            job_data['result'] = self.result
+        if self.error is not None:
+            job_data['error'] = self.error
+        return job_data
+
+    @classmethod
+    def from_dict(cls, job_data):
+        """
+        Rebuild a job written to the shared store by another process, for reading only.
+        """
+        job = cls(None, None, 0)
+        job.id = job_data['job_id']
+        job.status = job_data['status']
+        job.result = job_data.get('result')
+        job.error = job_data.get('error')
+        return job
+
+
+class JobQueue:
+    """
+    Background worker pool for slow PnL lookups. Jobs wait in a bounded priority queue,
+    higher priority first and first come first served within a priority. Submitting a key
+    that is already queued or running returns the existing job. Finished jobs are kept
+    for ttl seconds so clients can poll their results.
+
+    With a shared store every state change is also written there, so a job can be read,
+    deduplicated and cancelled from any API process, not only the one running it.
+    """
+
+    def __init__(self, workers=PNL_JOB_WORKERS, maxsize=PNL_JOB_QUEUE_SIZE, ttl=PNL_JOB_TTL,
+                 store=None, poll=PNL_JOB_POLL):
+        self.workers = workers
+        self.ttl = ttl
+        self.store = store
+        self.poll = poll
+        self.queue = queue.PriorityQueue(maxsize=maxsize)
+        self.jobs = {}
+        self.active = {}
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.threads = []
+        self.watcher = None
+        self.publish_lock = threading.Lock()
+
+    def _start_workers(self):
+        while len(self.threads) < self.workers:
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        if self.store is not None and self.watcher is None:
+            self.watcher = threading.Thread(target=self._watch, daemon=True)
+            self.watcher.start()
+
+    def _publish(self, job):
+        # serialized so a slower write can't replace a newer state of the job
+        if self.store is not None:
+            with self.publish_lock:
+                self.store.set('job:' + job.id, job.to_dict())
+
+    def _watch(self):
+        """
+        Apply cancels requested through the shared store to this process's unfinished
+        jobs and rewrite their state so it outlives the store ttl while they run.
+        """
+        while True:
+            time.sleep(self.poll)
+            with self.lock:
+                unfinished = list(self.active.values())
+            for job in unfinished:
+                try:
+                    if self.store.get('cancel:' + job.id):
+                        self.cancel(job.id)
+                    else:
+                        self._publish(job)
+                except Exception as e:
+                    print(f"job store unavailable: {e}")
+
+    def _purge(self, now):
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.finished_at is not None and now - job.finished_at > self.ttl]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def _finish(self, job, status, result=None, error=None):
+        with self.lock:
+            job.status = status
+            job.result = result
+            job.error = error
+            job.finished_at = time.monotonic()
+            job.func = None
+            if self.active.get(job.key) is job:
+                del self.active[job.key]
+        self._publish(job)
+
+    def _work(self):
+        while True:
+            _, _, job = self.queue.get()
+            with self.lock:
+                skip = job.cancel.is_set()
+                if not skip:
+                    job.status = 'running'
+            if not skip:
+                self._publish(job)
+            if skip:
+                self.queue.task_done()
+                continue
+            try:
+                self._finish(job, 'success', result=job.func(job.cancel))
+            except QueryCancelled:
+                self._finish(job, 'cancelled')
+            except ValueError as e:
+                self._finish(job, 'error', error=str(e))
+            except Exception as e:
+                status = 'cancelled' if job.cancel.is_set() else 'error'
+                print(e)
+                self._finish(job, status, error='Internal server error'
+                             if status == 'error' else None)
+            self.queue.task_done()
+
+    def submit(self, key, func, priority=0):
+        """
+        Queue a job, or return the queued or running job with the same key.
+
+        Parameters:
+        - key (str): Deduplication key, e.g. the response cache key.
+        - func (function): Called with a threading.Event that is set on cancel, returns the result.
+        - priority (int): Optional argument, default 0. Higher priorities run first.
+
+        Returns:
+        Job: The queued or existing job.
+        """
+        if self.store is not None:
+            active_id = self.store.get('active:' + key)
+            job_data = self.store.get('job:' + active_id) if active_id else None
+            if job_data is not None and job_data['status'] not in finished_statuses:
+                return Job.from_dict(job_data)
+
+        with self.lock:
+            self._purge(time.monotonic())
+            job = self.active.get(key)
+            if job is not None:
+                return job
+
+            job = Job(key, func, priority)
+            try:
+                self.queue.put_nowait((-priority, next(self.counter), job))
+            except queue.Full:
+                raise QueueFull("Too many pending PnL jobs, retry later")
+            self.jobs[job.id] = job
+            self.active[key] = job
+            self._start_workers()
+        if self.store is not None:
+            self.store.set('active:' + key, job.id)
+            self._publish(job)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None and self.store is not None:
+            job_data = self.store.get('job:' + job_id)
+            job = Job.from_dict(job_data) if job_data is not None else None
+        return job
+
+    def cancel(self, job_id):
+        """
+        Cancel a queued or running job. A queued job is skipped, a running one stops
+        waiting on Allium through its cancel event. A job running in another process is
+        flagged in the shared store and cancelled by that process's watcher.
+
+        Returns:
+        Job: The job, None if the id is unknown.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            job = self.get(job_id)
+            if job is not None and job.status not in finished_statuses:
+                self.store.set('cancel:' + job_id, True)
+            return job
+        with self.lock:
+            if job.status in finished_statuses:
+                return job
+            job.cancel.set()
+            if job.status == 'queued':
+                job.status = 'cancelled'
+                job.finished_at = time.monotonic()
+                job.func = None
+                if self.active.get(job.key) is job:
+                    del self.active[job.key]
+        self._publish(job)
+        return job
+
+    def stats(self):
+        with self.lock:
+            statuses = [job.status for job in self.jobs.values()]
+        return {status: statuses.count(status)
+                for status in ['queued', 'running'] + finished_statuses}
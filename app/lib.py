@@ -1,203 +1,323 @@
+from allium import AlliumClient, QueryCancelled, ALLIUM_RESULT_LIMIT
 from datetime import datetime, timedelta
-from db.connect import execute_pd
-from db.queries import get_src_prices
+from decimal import Decimal, localcontext
+from db.balances import wallet_sync_state, stored_balances, store_balances, balance_dtypes
+from db.metrics import metrics
+from db.precision import asset_decimals
+from db.prices import fetch_prices, query_prices, latest_job_ts
+from db.snapshots import pnl_snapshots, save_pnl_snapshots
 from dotenv import load_dotenv
+from jobs import JobQueue, QueueFull
 import math
+import numpy as np
 import os
 import pandas as pd
-import requests
-import time
+import threading
 
 load_dotenv()
 
-ALLIUM_API_KEY = os.getenv('ALLIUM_API_KEY')
+WALLET_REFRESH_SECONDS = int(os.getenv('WALLET_REFRESH_SECONDS', 60))
+MAX_GRID_POINTS = int(os.getenv('MAX_GRID_POINTS', 1_000_000))
+SNAPSHOT_WRITE_WORKERS = int(os.getenv('SNAPSHOT_WRITE_WORKERS', 2))
+SNAPSHOT_WRITE_QUEUE_SIZE = int(os.getenv('SNAPSHOT_WRITE_QUEUE_SIZE', 256))
 
-allium_query_run_api_url = 'https://api.allium.so/api/v1/explorer/queries/UWHFUe3BPTFpd7EDVIiI/run-async'
-allium_status_api_url = 'https://api.allium.so/api/v1/explorer/query-runs/{run_id}/status'
-allium_results_api_url = 'https://api.allium.so/api/v1/explorer/query-runs/{run_id}/results?f=json'
+# supported PnL intervals: pandas frequency and Postgres interval
+intervals = {
+    '5m': ('5min', '5 minutes'),
+    '1h': ('1H', '1 hour'),
+    '1d': ('1D', '1 day'),
+}
+default_interval = '1h'
+default_window = timedelta(days=7)
 
+allium_client = AlliumClient()
 
-def post_query(query_url, wallet_address, headers):
+# snapshot upserts run off the request thread; identical pending writes are deduplicated
+snapshot_writes = JobQueue(SNAPSHOT_WRITE_WORKERS, SNAPSHOT_WRITE_QUEUE_SIZE, ttl=60)
+
+
+def get_wallet_data(wallet_address, since=None, cancel=None):
     """
-    Makes post request to Allium run query api.
-    Runs saved SQL query to last 1000 balance records from wallet.
+    Get a wallet's balance records from Allium through the shared client, which
+    coalesces concurrent lookups of the same wallet into one query run. The query returns
+    the latest ALLIUM_RESULT_LIMIT records, so a result that fills the limit without
+    reaching back to since may have dropped records and is rejected.
 
     Parameters:
-    - query_url (str): Query run api endpoint full url.
-    - wallet_address (str): Wallet address to return balance records from.
-    - headers (dict): Headers dictionary to pass api_key in post request.
+    - wallet_address (str): wallet address to calculate PNL for
+    - since (datetime.datetime): Optional argument. Only return records with a later block timestamp.
+    - cancel (threading.Event): Optional argument. Stops waiting on the query run when set.
 
     Returns:
-    Str: Run_id of the query that was run
+    List: Data array from Allium query results api JSON response, None if the lookup failed.
+    Raises QueryCancelled when cancel is set, so callers do not mistake it for a bad wallet,
+    and ValueError when the result was truncated.
     """
-    params = {'address': wallet_address}
-    run_config = {'limit': '100'}
+    try:
+        data = allium_client.fetch_wallet(wallet_address, cancel)
+        block_timestamps = [datetime.fromisoformat(i['block_timestamp']).replace(tzinfo=None)
+                            for i in data]
+    except QueryCancelled:
+        raise
+    except Exception as e:
+        print(f"Failed to get wallet data: {e}")
+        return None
+    if len(data) >= ALLIUM_RESULT_LIMIT and (since is None or min(block_timestamps) > since):
+        raise ValueError(f"Wallet has more than {ALLIUM_RESULT_LIMIT} balance records to sync, "
+                         "raise ALLIUM_RESULT_LIMIT")
+    if since:
+        data = [i for i, ts in zip(data, block_timestamps) if ts > since]
+    return data
 
-    resp = requests.post(
-        query_url, json={'parameters': params, 'run_config': run_config}, headers=headers)
 
-    run_id = resp.json()['run_id']
-    return run_id
+_refreshing_wallets = set()
+_refreshing_lock = threading.Lock()
 
 
-def wait_for_status(run_id, status_url, headers, check_interval=1, timeout=1200):
+def refresh_wallet_balances(wallet_address, since=None, cancel=None):
     """
-    Makes get request to Allium query status api. Checks status of query at 
-    set check_interval while run time is less than timeout. 
-    Prints status updates while status is not a final status.
-    When a final status is received, the while loop is broken.
+    Fetch balance records newer than since from Allium and add them to the local store.
+    The sync state is left untouched when the Allium call fails.
 
     Parameters:
-    - run_id (str): Run_id of query that was run in post_query function.
-    - status_url (str): Full url of Allium query_status endpoint.
-    - headers (dict): Headers dictionary to pass api_key in post request.
-    - check_interval (int): Optional argument, default 1. Time to sleep in between status checks.
-    - timeout (int): Optional argument, default 1200. Time to wait for query to reach final status.
+    - wallet_address (str): Wallet address, lower case.
+    - since (datetime.datetime): Optional argument. Latest block timestamp already stored.
+    - cancel (threading.Event): Optional argument. Stops waiting on Allium when set.
 
     Returns:
     None
     """
-    formatted_status_url = status_url.format(run_id=run_id)
-    start = time.time()
-    while time.time() < start + timeout:
-        resp = requests.get(formatted_status_url, headers=headers)
-        status = resp.json()
-        if status not in ['created', 'queued', 'running']:
-            print(f"Query finished running. Status: {status}")
-            break
-        else:
-            print(
-                f"Query status: {status}. Rechecking in {check_interval} second(s).")
-            time.sleep(check_interval)
+    records = get_wallet_data(wallet_address, since, cancel)
+    if records is not None:
+        store_balances(wallet_address, records)
 
-    if time.time() > start + timeout:
-        print("Query timed out before reaching final status")
 
-
-def get_results(run_id, results_url, headers):
+def refresh_in_background(wallet_address, since):
+    """
+    Run refresh_wallet_balances on a daemon thread, at most one per wallet at a time.
     """
-    Makes get request to Allium query results api. Returns results in json format.
+    with _refreshing_lock:
+        if wallet_address in _refreshing_wallets:
+            return
+        _refreshing_wallets.add(wallet_address)
 
-    Parameters:
-    - run_id (str): Run_id of query that was run in post_query function.
-    - results_url (str): Full url of Allium query results endpoint.
-    - headers (dict): Headers dictionary to pass api_key in post request.
+    def run():
+        try:
+            refresh_wallet_balances(wallet_address, since)
+        except Exception as e:
+            print(f"Failed to refresh wallet {wallet_address}: {e}")
+        finally:
+            with _refreshing_lock:
+                _refreshing_wallets.discard(wallet_address)
 
-    Returns:
-    JSON response: Results_data, response from Allium query results api.
-    """
-    formatted_results_url = results_url.format(run_id=run_id)
-    results_resp = requests.get(
-        formatted_results_url,  headers=headers
-    )
-    results_data = results_resp.json()
-    return results_data
+    threading.Thread(target=run, daemon=True).start()
 
 
-def get_wallet_data(wallet_address):
+def get_wallet_balances(wallet_address, cancel=None, exact=False):
     """
-    Runs above functions in flow to get results of query run.
+    Return a wallet's balance records from the local store. A wallet seen for the first
+    time is synced from Allium before returning; a known wallet is served immediately
+    and refreshed in the background once its last sync is older than WALLET_REFRESH_SECONDS.
 
     Parameters:
     - wallet_address (str): wallet address to calculate PNL for
+    - cancel (threading.Event): Optional argument. Stops waiting on a first time sync when set.
+    - exact (bool): Optional argument, default False. Return balances as Decimal.
 
     Returns:
-    List: Data array from Allium query results api JSON response.
+    List: Balance records with token_id, block_timestamp and balance.
     """
-    headers = {
-        'X-API-Key': ALLIUM_API_KEY
-    }
-    try:
-        run_id = post_query(allium_query_run_api_url, wallet_address, headers)
-        wait_for_status(run_id, allium_status_api_url, headers)
-        results_data = get_results(run_id, allium_results_api_url, headers)
-        print(results_data)
-        return results_data['data']
-    except Exception as e:
-        print(f"Failed to get wallet data: {e}")
+    wallet_address = wallet_address.lower()
+    sync_state = wallet_sync_state(wallet_address)
+
+    if sync_state is None:
+        refresh_wallet_balances(wallet_address, cancel=cancel)
+    else:
+        last_block_timestamp, sync_age_seconds = sync_state
+        if sync_age_seconds > WALLET_REFRESH_SECONDS:
+            since = None if pd.isna(last_block_timestamp) else \
+                pd.Timestamp(last_block_timestamp).to_pydatetime()
+            refresh_in_background(wallet_address, since)
+
+    return stored_balances(wallet_address, exact)
 
 
-def get_prices(asset):
+def get_prices(asset, start, end, interval=default_interval):
     """
     Run SQL query and return pandas dataframe with results.
-    Gets most recent job run of hourly coin price data from last 7 days.
+    Gets coin price data between start and end, one closing price per interval.
 
     Parameters:
     - asset (str): Asset to return prices for
+    - start (datetime.datetime): Inclusive start of the price window
+    - end (datetime.datetime): Exclusive end of the price window
+    - interval (str): Optional argument, default '1h'. Key of intervals.
 
     Returns:
     Dataframe: Price data dataframe from database
     """
-    formatted_get_src_prices = get_src_prices.format(asset=asset)
-    prices_df = execute_pd(formatted_get_src_prices)
+    prices_df = fetch_prices([asset], start, end, intervals[interval][1])
     return prices_df
 
 
-def get_pnl(wallet_balance_df_all, asset):
+def get_prices_batch(assets, start, end, interval=default_interval):
     """
-    Use pandas to merge together the wallet balance data, a range of hourly timestamps from
-    now - 7 days to now and the price data from the database. 
+    Run a single SQL query returning prices for several assets.
+    Gets coin price data between start and end, one closing price per interval.
+
+    Parameters:
+    - assets (list): Assets to return prices for
+    - start (datetime.datetime): Inclusive start of the price window
+    - end (datetime.datetime): Exclusive end of the price window
+    - interval (str): Optional argument, default '1h'. Key of intervals.
+
+    Returns:
+    Dataframe: Price data dataframe from database, one row per asset and interval
+    """
+    prices_df = fetch_prices(assets, start, end, intervals[interval][1])
+    return prices_df
+
+
+def build_grid(interval=default_interval, start=None, end=None):
+    """
+    Build the timestamp grid PnL is calculated on, directly at the requested interval.
+
+    Parameters:
+    - interval (str): Optional argument, default '1h'. Key of intervals.
+    - start (datetime.datetime): Optional argument. Grid start, defaults to 7 days before end.
+    - end (datetime.datetime): Optional argument. Grid end, defaults to now.
+
+    Returns:
+    DatetimeIndex: Grid timestamps, truncated to the interval.
+    """
+    if interval not in intervals:
+        raise ValueError(
+            f"Unsupported interval {interval}, use one of {', '.join(intervals)}")
+    freq = intervals[interval][0]
+
+    end = pd.Timestamp(end or datetime.now()).floor(freq)
+    start = pd.Timestamp(start or end - default_window).floor(freq)
+    if start > end:
+        raise ValueError("start must be before end")
+
+    n_points = (end - start) // pd.Timedelta(freq) + 1
+    if n_points > MAX_GRID_POINTS:
+        raise ValueError(
+            f"Range too long for interval {interval}, use a coarser interval or shorter range")
+    return pd.date_range(start, end, freq=freq)
+
+
+def fill_balances(grid_ts, balance_ts, balances):
+    """
+    Vectorized running balance. For each timestamp in the grid, returns the most recent
+    balance whose (bucketed) timestamp is at or before it, or 0 if no balance precedes it.
+    Balances sharing a bucket resolve to the last one in input order, so callers should
+    sort records by their raw timestamp first.
+
+    Parameters:
+    - grid_ts (np.ndarray): Sorted datetime64 timestamps to calculate balances for.
+    - balance_ts (np.ndarray): Datetime64 timestamps of balance records, truncated to the grid frequency.
+    - balances (np.ndarray): Balance values aligned with balance_ts.
+
+    Returns:
+    np.ndarray: Running balance for each timestamp in grid_ts.
+    """
+    if len(balances) == 0:
+        return np.zeros(len(grid_ts))
+
+    order = np.argsort(balance_ts, kind='stable')
+    sorted_ts = balance_ts[order]
+    sorted_balances = balances[order]
+
+    idx = np.searchsorted(sorted_ts, grid_ts, side='right') - 1
+    return np.where(idx >= 0, sorted_balances[idx], 0)
+
+
+def fill_balances_grouped(grid_ts, codes, balance_ts, balances, n_groups):
+    """
+    Vectorized running balance for several assets sharing one grid. Same semantics as
+    fill_balances, computed for every group at once on a (n_groups, len(grid_ts)) matrix.
+
+    Parameters:
+    - grid_ts (np.ndarray): Sorted datetime64 timestamps to calculate balances for.
+    - codes (np.ndarray): Integer group (asset) code of each balance record.
+    - balance_ts (np.ndarray): Datetime64 timestamps of balance records, truncated to the grid frequency.
+    - balances (np.ndarray): Balance values aligned with balance_ts.
+    - n_groups (int): Number of groups, codes range from 0 to n_groups - 1.
+
+    Returns:
+    np.ndarray: Running balance matrix, one row per group and one column per grid timestamp.
+    """
+    n_grid = len(grid_ts)
+    present = np.zeros((n_groups, n_grid), dtype=bool)
+    values = np.zeros((n_groups, n_grid), dtype=balances.dtype)
+
+    # records after the grid never affect it, records before it land in the first cell
+    order = np.argsort(balance_ts, kind='stable')
+    order = order[balance_ts[order] <= grid_ts[-1]]
+    pos = np.searchsorted(grid_ts, balance_ts[order], side='right') - 1
+    cells = codes[order] * n_grid + np.clip(pos, 0, None)
+
+    # keep the latest record for each cell
+    _, last_reversed = np.unique(cells[::-1], return_index=True)
+    last = len(cells) - 1 - last_reversed
+    present.flat[cells[last]] = True
+    values.flat[cells[last]] = balances[order][last]
+
+    # forward fill along the grid from the last cell holding a record
+    last_cell = np.where(present, np.arange(n_grid), -1)
+    np.maximum.accumulate(last_cell, axis=1, out=last_cell)
+    filled = np.take_along_axis(values, np.clip(last_cell, 0, None), axis=1)
+    return np.where(last_cell >= 0, filled, 0)
+
+
+def get_pnl(wallet_balance_df_all, asset, interval=default_interval, start=None, end=None):
+    """
+    Use pandas to merge together the wallet balance data, a range of timestamps at the
+    requested interval (hourly from now - 7 days to now by default) and the price data
+    from the database. 
     Calculate running balance for entire time range. Calulate running USD value by combining 
     running balance and price. Calculate PnL by comparing start USD value of wallet to 
     running USD value of wallet.
 
     Parameters:
     - asset (str): Asset to calculate PnL for.
+    - interval (str): Optional argument, default '1h'. Key of intervals.
+    - start (datetime.datetime): Optional argument. Window start, defaults to 7 days before end.
+    - end (datetime.datetime): Optional argument. Window end, defaults to now.
 
     Returns:
-    Dict: PnL data for the last week - any data missing since last run of price data pipeline.
+    Dict: PnL data for the window - any data missing since last run of price data pipeline.
+    Timestamps are returned under hourly_ts for every interval.
     """
-    wallet_balance_df = wallet_balance_df_all[wallet_balance_df_all['token_id'] == asset]
+    wallet_balance_df = wallet_balance_df_all[
+        wallet_balance_df_all['token_id'] == asset].copy()
+
+    # create list of timestamps in the window
+    hour_range = build_grid(interval, start, end)
+    freq = intervals[interval][0]
 
-    # reformat timestamp columns and create hourly timestamps
+    # reformat timestamp columns and truncate to the interval
     wallet_balance_df['timestamp_dt'] = pd.to_datetime(
         wallet_balance_df['block_timestamp'], format='%Y-%m-%dT%H:%M:%S')
-    wallet_balance_df['hourly_ts'] = pd.to_datetime(
-        wallet_balance_df['timestamp_dt'].dt.strftime("%Y-%m-%d %H:00:00"))
-
-    # create list of hours between now and now - 7 days
-    dt_now = datetime.now().replace(minute=0, second=0, microsecond=0)
-    dt_now_minus_7_days = dt_now - timedelta(days=7)
-    hour_range = pd.date_range(dt_now_minus_7_days, dt_now, freq='H')
-
-    # get the starting balance for the hour range df
-    min_hour = hour_range.min()
-    max_wallet_balance_before_hour_range = wallet_balance_df[
-        wallet_balance_df['timestamp_dt'] <= min_hour]['timestamp_dt'].max()
-    last_balance_before_hour_range = wallet_balance_df[
-        wallet_balance_df['timestamp_dt'] == max_wallet_balance_before_hour_range]
-    last_balance_before_hour_range['join_col'] = min_hour
-
-    # create df from hourly range list, merge hourly range df and starting balance
-    hourly_range_df = pd.DataFrame(hour_range, columns=['hourly_ts'])
-    merged_start_bal = hourly_range_df.merge(
-        last_balance_before_hour_range[['join_col', 'balance']], how='left', left_on='hourly_ts', right_on='join_col')
-
-    # merge wallet balance data with hourly range df
-    merged_balances = merged_start_bal.merge(
-        wallet_balance_df, how='left', on='hourly_ts')
-
-    # calculate running balance, fill in blank balance rows
-    for i, v in merged_balances.fillna(0).iterrows():
-        balance_null = v['balance_x'] == 0
-
-        if balance_null:
-            merged_balances.loc[i,
-                                'balance_x'] = merged_balances.loc[i-1, 'balance_x']
-
-        if v['balance_y'] != 0:
-            current_balance = merged_balances.loc[i, 'balance_y']
-            merged_balances.loc[i, 'balance_x'] = current_balance
-        else:
-            current_balance = merged_balances.loc[i, 'balance_x']
-
-        merged_balances.loc[i, 'balance_actual'] = current_balance
+    wallet_balance_df['hourly_ts'] = wallet_balance_df['timestamp_dt'].dt.floor(freq)
+    wallet_balance_df = wallet_balance_df.sort_values('timestamp_dt', kind='stable')
+
+    # calculate running balance for every timestamp in the range
+    with metrics.span('balance_fill'):
+        merged_balances = pd.DataFrame(hour_range, columns=['hourly_ts'])
+        merged_balances['balance_actual'] = fill_balances(
+            hour_range.values,
+            wallet_balance_df['hourly_ts'].values,
+            wallet_balance_df['balance'].values)
 
     # merge running balances with prices
-    prices_df = get_prices(asset)
+    prices_df = get_prices(
+        asset, hour_range[0], hour_range[-1] + pd.Timedelta(freq), interval)
     merged_balances['token_id'] = asset
-    merged_prices = merged_balances.merge(
-        prices_df, how='left', on=['hourly_ts', 'token_id'])
+    with metrics.span('price_merge'):
+        merged_prices = merged_balances.merge(
+            prices_df, how='left', on=['hourly_ts', 'token_id'])
 
     # calculate usd_value and pnl
     merged_prices['usd_value'] = merged_prices['balance_actual'] * \
@@ -208,37 +328,443 @@ def get_pnl(wallet_balance_df_all, asset):
     # clean up df, convert to dict to return
     clean_merged_prices = merged_prices[[
         'hourly_ts', 'balance_actual', 'price', 'usd_value', 'PnL']]
-    clean_merged_prices_dict = clean_merged_prices.to_dict(orient='records')
+    with metrics.span('to_records'):
+        clean_merged_prices_dict = clean_merged_prices.to_dict(orient='records')
     return clean_merged_prices_dict
 
 
-def run_pnl_flow(wallet_address):
+def get_usd_values(wallet_balance_df_all, assets, hour_range, interval=default_interval,
+                   prices_df=None):
     """
-    Call get_wallet_data function to get data from Allium api. 
-    Check if data is returned from Allium, raise error for invalid/unsupported wallet,
-    Handle wallets with several coin balances.
+    Calculate running balance, price and USD value of several assets on a shared grid,
+    with one price query for all assets.
 
     Parameters:
-    - wallet_address (str): Wallet address to calculate PnL for
+    - wallet_balance_df_all (Dataframe): Wallet balance records for all assets.
+    - assets (list): Assets to calculate values for.
+    - hour_range (DatetimeIndex): Grid built by build_grid.
+    - interval (str): Optional argument, default '1h'. Key of intervals, matching the grid.
+    - prices_df (Dataframe): Optional argument. Prices already fetched with get_prices_batch
+      for the grid, e.g. shared by several wallets. Queried when None.
 
     Returns:
-    Dict:
-        PnL data for all supported coins in the wallet. 
-        All data for the last week minus any data missing since last run of price data pipeline.
+    Dataframe: hourly_ts, token_id, balance_actual, price and usd_value, one row per
+    asset and grid timestamp, grouped by asset in the order of assets.
+    """
+    assets = list(assets)
+    wallet_balance_df = wallet_balance_df_all[
+        wallet_balance_df_all['token_id'].isin(assets)].copy()
+    freq = intervals[interval][0]
+
+    # reformat timestamp columns and truncate to the interval
+    wallet_balance_df['timestamp_dt'] = pd.to_datetime(
+        wallet_balance_df['block_timestamp'], format='%Y-%m-%dT%H:%M:%S')
+    wallet_balance_df['hourly_ts'] = wallet_balance_df['timestamp_dt'].dt.floor(freq)
+    wallet_balance_df = wallet_balance_df.sort_values('timestamp_dt', kind='stable')
+
+    # calculate running balance for every asset and timestamp in the range
+    with metrics.span('balance_fill'):
+        codes = pd.Categorical(
+            wallet_balance_df['token_id'], categories=assets).codes
+        balance_matrix = fill_balances_grouped(
+            hour_range.values,
+            codes,
+            wallet_balance_df['hourly_ts'].values,
+            wallet_balance_df['balance'].values,
+            len(assets))
+        merged_balances = pd.DataFrame({
+            'hourly_ts': np.tile(hour_range.values, len(assets)),
+            'token_id': np.repeat(np.array(assets, dtype=object), len(hour_range)),
+            'balance_actual': balance_matrix.ravel(),
+        })
+
+    # merge running balances with prices
+    if prices_df is None:
+        prices_df = get_prices_batch(
+            assets, hour_range[0], hour_range[-1] + pd.Timedelta(freq), interval)
+    with metrics.span('price_merge'):
+        merged_prices = merged_balances.merge(
+            prices_df, how='left', on=['hourly_ts', 'token_id'])
+        if merged_prices['price'].dtype == object:
+            # exact Decimal prices: a Decimal NaN keeps the product defined for missing ones
+            merged_prices['price'] = merged_prices['price'].fillna(Decimal('NaN'))
+        merged_prices['usd_value'] = merged_prices['balance_actual'] * \
+            merged_prices['price']
+    return merged_prices
+
+
+def add_pnl(merged_prices):
+    """
+    Calculate PnL of each row against the first row of its asset.
+
+    Parameters:
+    - merged_prices (Dataframe): Output of get_usd_values.
+
+    Returns:
+    Dataframe: merged_prices with a PnL column.
     """
-    wallet_balance_data = get_wallet_data(wallet_address)
+    first_rows = ~merged_prices['token_id'].duplicated()
+    start_values = merged_prices.loc[first_rows].set_index('token_id')[
+        'usd_value']
+    merged_prices['PnL'] = merged_prices['usd_value'] - \
+        merged_prices['token_id'].map(start_values)
+    return merged_prices
+
+
+def split_by_asset(merged_prices):
+    """
+    Split a multi-asset PnL frame into the per-asset record lists returned by the API.
+    """
+    all_assets_pnl = {}
+    with metrics.span('to_records'):
+        for asset, asset_prices in merged_prices.groupby('token_id', sort=False):
+            clean_merged_prices = asset_prices[[
+                'hourly_ts', 'balance_actual', 'price', 'usd_value', 'PnL']]
+            all_assets_pnl[asset] = clean_merged_prices.to_dict(orient='records')
+    return all_assets_pnl
+
+
+def trim_decimal(value):
+    """
+    Drop trailing zeros from a Decimal without switching to exponent notation.
+    """
+    return Decimal(f"{value.normalize():f}")
+
+
+def to_decimal(merged_prices):
+    """
+    Convert a PnL frame computed from exact Decimal balances and prices (see run_pnl_exact)
+    for output. Balances finer than the asset's token decimals from SRC.ASSET_PRECISION
+    are rounded to them, never padded, and usd_value and PnL are computed in Decimal
+    arithmetic. Missing prices become None.
+
+    Parameters:
+    - merged_prices (Dataframe): Output of get_usd_values with Decimal balances and prices.
+
+    Returns:
+    Dataframe: Copy of merged_prices with Decimal balance_actual, price, usd_value and PnL.
+    """
+    decimal_prices = merged_prices.copy()
+    decimals = asset_decimals(list(decimal_prices['token_id'].unique()))
+    balances, prices, usd_values, pnls = [], [], [], []
+    start_values = {}
+    with localcontext() as ctx:
+        # wide enough for uint256 token amounts at 18 decimals
+        ctx.prec = 96
+        for asset, balance, price in zip(decimal_prices['token_id'], decimal_prices['balance_actual'],
+                                         decimal_prices['price']):
+            balance = Decimal(balance)
+            if balance.as_tuple().exponent < -decimals[asset]:
+                balance = balance.quantize(Decimal(1).scaleb(-decimals[asset]))
+            balances.append(balance)
+            if pd.isna(price):
+                prices.append(None)
+                usd_values.append(None)
+                pnls.append(None)
+                start_values.setdefault(asset, None)
+                continue
+            usd_value = balance * price
+            start_value = start_values.setdefault(asset, usd_value)
+            prices.append(price)
+            usd_values.append(trim_decimal(usd_value))
+            pnls.append(None if start_value is None else trim_decimal(usd_value - start_value))
+    decimal_prices['balance_actual'] = balances
+    decimal_prices['price'] = prices
+    decimal_prices['usd_value'] = usd_values
+    decimal_prices['PnL'] = pnls
+    return decimal_prices
+
+
+def get_pnl_batch(wallet_balance_df_all, assets, interval=default_interval, start=None, end=None):
+    """
+    Batched version of get_pnl. Builds one grid, fetches prices for every asset
+    in a single query and computes running balance, USD value and PnL for all assets
+    together.
+
+    Parameters:
+    - wallet_balance_df_all (Dataframe): Wallet balance records for all assets.
+    - assets (list): Assets to calculate PnL for.
+    - interval (str): Optional argument, default '1h'. Key of intervals.
+    - start (datetime.datetime): Optional argument. Window start, defaults to 7 days before end.
+    - end (datetime.datetime): Optional argument. Window end, defaults to now.
+
+    Returns:
+    Dict: PnL data for the window per asset, same records as get_pnl.
+    """
+    hour_range = build_grid(interval, start, end)
+    merged_prices = get_usd_values(
+        wallet_balance_df_all, assets, hour_range, interval)
+    return split_by_asset(add_pnl(merged_prices))
+
+
+def downsample_index(n_points, max_points=None):
+    """
+    Pick evenly strided positions so at most max_points of n_points remain,
+    always keeping the last point.
+
+    Parameters:
+    - n_points (int): Length of the series.
+    - max_points (int): Optional argument. Maximum points to keep, all points if None.
+
+    Returns:
+    np.ndarray: Sorted positions to keep.
+    """
+    if not max_points or n_points <= max_points:
+        return np.arange(n_points)
+    stride = math.ceil(n_points / max_points)
+    return np.arange(n_points - 1, -1, -stride)[::-1]
+
+
+def get_portfolio_pnl(pnl_df, max_points=None):
+    """
+    Aggregate a wallet's per-asset PnL into one portfolio series. All assets are aligned
+    on the shared grid in a single pivot; assets without a price at a timestamp contribute
+    nothing to it. Portfolio PnL is measured against the first grid timestamp before any
+    downsampling.
+
+    Parameters:
+    - pnl_df (Dataframe): Output of run_pnl_frame.
+    - max_points (int): Optional argument. Downsample the series to at most this many points.
+
+    Returns:
+    Dict: hourly_ts, usd_value and PnL lists for the portfolio, and under assets the
+    usd_value and PnL lists of each asset on the same timestamps.
+    """
+    usd_values = pnl_df.pivot(
+        index='hourly_ts', columns='token_id', values='usd_value')
+    asset_pnl = pnl_df.pivot(index='hourly_ts', columns='token_id', values='PnL')
+    assets = list(pnl_df['token_id'].unique())
+
+    total_usd = usd_values.sum(axis=1, min_count=1)
+    total_pnl = total_usd - total_usd.iloc[0]
+
+    keep = downsample_index(len(usd_values), max_points)
+    return {
+        'hourly_ts': usd_values.index[keep].tolist(),
+        'usd_value': total_usd.iloc[keep].tolist(),
+        'PnL': total_pnl.iloc[keep].tolist(),
+        'assets': {asset: {'usd_value': usd_values[asset].iloc[keep].tolist(),
+                           'PnL': asset_pnl[asset].iloc[keep].tolist()} for asset in assets},
+    }
+
+
+def save_snapshots_in_background(wallet_address, interval, pnl_df, last_block_timestamp):
+    """
+    Queue save_pnl_snapshots on the snapshot_writes workers so the request returns without
+    waiting on the upsert. When the queue is full the rows are skipped; a later request
+    computes and queues them again. The rows are dropped at merge time if the wallet has
+    been synced past last_block_timestamp in the meantime.
+    """
+    key = f"{wallet_address}:{interval}:{pnl_df['hourly_ts'].min()}:{pnl_df['hourly_ts'].max()}:" \
+          f"{last_block_timestamp}"
+
+    def write(cancel):
+        with metrics.span('snapshot_write'):
+            save_pnl_snapshots(wallet_address, interval, pnl_df, last_block_timestamp)
+
+    try:
+        snapshot_writes.submit(key, write)
+    except QueueFull:
+        print(f"snapshot write queue full, skipped {len(pnl_df)} rows for {wallet_address}")
+
+
+def get_usd_values_incremental(wallet_address, wallet_balance_df_all, assets,
+                               interval=default_interval, start=None, end=None):
+    """
+    Snapshot backed version of get_usd_values. Rows already persisted in SRC.PNL_SNAPSHOT
+    for the wallet are reused from the start of the window up to each asset's checkpoint
+    (the end of the unbroken run of snapshot rows), and only assets behind the end of the
+    window are computed, from the earliest of their checkpoints. Newly computed rows are
+    persisted once their interval has closed and either have a price or are older than
+    the latest ELT job, which drops the snapshots of any prices it loads later.
+
+    Parameters:
+    - wallet_address (str): Wallet address the balances belong to.
+    - wallet_balance_df_all (Dataframe): Wallet balance records for all assets.
+    - assets (list): Assets to calculate PnL for.
+    - interval (str): Optional argument, default '1h'. Key of intervals.
+    - start (datetime.datetime): Optional argument. Window start, defaults to 7 days before end.
+    - end (datetime.datetime): Optional argument. Window end, defaults to now.
+
+    Returns:
+    Dataframe: Same rows as get_usd_values over the window's grid.
+    """
+    assets = list(assets)
+    wallet_address = wallet_address.lower()
+    hour_range = build_grid(interval, start, end)
+    step = pd.Timedelta(intervals[interval][0])
+
+    # an asset's checkpoint is the first grid timestamp not covered by the unbroken run
+    # of snapshot rows from the start of the window
+    with metrics.span('snapshot_read'):
+        snapshot_df = pnl_snapshots(
+            wallet_address, interval, hour_range[0], hour_range[-1])
+    checkpoints = {}
+    for asset in assets:
+        snapshot_ts = snapshot_df.loc[snapshot_df['token_id']
+                                      == asset, 'hourly_ts'].values
+        n = min(len(snapshot_ts), len(hour_range))
+        mismatch = np.flatnonzero(snapshot_ts[:n] != hour_range.values[:n])
+        checkpoints[asset] = mismatch[0] if len(mismatch) else n
+    grid_end = hour_range[-1] + step
+    cutoffs = {asset: hour_range[k] if k < len(hour_range) else grid_end
+               for asset, k in checkpoints.items()}
+
+    reused = snapshot_df[snapshot_df['hourly_ts'] <
+                         snapshot_df['token_id'].map(cutoffs)]
+    frames = [reused]
+
+    # compute the assets that are behind in one batch, from the earliest of their checkpoints
+    behind = [asset for asset in assets if checkpoints[asset] < len(hour_range)]
+    if behind:
+        resume_at = min(checkpoints[asset] for asset in behind)
+        computed = get_usd_values(
+            wallet_balance_df_all, behind, hour_range[resume_at:], interval)
+        computed = computed[computed['hourly_ts'] >=
+                            computed['token_id'].map(cutoffs)]
+        frames.append(computed)
+
+        # persist rows that can no longer change: interval closed and price loaded, or no
+        # price by the latest ELT job (a later load of it drops the snapshot again)
+        stored = pd.MultiIndex.from_frame(snapshot_df[['token_id', 'hourly_ts']])
+        closed = computed['hourly_ts'] + step <= pd.Timestamp(datetime.now())
+        settled = computed['price'].notna()
+        if not settled[closed].all():
+            job_ts = latest_job_ts()
+            if job_ts is not None:
+                settled |= computed['hourly_ts'] + step <= pd.Timestamp(job_ts)
+        final = computed[closed & settled
+                         & ~pd.MultiIndex.from_frame(computed[['token_id', 'hourly_ts']]).isin(stored)]
+        if len(final):
+            save_snapshots_in_background(wallet_address, interval, final,
+                                         wallet_balance_df_all['block_timestamp'].max())
+
+    merged_prices = pd.concat(frames, ignore_index=True)
+    merged_prices['order'] = pd.Categorical(
+        merged_prices['token_id'], categories=assets).codes
+    merged_prices = merged_prices.sort_values(
+        ['order', 'hourly_ts'], kind='stable').reset_index(drop=True)
+    return merged_prices.drop(columns='order')
+
+
+def get_pnl_incremental(wallet_address, wallet_balance_df_all, assets, interval=default_interval,
+                        start=None, end=None):
+    """
+    Snapshot backed version of get_pnl_batch, see get_usd_values_incremental.
+
+    Returns:
+    Dict: PnL data for the window per asset, same records as get_pnl_batch.
+    """
+    merged_prices = get_usd_values_incremental(
+        wallet_address, wallet_balance_df_all, assets, interval, start, end)
+    return split_by_asset(add_pnl(merged_prices))
+
+
+def load_wallet_balances(wallet_address, cancel=None, exact=False):
+    """
+    Return a wallet's balance records as a Dataframe, raising ValueError when
+    the wallet has none. Balances are float64, or Decimal objects when exact.
+    """
+    with metrics.span('wallet_balances'):
+        wallet_balance_data = get_wallet_balances(wallet_address, cancel, exact)
     wallet_balance_df_all = pd.DataFrame.from_dict(wallet_balance_data)
     if len(wallet_balance_df_all) == 0:
         raise ValueError("Invalid or unsupported wallet address")
+    return wallet_balance_df_all if exact else wallet_balance_df_all.astype(balance_dtypes)
+
+
+def run_pnl_exact(wallet_address, cancel=None, interval=default_interval, start=None, end=None):
+    """
+    PnL flow for exact decimal output. Balances and prices are read as the stored NUMERIC
+    values, bypassing the float64 price cache, store and snapshots, and run through the
+    same fill and merge as get_usd_values on Decimal objects.
+
+    Parameters:
+    - wallet_address (str): Wallet address to calculate PnL for
+    - cancel (threading.Event): Optional argument. Stops waiting on Allium when set.
+    - interval (str): Optional argument, default '1h'. Key of intervals.
+    - start (datetime.datetime): Optional argument. Window start, defaults to 7 days before end.
+    - end (datetime.datetime): Optional argument. Window end, defaults to now.
+
+    Returns:
+    Dataframe: Output of to_decimal, grouped by asset.
+    """
+    wallet_balance_df_all = load_wallet_balances(wallet_address, cancel, exact=True)
+    assets = list(wallet_balance_df_all['token_id'].unique())
+    hour_range = build_grid(interval, start, end)
+    freq = intervals[interval][0]
+    with metrics.span('price_query', source='exact'):
+        prices_df = query_prices(assets, hour_range[0], hour_range[-1] + pd.Timedelta(freq),
+                                 intervals[interval][1], exact=True)
+    return to_decimal(get_usd_values(wallet_balance_df_all, assets, hour_range, interval, prices_df))
+
+
+def run_pnl_frame(wallet_address, cancel=None, interval=default_interval, start=None, end=None,
+                  snapshots=True):
+    """
+    Batched PnL flow returning one long Dataframe instead of per-asset records,
+    for callers that serialize the result themselves (e.g. streaming responses).
+
+    Parameters:
+    - wallet_address (str): Wallet address to calculate PnL for
+    - cancel (threading.Event): Optional argument. Stops waiting on Allium when set.
+    - interval (str): Optional argument, default '1h'. Key of intervals.
+    - start (datetime.datetime): Optional argument. Window start, defaults to 7 days before end.
+    - end (datetime.datetime): Optional argument. Window end, defaults to now.
+    - snapshots (bool): Optional argument, default True. Reuse and extend the wallet's
+      persisted PnL snapshots instead of recomputing the whole window.
 
+    Returns:
+    Dataframe: hourly_ts, token_id, balance_actual, price, usd_value and PnL, grouped by asset.
+    """
+    wallet_balance_df_all = load_wallet_balances(wallet_address, cancel)
+    assets = wallet_balance_df_all['token_id'].unique()
+    if snapshots:
+        merged_prices = get_usd_values_incremental(
+            wallet_address, wallet_balance_df_all, assets, interval, start, end)
     else:
-        assets = wallet_balance_df_all['token_id'].unique()
-        all_assets_pnl = {}
-        for asset in assets:
-            try:
-                asset_pnl_data = get_pnl(wallet_balance_df_all, asset)
-                all_assets_pnl[asset] = asset_pnl_data
-            except Exception as e:
-                print(f'Missing data for {asset}')
-
-        return all_assets_pnl
+        merged_prices = get_usd_values(
+            wallet_balance_df_all, assets, build_grid(interval, start, end), interval)
+    return add_pnl(merged_prices)
+
+
+def run_pnl_flow(wallet_address, batched=True, cancel=None, interval=default_interval,
+                 start=None, end=None, snapshots=True):
+    """
+    Call get_wallet_balances function to get balance data from the local store,
+    synced from the Allium api. 
+    Check if data is returned from Allium, raise error for invalid/unsupported wallet,
+    Handle wallets with several coin balances.
+
+    Parameters:
+    - wallet_address (str): Wallet address to calculate PnL for
+    - batched (bool): Optional argument, default True. Compute all assets in one pass
+      with a single price query instead of one get_pnl call per asset.
+    - cancel (threading.Event): Optional argument. Stops waiting on Allium when set.
+    - interval (str): Optional argument, default '1h'. Key of intervals.
+    - start (datetime.datetime): Optional argument. Window start, defaults to 7 days before end.
+    - end (datetime.datetime): Optional argument. Window end, defaults to now.
+    - snapshots (bool): Optional argument, default True. With batched, reuse and extend
+      the wallet's persisted PnL snapshots instead of recomputing the whole window.
+
+    Returns:
+    Dict:
+        PnL data for all supported coins in the wallet. 
+        All data for the window minus any data missing since last run of price data pipeline.
+    """
+    if batched:
+        return split_by_asset(run_pnl_frame(wallet_address, cancel, interval, start, end,
+                                            snapshots))
+
+    wallet_balance_df_all = load_wallet_balances(wallet_address, cancel)
+    assets = wallet_balance_df_all['token_id'].unique()
+    all_assets_pnl = {}
+    for asset in assets:
+        try:
+            asset_pnl_data = get_pnl(
+                wallet_balance_df_all, asset, interval, start, end)
+            all_assets_pnl[asset] = asset_pnl_data
+        except Exception as e:
+            print(f'Missing data for {asset}')
+
+    return all_assets_pnl
@@ -0,0 +1,82 @@
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+PNL_STREAM_BATCH_ROWS = int(os.getenv("PNL_STREAM_BATCH_ROWS", 10000))
+
+pnl_columns = ['hourly_ts', 'balance_actual', 'price', 'usd_value', 'PnL']
+stream_formats = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+}
+
+
+def iter_batches(pnl_df, batch_rows=PNL_STREAM_BATCH_ROWS):
+    """
+    Yield (asset, rows) slices of a PnL frame, at most batch_rows rows each,
+    in the frame's asset order.
+    """
+    for asset, asset_df in pnl_df.groupby('token_id', sort=False):
+        for i in range(0, len(asset_df), batch_rows):
+            yield asset, asset_df.iloc[i:i + batch_rows]
+
+
+def encode_batch(batch, columnar=False):
+    """
+    Convert a slice of a PnL frame to JSON-ready data: a list of row dicts, or with
+    columnar one list per field.
+    """
+    if columnar:
+        return {column: batch[column].tolist() for column in pnl_columns}
+    return batch[pnl_columns].to_dict(orient='records')
+
+
+def stream_ndjson(pnl_df, dumps, columnar=False, batch_rows=PNL_STREAM_BATCH_ROWS):
+    """
+    Serialize a PnL frame as newline delimited JSON, one line per asset batch
+    holding the asset and its rows.
+
+    Parameters:
+    - pnl_df (Dataframe): Output of lib.run_pnl_frame.
+    - dumps (function): JSON serializer, e.g. app.json.dumps.
+    - columnar (bool): Optional argument, default False. Encode rows as arrays per field.
+    - batch_rows (int): Optional argument, default PNL_STREAM_BATCH_ROWS. Rows per line.
+
+    Returns:
+    Generator: Lines of the response body.
+    """
+    for asset, batch in iter_batches(pnl_df, batch_rows):
+        yield dumps({'asset': asset, 'data': encode_batch(batch, columnar)}) + '\n'
+
+
+def stream_json(pnl_df, dumps, columnar=False, batch_rows=PNL_STREAM_BATCH_ROWS):
+    """
+    Serialize a PnL frame as one JSON document with the same shape as the buffered
+    /get-pnl response, written in asset batches. With columnar each asset holds a
+    list of column chunks ({field: [values]}) instead of a list of rows.
+
+    Parameters:
+    - pnl_df (Dataframe): Output of lib.run_pnl_frame.
+    - dumps (function): JSON serializer, e.g. app.json.dumps.
+    - columnar (bool): Optional argument, default False. Encode rows as arrays per field.
+    - batch_rows (int): Optional argument, default PNL_STREAM_BATCH_ROWS. Rows per chunk.
+
+    Returns:
+    Generator: Chunks of the response body.
+    """
+    yield '{"data": {'
+    current = None
+    for asset, batch in iter_batches(pnl_df, batch_rows):
+        if asset != current:
+            yield ('], ' if current is not None else '') + dumps(asset) + ': ['
+        else:
+            yield ', '
+        current = asset
+
+        encoded = dumps(encode_batch(batch, columnar))
+        # row batches are spliced into the asset's single list of rows
+        yield encoded if columnar else encoded[1:-1]
+    if current is not None:
+        yield ']'
+    yield '}, "message": "Success"}'
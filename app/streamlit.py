@@ -1,6 +1,6 @@
 from dotenv import load_dotenv
 import os
-import pandas as pd
+import pyarrow as pa
 import streamlit as st
 import requests
 
@@ -13,13 +13,17 @@ def gen_viz(wallet_address):
     API_PORT = os.getenv("API_PORT")
     url = API_BASE_URL + ':' + API_PORT + ENDPOINT
 
-    data = requests.get(url).json()['data']
+    # request the Arrow IPC stream: native timestamps and floats, no JSON parsing
+    resp = requests.get(
+        url, headers={'Accept': 'application/vnd.apache.arrow.stream'})
+    if resp.headers.get('Content-Type', '').startswith('application/json'):
+        st.error(resp.json()['message'])
+        return
+    pnl_df = pa.ipc.open_stream(resp.content).read_pandas()
 
-    for coin in data:
+    for coin, df in pnl_df.groupby('token_id', sort=False, observed=True):
         st.header(coin)
-        df = pd.DataFrame.from_dict(data[coin])
-        df['hour_of'] = pd.to_datetime(
-            df['hourly_ts'], format='%a, %d %b %Y %H:%M:%S GMT', utc=True)
+        df = df.rename(columns={'hourly_ts': 'hour_of'})
         sorted = df[['hour_of', 'balance_actual', 'price',
                      'usd_value', 'PnL']].sort_values(by='hour_of')
 
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from benchmarks.bench_balances import legacy_fill_balances, make_wallet
+from lib import fill_balances, fill_balances_grouped
+
+
+@pytest.mark.parametrize('n_rows, freq, density, seed', [
+    (168, 'H', 0.1, 0),
+    (2_016, 'H', 0.1, 1),
+    (2_016, '5min', 0.5, 2),
+    (500, 'D', 1.0, 3),
+])
+def test_fill_balances_matches_legacy_loop(n_rows, freq, density, seed):
+    grid, balances = make_wallet(n_rows, freq, density, seed)
+    expected = legacy_fill_balances(grid, balances)
+    actual = fill_balances(grid.values, balances['hourly_ts'].values, balances['balance'].values)
+    np.testing.assert_allclose(actual, expected)
+
+
+def test_fill_balances_grouped_matches_per_asset_fill():
+    rng = np.random.default_rng(4)
+    grid = np.arange('2024-01-01T00', '2024-01-08T00', dtype='datetime64[h]').astype('datetime64[ns]')
+    n_records, n_groups = 400, 5
+    # records before, inside and after the grid, unsorted, several sharing a bucket
+    balance_ts = grid[0] + rng.integers(-48, len(grid) + 48, n_records).astype('timedelta64[h]')
+    codes = rng.integers(0, n_groups - 1, n_records)
+    balances = rng.uniform(0, 100, n_records)
+
+    matrix = fill_balances_grouped(grid, codes, balance_ts, balances, n_groups)
+    assert matrix.shape == (n_groups, len(grid))
+    for group in range(n_groups):
+        mask = codes == group
+        np.testing.assert_array_equal(matrix[group], fill_balances(grid, balance_ts[mask], balances[mask]))
+    # the last group has no records
+    assert not matrix[-1].any()
@@ -0,0 +1,55 @@
+import json
+import threading
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+import batch_pnl
+import lib
+from allium import QueryCancelled
+
+end = datetime(2024, 1, 2)
+balance_records = [{'token_id': 'eth', 'block_timestamp': '2023-12-31T00:00:00', 'balance': 2.0}]
+
+
+@pytest.fixture
+def batch_sources(monkeypatch):
+    def load_wallet_balances(wallet_address, cancel=None, exact=False):
+        if wallet_address == '0xbroken':
+            raise KeyError('balance')
+        return pd.DataFrame(balance_records)
+
+    def get_prices_batch(assets, start, end, interval='1h'):
+        hours = pd.date_range(start, end, freq='1H', inclusive='left')
+        return pd.DataFrame({'hourly_ts': hours, 'token_id': 'eth', 'price': 100.0})
+
+    monkeypatch.setattr(lib, 'load_wallet_balances', load_wallet_balances)
+    monkeypatch.setattr(lib, 'get_prices_batch', get_prices_batch)
+
+
+def test_compute_wallet_records_unexpected_errors():
+    wallet_address, pnl_df, error = batch_pnl.compute_wallet(
+        '0xa', [{'token_id': 'eth'}], '1h', None, end)
+    assert wallet_address == '0xa' and pnl_df is None
+    assert error.startswith('KeyError')
+
+
+def test_failed_wallet_does_not_abort_batch(batch_sources, tmp_path):
+    output = str(tmp_path / 'pnl.ndjson')
+    summary = batch_pnl.run_batch(['0xa', '0xbroken'], output, end=end, processes=1)
+    assert summary['wallets'] == 2 and summary['failed'] == 1
+
+    with open(output) as f:
+        lines = {i['wallet_address']: i for i in map(json.loads, f)}
+    assert lines['0xbroken']['error'].startswith('KeyError')
+    assert len(lines['0xa']['data']['eth']) == 169
+
+
+def test_cancelled_batch_removes_output(batch_sources, tmp_path):
+    output = tmp_path / 'pnl.ndjson'
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(QueryCancelled):
+        batch_pnl.run_batch(['0xa', '0xb'], str(output), end=end, processes=1, cancel=cancel)
+    assert not output.exists()
@@ -0,0 +1,37 @@
+import cache
+from cache import LRUCache, ResponseCache, create_shared
+
+
+def test_lru_evicts_least_recently_used():
+    lru = LRUCache(maxsize=2, ttl=60)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    assert lru.get('a') == 1
+    lru.set('c', 3)
+    assert lru.get('b') is None
+    assert (lru.get('a'), lru.get('c')) == (1, 3)
+    assert lru.evictions == 1
+
+
+def test_lru_expires_entries(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    lru = LRUCache(maxsize=2, ttl=10)
+    lru.set('a', 1)
+    now[0] += 9
+    assert lru.get('a') == 1
+    now[0] += 1
+    assert lru.get('a') is None
+    assert len(lru.entries) == 0
+
+
+def test_response_cache_fills_local_from_shared():
+    shared = create_shared('local://', ttl=60)
+    writer = ResponseCache(LRUCache(maxsize=8, ttl=60), shared)
+    reader = ResponseCache(LRUCache(maxsize=8, ttl=60), shared)
+
+    assert reader.get('wallet') is None
+    writer.set('wallet', {'eth': [1.0]})
+    assert reader.get('wallet') == {'eth': [1.0]}
+    assert reader.get('wallet') == {'eth': [1.0]}
+    assert reader.stats() == {'hits': 1, 'shared_hits': 1, 'misses': 1, 'evictions': 0, 'size': 1}
@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+import lib
+
+now = datetime.now().replace(minute=0, second=0, microsecond=0)
+balances = pd.DataFrame({
+    'token_id': ['btc', 'dust', 'btc'],
+    'block_timestamp': [(now - timedelta(days=10)).strftime('%Y-%m-%dT%H:%M:%S'),
+                        (now - timedelta(days=9)).strftime('%Y-%m-%dT%H:%M:%S'),
+                        (now - timedelta(days=2)).strftime('%Y-%m-%dT%H:%M:%S')],
+    'balance': [1.0, 5.0, 3.0],
+})
+
+
+@pytest.fixture
+def snapshot_store(monkeypatch):
+    """
+    In-memory SRC.PNL_SNAPSHOT with synchronous writes. Only btc is priced.
+    """
+    store = {'rows': [], 'writes': [], 'computed': []}
+
+    def pnl_snapshots(wallet_address, interval, start, end):
+        snapshot_df = pd.DataFrame(store['rows'], columns=[
+            'hourly_ts', 'token_id', 'balance_actual', 'price', 'usd_value'])
+        snapshot_df['hourly_ts'] = snapshot_df['hourly_ts'].astype('datetime64[ns]')
+        snapshot_df = snapshot_df[(snapshot_df['hourly_ts'] >= start) & (snapshot_df['hourly_ts'] <= end)]
+        return snapshot_df.sort_values(['token_id', 'hourly_ts']).reset_index(drop=True)
+
+    def save_snapshots(wallet_address, interval, pnl_df, last_block_timestamp):
+        store['writes'].append((sorted(pnl_df['token_id'].unique()), last_block_timestamp))
+        store['rows'].extend(pnl_df[['hourly_ts', 'token_id', 'balance_actual', 'price',
+                                     'usd_value']].itertuples(index=False))
+
+    def get_prices_batch(assets, start, end, interval='1h'):
+        hours = pd.date_range(start, end, freq='1H', inclusive='left')
+        return pd.DataFrame({'hourly_ts': hours, 'token_id': 'btc', 'price': 100.0 + hours.hour})
+
+    get_usd_values = lib.get_usd_values
+
+    def spy_usd_values(wallet_balance_df_all, assets, hour_range, *args, **kwargs):
+        store['computed'].append((list(assets), hour_range[0]))
+        return get_usd_values(wallet_balance_df_all, assets, hour_range, *args, **kwargs)
+
+    monkeypatch.setattr(lib, 'pnl_snapshots', pnl_snapshots)
+    monkeypatch.setattr(lib, 'save_snapshots_in_background', save_snapshots)
+    monkeypatch.setattr(lib, 'get_prices_batch', get_prices_batch)
+    monkeypatch.setattr(lib, 'get_usd_values', spy_usd_values)
+    monkeypatch.setattr(lib, 'latest_job_ts', lambda: now)
+    return store
+
+
+def assert_same_pnl(expected, got):
+    for asset in expected:
+        pd.testing.assert_frame_equal(pd.DataFrame(expected[asset]), pd.DataFrame(got[asset]),
+                                      check_dtype=False)
+
+
+def test_unpriced_asset_does_not_hold_back_reuse(snapshot_store):
+    expected = lib.get_pnl_batch(balances, ['btc', 'dust'])
+    snapshot_store['computed'].clear()
+
+    assert_same_pnl(expected, lib.get_pnl_incremental('0xa', balances, ['btc', 'dust']))
+    # unpriced rows older than the latest ELT job are persisted with the priced ones
+    assert snapshot_store['writes'] == [(['btc', 'dust'], balances['block_timestamp'].max())]
+
+    assert_same_pnl(expected, lib.get_pnl_incremental('0xa', balances, ['btc', 'dust']))
+    # only the open interval at the end of the window is computed again
+    assert snapshot_store['computed'][1] == (['btc', 'dust'], pd.Timestamp(now))
+
+
+def test_only_assets_behind_are_computed(snapshot_store):
+    # a window that has closed, so btc is fully persisted by the first request
+    end = now - timedelta(days=1)
+    lib.get_pnl_incremental('0xa', balances, ['btc'], end=end)
+    snapshot_store['computed'].clear()
+
+    expected = lib.get_pnl_batch(balances, ['btc', 'dust'], end=end)
+    snapshot_store['computed'].clear()
+    assert_same_pnl(expected, lib.get_pnl_incremental('0xa', balances, ['btc', 'dust'], end=end))
+    assert [i[0] for i in snapshot_store['computed']] == [['dust']]
@@ -0,0 +1,91 @@
+import threading
+import time
+
+import pytest
+
+from allium import QueryCancelled
+from cache import create_shared
+from jobs import JobQueue, QueueFull
+
+
+def wait_finished(job, timeout=5):
+    deadline = time.monotonic() + timeout
+    while job.status in ('queued', 'running'):
+        assert time.monotonic() < deadline, f"job still {job.status}"
+        time.sleep(0.01)
+    return job
+
+
+def test_cancelled_lookup_ends_cancelled():
+    jobs = JobQueue(workers=1)
+    started = threading.Event()
+
+    def lookup(cancel):
+        started.set()
+        cancel.wait(5)
+        raise QueryCancelled('Lookup cancelled')
+
+    job = jobs.submit('wallet', lookup)
+    assert started.wait(5)
+    jobs.cancel(job.id)
+    assert wait_finished(job).status == 'cancelled'
+    assert job.error is None
+
+
+def test_same_key_shares_one_job():
+    jobs = JobQueue(workers=1)
+    release = threading.Event()
+    runs = []
+
+    def lookup(cancel):
+        runs.append(1)
+        release.wait(5)
+        return {'eth': []}
+
+    job = jobs.submit('wallet', lookup)
+    assert jobs.submit('wallet', lookup) is job
+    release.set()
+    assert wait_finished(job).status == 'success'
+    assert job.to_dict() == {'job_id': job.id, 'status': 'success', 'result': {'eth': []}}
+    assert runs == [1]
+
+
+def test_higher_priority_runs_first_and_full_queue_rejects():
+    jobs = JobQueue(workers=1, maxsize=2)
+    release = threading.Event()
+    order = []
+    blocker = jobs.submit('blocker', lambda cancel: release.wait(5))
+    while blocker.status == 'queued':
+        time.sleep(0.01)
+
+    low = jobs.submit('low', lambda cancel: order.append('low'))
+    high = jobs.submit('high', lambda cancel: order.append('high'), priority=1)
+    with pytest.raises(QueueFull):
+        jobs.submit('extra', lambda cancel: None)
+    release.set()
+    wait_finished(low), wait_finished(high)
+    assert order == ['high', 'low']
+
+
+def test_shared_store_serves_other_processes():
+    store = create_shared('local://', 60, 'pnljob:')
+    runner, other = JobQueue(store=store, poll=0.02), JobQueue(store=store, poll=0.02)
+    started = threading.Event()
+
+    def lookup(cancel):
+        started.set()
+        cancel.wait(5)
+        raise QueryCancelled('Lookup cancelled')
+
+    job = runner.submit('wallet', lookup)
+    assert started.wait(5)
+    # another process returns the running job, deduplicates on it and can cancel it
+    assert other.get(job.id).status == 'running'
+    assert other.submit('wallet', lookup).id == job.id
+    other.cancel(job.id)
+    assert wait_finished(job).status == 'cancelled'
+    deadline = time.monotonic() + 5
+    while other.get(job.id).status != 'cancelled':
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert other.get('unknown') is None
@@ -0,0 +1,56 @@
+from datetime import datetime
+
+import pytest
+
+import lib
+from allium import QueryCancelled
+
+
+def test_get_wallet_data_raises_cancel(monkeypatch):
+    def fetch_wallet(wallet_address, cancel=None):
+        raise QueryCancelled('Lookup cancelled')
+
+    monkeypatch.setattr(lib.allium_client, 'fetch_wallet', fetch_wallet)
+    with pytest.raises(QueryCancelled):
+        lib.get_wallet_data('0xabc')
+
+
+def test_get_wallet_data_failure_returns_none(monkeypatch):
+    def fetch_wallet(wallet_address, cancel=None):
+        raise TimeoutError('Query run timed out')
+
+    monkeypatch.setattr(lib.allium_client, 'fetch_wallet', fetch_wallet)
+    assert lib.get_wallet_data('0xabc') is None
+
+
+def balance_records(*block_timestamps):
+    return [{'token_id': 'eth', 'block_timestamp': i, 'balance': 1.0} for i in block_timestamps]
+
+
+def test_get_wallet_data_keeps_records_after_since(monkeypatch):
+    records = balance_records('2024-01-03T00:00:00', '2024-01-02T00:00:00', '2024-01-01T00:00:00')
+    monkeypatch.setattr(lib, 'ALLIUM_RESULT_LIMIT', 3)
+    monkeypatch.setattr(lib.allium_client, 'fetch_wallet', lambda wallet_address, cancel=None: records)
+    # a full result reaching back to since is complete
+    assert lib.get_wallet_data('0xabc', since=datetime(2024, 1, 1, 12)) == records[:2]
+
+
+def test_get_wallet_data_rejects_truncated_results(monkeypatch):
+    records = balance_records('2024-01-03T00:00:00', '2024-01-02T00:00:00')
+    monkeypatch.setattr(lib, 'ALLIUM_RESULT_LIMIT', 2)
+    monkeypatch.setattr(lib.allium_client, 'fetch_wallet', lambda wallet_address, cancel=None: records)
+    with pytest.raises(ValueError):
+        lib.get_wallet_data('0xabc')
+    with pytest.raises(ValueError):
+        lib.get_wallet_data('0xabc', since=datetime(2024, 1, 1))
+
+
+def test_truncated_refresh_keeps_sync_state(monkeypatch):
+    stored = []
+    monkeypatch.setattr(lib, 'ALLIUM_RESULT_LIMIT', 1)
+    monkeypatch.setattr(lib.allium_client, 'fetch_wallet',
+                        lambda wallet_address, cancel=None: balance_records('2024-01-03T00:00:00'))
+    monkeypatch.setattr(lib, 'store_balances', lambda wallet_address, records: stored.append(records))
+    with pytest.raises(ValueError):
+        lib.refresh_wallet_balances('0xabc', since=datetime(2024, 1, 1))
+    assert stored == []
@@ -0,0 +1,46 @@
+from decimal import Decimal
+
+import pandas as pd
+
+import lib
+from db import precision
+
+
+def test_to_decimal_rounds_to_token_decimals_and_stays_exact(monkeypatch):
+    monkeypatch.setattr(lib, 'asset_decimals', lambda assets: {'usdc': 6, 'eth': 18})
+    merged_prices = pd.DataFrame({
+        'hourly_ts': pd.date_range('2024-01-01', periods=4, freq='1H'),
+        'token_id': ['usdc', 'usdc', 'eth', 'eth'],
+        'balance_actual': [Decimal('1.23456789'), Decimal('2.5'),
+                           Decimal('123456789.123456789123456789'), Decimal('0.1')],
+        'price': [Decimal('0.9999'), Decimal('1.0001'), float('nan'), Decimal('0.3')],
+    })
+    decimal_prices = lib.to_decimal(merged_prices)
+
+    # rounded to 6 decimals, never padded
+    assert str(decimal_prices['balance_actual'][0]) == '1.234568'
+    assert str(decimal_prices['balance_actual'][1]) == '2.5'
+    assert str(decimal_prices['balance_actual'][2]) == '123456789.123456789123456789'
+    assert decimal_prices['usd_value'].tolist() == [Decimal('1.2344445432'), Decimal('2.50025'),
+                                                    None, Decimal('0.03')]
+    # PnL is measured from each asset's first priced value, exactly
+    assert decimal_prices['PnL'].tolist() == [Decimal('0'), Decimal('1.2658054568'), None, None]
+
+
+def test_asset_decimals_caches_missing_rows(monkeypatch):
+    queried = []
+
+    def execute_pd(query, params):
+        queried.append(sorted(params['assets']))
+        return pd.DataFrame({'asset': ['usdc'], 'decimals': [6]})
+
+    monkeypatch.setattr(precision, 'execute_pd', execute_pd)
+    monkeypatch.setattr(precision, '_decimals', {})
+    default = precision.ASSET_DEFAULT_DECIMALS
+
+    assert precision.asset_decimals(['usdc', 'unknown']) == {'usdc': 6, 'unknown': default}
+    assert precision.asset_decimals(['usdc', 'unknown']) == {'usdc': 6, 'unknown': default}
+    assert queried == [['unknown', 'usdc']]
+    # expired lookups are queried again
+    precision.asset_decimals(['unknown'], ttl=0)
+    assert queried == [['unknown', 'usdc'], ['unknown']]
@@ -0,0 +1,80 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from db.price_cache import PriceSeriesCache
+
+job = datetime(2024, 1, 1)
+
+
+class Loader:
+    """
+    Hourly prices encoding the bucket hour, recording every window it is asked for.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, assets, start, end, bucket):
+        self.calls.append((sorted(assets), start, end))
+        hours = pd.date_range(start, end, freq='1H', inclusive='left')
+        return pd.DataFrame({'hourly_ts': np.tile(hours, len(assets)),
+                             'token_id': np.repeat(assets, len(hours)),
+                             'price': np.tile(hours.view(np.int64) / 3.6e12, len(assets))})
+
+
+def expected(assets, start, end):
+    return Loader()(assets, start, end, '1 hour')
+
+
+def assert_prices(prices_df, assets, start, end):
+    pd.testing.assert_frame_equal(
+        prices_df.sort_values(['token_id', 'hourly_ts']).reset_index(drop=True),
+        expected(assets, start, end).sort_values(['token_id', 'hourly_ts']).reset_index(drop=True))
+
+
+def test_covered_window_is_served_from_cache():
+    cache, loader = PriceSeriesCache(), Loader()
+    cache.get(['eth', 'btc'], datetime(2024, 1, 1), datetime(2024, 1, 8), '1 hour', job, loader)
+    prices_df = cache.get(['btc'], datetime(2024, 1, 3), datetime(2024, 1, 4), '1 hour', job, loader)
+    assert len(loader.calls) == 1
+    assert_prices(prices_df, ['btc'], datetime(2024, 1, 3), datetime(2024, 1, 4))
+
+
+def test_miss_loads_only_the_missing_range():
+    cache, loader = PriceSeriesCache(), Loader()
+    # a long historical window followed by a recent one
+    cache.get(['eth'], datetime(2022, 1, 1), datetime(2024, 1, 1), '1 hour', job, loader)
+    prices_df = cache.get(['eth'], datetime(2023, 12, 25), datetime(2024, 1, 2), '1 hour', job, loader)
+    assert loader.calls[1] == (['eth'], datetime(2024, 1, 1), datetime(2024, 1, 2))
+    assert_prices(prices_df, ['eth'], datetime(2023, 12, 25), datetime(2024, 1, 2))
+
+    cache.get(['eth'], datetime(2021, 12, 31), datetime(2022, 1, 2), '1 hour', job, loader)
+    assert loader.calls[2] == (['eth'], datetime(2021, 12, 31), datetime(2022, 1, 1))
+    assert len(loader.calls) == 3
+
+
+def test_disjoint_window_replaces_entry():
+    cache, loader = PriceSeriesCache(), Loader()
+    cache.get(['eth'], datetime(2022, 1, 1), datetime(2022, 1, 2), '1 hour', job, loader)
+    prices_df = cache.get(['eth'], datetime(2024, 1, 1), datetime(2024, 1, 2), '1 hour', job, loader)
+    assert loader.calls[1] == (['eth'], datetime(2024, 1, 1), datetime(2024, 1, 2))
+    assert cache.entries[('eth', '1 hour')][:2] == (pd.Timestamp('2024-01-01').value,
+                                                   pd.Timestamp('2024-01-02').value)
+    assert_prices(prices_df, ['eth'], datetime(2024, 1, 1), datetime(2024, 1, 2))
+
+
+def test_new_job_clears_cache():
+    cache, loader = PriceSeriesCache(), Loader()
+    cache.get(['eth'], datetime(2024, 1, 1), datetime(2024, 1, 2), '1 hour', job, loader)
+    cache.get(['eth'], datetime(2024, 1, 1), datetime(2024, 1, 2), '1 hour', datetime(2024, 1, 2), loader)
+    assert len(loader.calls) == 2
+
+
+def test_lru_eviction_keeps_bytes_bounded():
+    cache, loader = PriceSeriesCache(max_bytes=24 * 16 * 2), Loader()
+    for asset in ['a', 'b', 'c']:
+        cache.get([asset], datetime(2024, 1, 1), datetime(2024, 1, 2), '1 hour', job, loader)
+    assert list(cache.entries) == [('b', '1 hour'), ('c', '1 hour')]
+    assert cache.stats()['evictions'] == 1
@@ -0,0 +1,67 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from db import prices
+from db.price_store import PriceStore, write_generation, write_series
+
+job = datetime(2024, 1, 3, 1, 2, 3, 456789)
+hours = pd.date_range('2024-01-01', periods=48, freq='1H')
+
+
+@pytest.fixture
+def store(tmp_path):
+    for asset in ['eth', 'usd/c']:
+        write_series(str(tmp_path), '1h', asset, pd.DataFrame({'bucket_ts': hours, 'price': np.arange(48.0)}))
+    write_generation(str(tmp_path), job)
+    return PriceStore(str(tmp_path), max_maps=1)
+
+
+def test_read_slices_and_rebuckets(store):
+    prices_df, missing = store.read(['eth', 'usd/c', 'btc'], datetime(2024, 1, 1, 5),
+                                    datetime(2024, 1, 2, 12), '1 day', '1h')
+    assert missing == ['btc']
+    # the last price of each day within the window
+    assert prices_df.to_dict('list') == {
+        'hourly_ts': [pd.Timestamp('2024-01-01'), pd.Timestamp('2024-01-02')] * 2,
+        'token_id': ['eth', 'eth', 'usd/c', 'usd/c'],
+        'price': [23.0, 35.0, 23.0, 35.0]}
+
+
+def test_replaced_series_is_reopened(store, tmp_path):
+    assert store.read(['eth'], hours[0], hours[1], '1 hour', '1h')[0]['price'].tolist() == [0.0]
+    write_series(str(tmp_path), '1h', 'eth', pd.DataFrame({'bucket_ts': hours, 'price': 7.0}))
+    assert store.read(['eth'], hours[0], hours[1], '1 hour', '1h')[0]['price'].tolist() == [7.0]
+
+
+def test_mappings_are_bounded(store):
+    store.series('1h', 'eth')
+    store.series('1h', 'usd/c')
+    assert len(store.maps) == 1
+
+
+def test_only_current_generation_is_trusted(store, tmp_path):
+    assert store.is_current(job)
+    assert not store.is_current(datetime(2024, 1, 4))
+    assert not store.is_current(None)
+    store.series('1h', 'eth')
+    write_generation(str(tmp_path), datetime(2024, 1, 4))
+    assert not store.is_current(job)
+    assert store.maps == {}
+
+
+def test_stale_store_falls_back_to_cache(store, monkeypatch):
+    fallback = []
+    monkeypatch.setattr(prices, 'price_store', store)
+    monkeypatch.setattr(prices, 'cached_prices', lambda assets, start, end, bucket: fallback.append(assets)
+                        or pd.DataFrame(columns=['hourly_ts', 'token_id', 'price']))
+
+    monkeypatch.setattr(prices, 'latest_job_ts', lambda: datetime(2024, 1, 4))
+    prices.fetch_prices(['eth'], hours[0], hours[2])
+    assert fallback == [['eth']]
+
+    monkeypatch.setattr(prices, 'latest_job_ts', lambda: job)
+    assert len(prices.fetch_prices(['eth'], hours[0], hours[2])) == 2
+    assert fallback == [['eth']]
@@ -0,0 +1,40 @@
+import pytest
+
+from db import rate_limit
+from db.rate_limit import TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limit, 'time', fake)
+    return fake
+
+
+def test_burst_then_refill_rate(clock):
+    bucket = TokenBucket(rate_per_minute=60, capacity=3)
+    waits = [bucket.acquire() for _ in range(5)]
+    # the burst is served from capacity, later tokens arrive once per second
+    assert waits[:3] == [0, 0, 0]
+    assert waits[3:] == pytest.approx([1, 1])
+    assert clock.now == pytest.approx(102)
+
+
+def test_pause_blocks_and_drains(clock):
+    bucket = TokenBucket(rate_per_minute=60, capacity=3)
+    bucket.pause(10)
+    assert bucket.acquire() == pytest.approx(11)
+    assert bucket.acquire() == pytest.approx(1)
@@ -0,0 +1,26 @@
+from datetime import datetime
+
+from api import parse_window_args
+from lib import build_grid
+
+
+def test_aware_start_naive_end():
+    interval, start, end = parse_window_args(
+        {'start': '2024-01-01T00:00:00Z', 'end': '2024-01-02T00:00:00'})
+    assert start == datetime(2024, 1, 1) and start.tzinfo is None
+    assert end == datetime(2024, 1, 2)
+
+    grid = build_grid(interval, start, end)
+    assert grid.tz is None
+    assert len(grid) == 25
+
+
+def test_naive_start_aware_end():
+    interval, start, end = parse_window_args(
+        {'start': '2024-01-01T00:00:00', 'end': '2024-01-02T02:00:00+02:00'})
+    assert start == datetime(2024, 1, 1)
+    assert end == datetime(2024, 1, 2) and end.tzinfo is None
+
+    grid = build_grid(interval, start, end)
+    assert grid.tz is None
+    assert grid[-1] == datetime(2024, 1, 2)
@@ -0,0 +1,5 @@
+"""
+WSGI entry point for production serving, e.g.:
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+from api import app